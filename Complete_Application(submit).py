@@ -1,19 +1,530 @@
+import atexit
+import datetime
+import logging
+import time
+
+import click
 import mysql.connector
-from flask import Flask, jsonify, request, render_template
+from flask import Flask, Response, g, has_request_context, jsonify, request, render_template
+from flask.json.provider import DefaultJSONProvider
+
+import inventory
+import loans
+import recommendations
+import rollups
+import statements
+from bulk_operations import add_cart_items, parse_cart_items, register_users, remove_cart_items, return_books
+from cart_store import CartNotFoundError, CartStore
+from catalog_cache import CatalogCache, LocalVersionStore, RedisVersionStore
+from catalog_import import CatalogImporter, CatalogImportError, detect_format, iter_records
+from catalog_search import MIN_TOKEN_LENGTH, search_books, split_terms
+from checkout_engine import CheckoutError, checkout_cart, checkout_cart_slots
+from db_pool import ConnectionPool, PoolTimeoutError
+from db_router import ReplicaRouter
+from event_writer import CART_ADD, CART_REMOVE, EventWriter
+from http_cache import compress_response, make_etag, matching_etag, negotiate_encoding
+from metrics import InstrumentedCursor, Metrics
+from migrations import LATEST_VERSION, current_version, migrate
+from report_summaries import fetch_top_loans, forget_book, rebuild_summaries, record_cart_add, record_cart_remove
+from serializers import Table, negotiate_format, render
+from settings import Settings
+from slow_queries import SlowQueryLog
+
+
+class LibraryJSONProvider(DefaultJSONProvider):
+    # DATE and DATETIME columns are sent as ISO 8601 rather than Flask's default HTTP date format
+    @staticmethod
+    def default(o):
+        if isinstance(o, (datetime.date, datetime.datetime)):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
+
+
+logger = logging.getLogger('library.app')
 
 app = Flask(__name__)
+app.json = LibraryJSONProvider(app)
+
+# Every *_config dict below can be overridden from a config file and the environment (see settings.py)
+settings = Settings()
 
 # Database configuration
-db_config = {
+db_config = settings.section('db', {
     'host': 'localhost',
     'user': 'user',
     'password': 'password',
     'database': 'library'
-}
+})
+
+# Connection pool configuration (timeouts and ages are in seconds)
+pool_config = settings.section('pool', {
+    'size': 10,
+    'timeout': 5.0,
+    'recycle': 1800,
+    'ping_interval': 30,
+    # Run the hot routes' SQL (statements.py) as server-side prepared statements cached per connection
+    'prepare_statements': True
+})
+
+# Request instrumentation; 'timing_header' adds Server-Timing and X-DB-Queries headers to responses
+metrics_config = settings.section('metrics', {
+    'enabled': True,
+    'timing_header': False
+})
+
+# Opt-in slow-query log; 'explain' captures an EXPLAIN plan for each new slow query shape
+slow_query_config = settings.section('slow_query', {
+    'enabled': False,
+    'threshold_ms': 200.0,
+    'explain': True
+})
+
+request_metrics = Metrics()
+slow_query_log = SlowQueryLog(slow_query_config['threshold_ms'],
+                              explain_connection=(lambda: db_pool.acquire()) if slow_query_config['explain'] else None)
+
+
+def record_statement(operation, params, seconds, many):
+    if seconds < slow_query_log.threshold:
+        return
+    route = request.url_rule.rule if has_request_context() and request.url_rule else 'background'
+    slow_query_log.record(operation, params, seconds, route, many)
+
+
+cursor_listeners = (record_statement,) if slow_query_config['enabled'] else ()
+
+
+def wrap_cursor(cursor):
+    return InstrumentedCursor(cursor, cursor_listeners)
+
+
+instrument_cursors = metrics_config['enabled'] or slow_query_config['enabled']
+db_pool = ConnectionPool(db_config, **pool_config, cursor_wrapper=wrap_cursor if instrument_cursors else None)
+
+# Read replicas: each entry overrides db_config keys, e.g. {'name': 'replica1', 'host': '10.0.0.2'}.
+# Read-only routes are spread over replicas less than 'max_lag' seconds behind (None disables the
+# check), and a client that wrote is pinned to the primary for 'sticky_seconds'. Reads of tables
+# written within 'max_lag' go to the primary; the write times come from the catalog version store,
+# which the redis cache backend shares between workers.
+replica_config = settings.section('replica', {
+    'replicas': [],
+    'max_lag': 5.0,
+    'check_interval': 2.0,
+    'sticky_seconds': 10
+})
+
+replica_router = ReplicaRouter(
+    db_pool,
+    {replica.get('name', replica.get('host')): ConnectionPool(
+        dict(db_config, **{key: value for key, value in replica.items() if key != 'name'}), **pool_config,
+        cursor_wrapper=wrap_cursor if instrument_cursors else None)
+     for replica in replica_config['replicas']},
+    replica_config['max_lag'], replica_config['check_interval'],
+    write_times=lambda tables: version_store.last_written(tables))
+replica_router.start()
+
+# Cookie marking a client that recently wrote, so its next reads see its own writes
+PRIMARY_COOKIE = 'library_primary_until'
+
+# Catalog read cache; set 'backend' to 'redis' to share invalidations between workers
+cache_config = settings.section('cache', {
+    'max_entries': 10000,
+    'ttl': 300.0,
+    'backend': 'local',
+    'redis_url': 'redis://localhost:6379/0'
+})
+
+if cache_config['backend'] == 'redis':
+    version_store = RedisVersionStore(cache_config['redis_url'])
+else:
+    version_store = LocalVersionStore()
+catalog_cache = CatalogCache(cache_config['max_entries'], cache_config['ttl'], version_store)
+
+# Conditional GET for catalog reads and compression of response bodies of at least 'compress_min_bytes'
+http_config = settings.section('http', {
+    'etags': True,
+    'compression': True,
+    'compress_min_bytes': 1024,
+    'gzip_level': 6,
+    'brotli_quality': 5
+})
+
+# Cart storage: 'db' reads and writes Cart_Items on every call, 'write-back' keeps active carts
+# in memory and writes them out on checkout, eviction and shutdown. 'durability' is 'none',
+# 'journal' or 'fsync' (see cart_store.py). Write-back carts are per process, so use 'db' when
+# several workers serve the same carts.
+cart_config = settings.section('cart', {
+    'mode': 'db',
+    'max_carts': 10000,
+    'idle_timeout': 900,
+    'durability': 'journal',
+    'journal_path': 'cart_journal.log'
+})
+
+# Sharded inventory (see inventory.py): with 'enabled', checkouts take copies from
+# Inventory_Slots instead of decrementing Books.bookCount. A 'reservation_ttl' above zero
+# holds a copy for that many seconds when a book is added to a 'db' mode cart, and the
+# reaper returns expired reservations every 'reaper_interval' seconds.
+inventory_config = settings.section('inventory', {
+    'enabled': False,
+    'slots': inventory.DEFAULT_SLOTS,
+    'reservation_ttl': 0,
+    'reaper_interval': 30
+})
+
+# Loan rollups behind /reports/top, /reports/trends and /reports/genres (see rollups.py). The
+# aggregator folds new transactions in every 'interval' seconds, leaving the last
+# 'settle_seconds' of loans for the next run.
+rollup_config = settings.section('rollup', {
+    'enabled': True,
+    'interval': 60,
+    'batch_size': 50000,
+    'settle_seconds': 60
+})
+
+# Co-borrow recommendations (see recommendations.py): the updater applies new transactions
+# every 'interval' seconds and keeps the top 'neighbours' similar books per book.
+recommendation_config = settings.section('recommendation', {
+    'enabled': True,
+    'interval': 60,
+    'batch_size': 50000,
+    'neighbours': recommendations.DEFAULT_NEIGHBOURS
+})
+
+# Group commit for summary rows (see event_writer.py): with 'enabled', checkouts commit only the
+# inventory change and their Transactions rows, and queue their summary updates, along with cart
+# analytics, for a background writer that commits up to 'batch_size' rows at a time after
+# waiting at most 'linger' seconds. A full queue ('max_queue' batches) makes callers wait up
+# to 'put_timeout' seconds and then write their events themselves.
+event_config = settings.section('event', {
+    'enabled': False,
+    'batch_size': 500,
+    'linger': 0.005,
+    'max_queue': 10000,
+    'put_timeout': 1.0
+})
+
+# Loans (see loans.py): a loan is overdue 'loan_days' days after it was borrowed. The
+# rotate-transactions command keeps 'keep_months' monthly partitions of Transactions,
+# creates them 'months_ahead' months in advance and, with an 'export_dir', writes retired
+# months there as gzip'd CSV instead of copying them to Transactions_Archive.
+loan_config = settings.section('loan', {
+    'loan_days': 14,
+    'keep_months': 24,
+    'months_ahead': 3,
+    'export_dir': None
+})
+
+# Per-process startup and shutdown (see server.py). warm_up() opens 'warm_connections' pool
+# connections (None: the whole pool) and, with 'warm_cache', loads the book list into the
+# catalog cache. 'background_jobs' runs the reservation reaper, rollup aggregator and
+# recommendation updater in this process; the launcher keeps them to one worker.
+worker_config = settings.section('worker', {
+    'warm_connections': None,
+    'warm_cache': True,
+    'background_jobs': True
+})
+
+# With sharded inventory Books.bookCount is not kept up to date, so catalog reads take the
+# count from Inventory_Slots and Reservations (see inventory.py)
+if inventory_config['enabled']:
+    BOOKS_ALL = statements.BOOKS_ALL_SLOTS
+    BOOKS_PAGE = statements.BOOKS_PAGE_SLOTS
+    BOOKS_BY_IDS = statements.BOOKS_BY_IDS_SLOTS
+    BOOK_COLUMNS = statements.SLOT_BOOK_COLUMNS
+    STOCK_TABLES = ('Inventory_Slots', 'Reservations')
+else:
+    BOOKS_ALL = statements.BOOKS_ALL
+    BOOKS_PAGE = statements.BOOKS_PAGE
+    BOOKS_BY_IDS = statements.BOOKS_BY_IDS
+    BOOK_COLUMNS = 'b.*'
+    STOCK_TABLES = ()
+
+# Tables each cached read depends on
+BOOK_LIST_TABLES = ('Books',) + STOCK_TABLES
+BOOK_DETAIL_TABLES = ('Books', 'Authors', 'Genres', 'Book_Authors', 'Book_Genres') + STOCK_TABLES
+BOOK_SEARCH_TABLES = BOOK_DETAIL_TABLES + ('Publishers',)
+
+
+def get_db_connection(readonly=False, tables=()):
+    # Borrow a pooled connection; calling close() on it hands it back to the pool.
+    # readonly connections may come from a replica; tables are the ones the read depends on.
+    pool = db_pool
+    if readonly and not pinned_to_primary():
+        pool = replica_router.read_pool(tables)
+    start = time.perf_counter()
+    connection = pool.acquire()
+    request_metrics.record_acquire(time.perf_counter() - start)
+    return connection
+
+
+def pinned_to_primary():
+    if not has_request_context():
+        return False
+    try:
+        return float(request.cookies.get(PRIMARY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def invalidate_catalog(tables):
+    catalog_cache.invalidate(tables)
+    replica_router.note_write(tables)
+
+
+def require_shared_versions(server_stopped):
+    # A CLI command runs in its own process: with the local backend its invalidation never reaches a
+    # running server, which keeps serving (and answering 304 for) the old catalog. A restarted server
+    # starts a new epoch, so the local backend is only safe while the server is stopped.
+    if cache_config['backend'] != 'redis' and not server_stopped:
+        raise click.UsageError("This command changes the catalog, and with cache backend 'local' running servers "
+                               "never see the change. Set cache.backend to 'redis', or stop the servers and pass "
+                               "--server-stopped.")
+
+
+server_stopped_option = click.option('--server-stopped', is_flag=True,
+                                     help="No server is running (only needed with cache backend 'local').")
+
+
+cart_store = None
+if cart_config['mode'] == 'write-back':
+    cart_store = CartStore(get_db_connection, cart_config['max_carts'], cart_config['idle_timeout'],
+                           cart_config['durability'], cart_config['journal_path'])
+    atexit.register(cart_store.flush_all)
+
+reservations_enabled = inventory_config['enabled'] and inventory_config['reservation_ttl'] > 0
+reservation_reaper = inventory.ReservationReaper(get_db_connection, inventory_config['reaper_interval'])
+if reservations_enabled and worker_config['background_jobs']:
+    reservation_reaper.start()
+
+rollup_aggregator = rollups.RollupAggregator(get_db_connection, rollup_config['interval'],
+                                             rollup_config['batch_size'], rollup_config['settle_seconds'])
+if rollup_config['enabled'] and worker_config['background_jobs']:
+    rollup_aggregator.start()
+
+recommendation_updater = recommendations.RecommendationUpdater(
+    get_db_connection, recommendation_config['interval'], recommendation_config['batch_size'],
+    rollup_config['settle_seconds'], recommendation_config['neighbours'])
+if recommendation_config['enabled'] and worker_config['background_jobs']:
+    recommendation_updater.start()
+
+event_writer = None
+if event_config['enabled']:
+    event_writer = EventWriter(get_db_connection, event_config['batch_size'], event_config['linger'],
+                               event_config['max_queue'], event_config['put_timeout'])
+    event_writer.start()
+    # Write out whatever is still queued at shutdown
+    atexit.register(event_writer.close)
+
+
+def warm_up():
+    """Opens pool connections and fills the catalog cache before the process takes requests."""
+    try:
+        opened = db_pool.warm(worker_config['warm_connections'])
+        for pool in replica_router.replicas.values():
+            pool.warm(worker_config['warm_connections'])
+        books = 0
+        if worker_config['warm_cache']:
+            # The same entry an unpaged /books/all reads
+            books = len(catalog_cache.get_or_load(('books/all', 0, None), BOOK_LIST_TABLES,
+                                                  lambda: load_books(0, None)))
+        logger.info("Warmed up %s connections and %s cached books", opened, books)
+    except Exception as e:
+        # A cold worker still serves; its first requests just pay for the connects and loads
+        logger.warning("Warm-up failed: %s", e)
+
+
+def shutdown():
+    """Stops the background threads and writes out queued events and write-back carts."""
+    for job in (reservation_reaper, rollup_aggregator, recommendation_updater, replica_router):
+        job.stop()
+    if event_writer is not None:
+        event_writer.close()
+    if cart_store is not None:
+        cart_store.flush_all()
+
+
+@app.before_request
+def start_request_metrics():
+    if metrics_config['enabled']:
+        g.request_stats, g.request_stats_token = request_metrics.start_request()
+
+
+@app.after_request
+def record_request_metrics(response):
+    stats = g.pop('request_stats', None)
+    if stats is None:
+        return response
+
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    elapsed = request_metrics.finish_request(stats, route, request.method, response.status_code)
+    if metrics_config['timing_header']:
+        response.headers['Server-Timing'] = (f"acquire;dur={stats.acquire_time * 1000:.2f}, "
+                                             f"db;dur={stats.db_time * 1000:.2f}, "
+                                             f"total;dur={elapsed * 1000:.2f}")
+        response.headers['X-DB-Queries'] = str(stats.queries)
+    return response
+
+
+@app.after_request
+def pin_writers_to_primary(response):
+    if replica_router.replicas and request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+        response.set_cookie(PRIMARY_COOKIE, str(time.time() + replica_config['sticky_seconds']),
+                            max_age=replica_config['sticky_seconds'], httponly=True)
+    return response
+
+
+@app.after_request
+def compress_body(response):
+    if not http_config['compression']:
+        return response
+    return compress_response(response, negotiate_encoding(request.accept_encodings),
+                             http_config['compress_min_bytes'], http_config['gzip_level'],
+                             http_config['brotli_quality'])
+
+
+def catalog_etag(key, tables):
+    """
+    Returns (etag, response). response is a ready 304 when the client's copy is current,
+    which is decided from the table versions alone, before any query runs.
+    """
+    if not http_config['etags']:
+        return None, None
+    etag = make_etag(version_store.epoch, key, catalog_cache.versions.get(tables))
+    encoding = negotiate_encoding(request.accept_encodings) if http_config['compression'] else None
+    matched = matching_etag(request.if_none_match, etag, encoding)
+    if matched is None:
+        return etag, None
+    response = Response(status=304)
+    response.set_etag(matched)
+    response.cache_control.no_cache = True
+    if http_config['compression']:
+        response.vary.add('Accept-Encoding')
+    return etag, response
+
+
+def table_response(table, fmt, json_body=None, extra=None, etag=None):
+    # Encodes rows in the format negotiated from the Accept header (see serializers.py)
+    response = Response(render(table, fmt, json_body, extra), mimetype=fmt)
+    response.vary.add('Accept')
+    return with_etag(response, etag)
+
+
+def with_etag(response, etag):
+    if etag is not None:
+        response.set_etag(etag)
+        # Let clients keep the body but revalidate it on every use
+        response.cache_control.no_cache = True
+    return response
+
+
+@app.teardown_request
+def end_request_metrics(exc):
+    token = g.pop('request_stats_token', None)
+    if token is not None:
+        request_metrics.end_request(token)
+
+
+@app.route('/debug/slow_queries', methods=['GET'])
+def slow_queries():
+    if not slow_query_config['enabled']:
+        return jsonify({"error": "The slow-query log is disabled."}), 404
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer."}), 400
+    return jsonify({
+        "threshold_ms": slow_query_config['threshold_ms'],
+        "shapes": slow_query_log.worst(limit)
+    })
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    pool = db_pool.stats()
+    cache = catalog_cache.stats()
+    gauges = [
+        ('library_db_pool_connections', 'Pooled connections by state.',
+         {f'state="{state}"': pool[state] for state in ('open', 'in_use', 'idle')}),
+        ('library_catalog_cache_entries', 'Entries held by the catalog cache.', {'': cache['entries']})
+    ]
+    counters = [
+        ('library_db_pool_acquires_total', 'Connections borrowed from the pool.', {'': pool['borrowed']}),
+        ('library_db_pool_waits_total', 'Borrows that had to wait for a free connection.', {'': pool['waits']}),
+        ('library_db_pool_wait_seconds_total', 'Time borrowers spent waiting.', {'': pool['wait_time']}),
+        ('library_db_pool_timeouts_total', 'Borrows that gave up waiting.', {'': pool['timeouts']}),
+        ('library_db_pool_recycled_total', 'Connections replaced for age or a failed ping.', {'': pool['recycled']}),
+        ('library_catalog_cache_events_total', 'Catalog cache lookups and removals by outcome.',
+         {f'event="{event}"': cache[event] for event in ('hits', 'misses', 'evictions', 'expirations',
+                                                         'invalidations')})
+    ]
+    if replica_router.replicas:
+        replicas = replica_router.stats()["replicas"]
+        gauges.append(('library_db_replica_lag_seconds', 'Replication lag last seen per replica.',
+                       {f'replica="{name}"': status['lag'] for name, status in replicas.items()
+                        if status['lag'] is not None}))
+        gauges.append(('library_db_replica_in_rotation', 'Whether a replica is serving reads.',
+                       {f'replica="{name}"': int(status['in_rotation']) for name, status in replicas.items()}))
+    if cart_store is not None:
+        carts = cart_store.stats()
+        gauges.append(('library_cart_store_carts', 'Carts held in memory, and those with unflushed changes.',
+                       {'state="cached"': carts['carts'], 'state="dirty"': carts['dirty']}))
+    if event_writer is not None:
+        events = event_writer.stats()
+        gauges.append(('library_event_writer_queued', 'Event batches waiting for the group-commit writer.',
+                       {'': events['queued']}))
+        counters.append(('library_event_writer_events_total', 'Events by outcome.',
+                         {f'outcome="{outcome}"': events[outcome] for outcome in ('submitted', 'written', 'dropped')}))
+    return Response(request_metrics.render(gauges, counters), mimetype='text/plain; version=0.0.4')
+
+
+@app.errorhandler(PoolTimeoutError)
+def pool_timeout(e):
+    return jsonify({"error": str(e)}), 503
+
+
+@app.route('/stats/pool', methods=['GET'])
+def pool_stats():
+    return jsonify(db_pool.stats())
+
+
+@app.route('/stats/replicas', methods=['GET'])
+def replica_stats():
+    return jsonify(replica_router.stats())
 
 
-def get_db_connection():
-    return mysql.connector.connect(**db_config)
+@app.route('/stats/cache', methods=['GET'])
+def cache_stats():
+    return jsonify(catalog_cache.stats())
+
+
+@app.route('/stats/carts', methods=['GET'])
+def cart_stats():
+    if cart_store is None:
+        return jsonify({"mode": cart_config['mode']})
+    return jsonify(dict(cart_store.stats(), mode=cart_config['mode']))
+
+
+@app.route('/stats/events', methods=['GET'])
+def event_stats():
+    if event_writer is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(event_writer.stats(), enabled=True))
+
+
+@app.route('/stats/rollups', methods=['GET'])
+def rollup_stats():
+    connection = None
+    try:
+        connection = get_db_connection(readonly=True)
+        watermark = rollups.fetch_watermark(connection.cursor())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if connection:
+            connection.close()
+    return jsonify({"enabled": rollup_config['enabled'], "watermark": watermark,
+                    "aggregated": rollup_aggregator.aggregated})
 
 
 @app.route('/initialize_db', methods=['POST'])
@@ -27,104 +538,135 @@ def create_tables():
 
 def initialize_db():
     connection = get_db_connection()
-    cur = connection.cursor()
-
-    # Create Authors Table
-    cur.execute('''CREATE TABLE IF NOT EXISTS Authors (
-                    authorID INTEGER PRIMARY KEY AUTO_INCREMENT,
-                    name VARCHAR(255) NOT NULL,
-                    bio VARCHAR(255))''')
-
-    # Create Genres Table
-    cur.execute('''CREATE TABLE IF NOT EXISTS Genres (
-                    genreID INTEGER PRIMARY KEY AUTO_INCREMENT,
-                    genreName VARCHAR(255) NOT NULL)''')
-
-    # Create Publishers Table
-    cur.execute('''CREATE TABLE IF NOT EXISTS Publishers (
-                    publisherID INTEGER PRIMARY KEY AUTO_INCREMENT,
-                    publisherName VARCHAR(255) NOT NULL,
-                    contactInfo VARCHAR(255),
-                    INDEX (publisherName))''')
-
-    # Create Books Table
-    cur.execute('''CREATE TABLE IF NOT EXISTS Books (
-                    bookID INTEGER PRIMARY KEY AUTO_INCREMENT,
-                    title VARCHAR(255) NOT NULL,
-                    publicationDate VARCHAR(255),
-                    publisherID INTEGER,
-                    availabilityStatus TINYINT(1) DEFAULT TRUE,
-                    bookCount INTEGER DEFAULT 1,
-                    FOREIGN KEY (publisherID) REFERENCES Publishers(publisherID),
-                    INDEX (title),
-                    INDEX (publicationDate),
-                    INDEX (publisherID))''')
-
-    # Create Users Table
-    cur.execute('''CREATE TABLE IF NOT EXISTS Users (
-                    userID INTEGER PRIMARY KEY AUTO_INCREMENT,
-                    name VARCHAR(255) NOT NULL,
-                    contactDetails VARCHAR(255),
-                    borrowingHistory VARCHAR(255),
-                    preferences VARCHAR(255),
-                    INDEX (name),
-                    INDEX (contactDetails))''')
-
-    # Create Transactions Table
-    cur.execute('''CREATE TABLE IF NOT EXISTS Transactions (
-                    transactionID INTEGER PRIMARY KEY AUTO_INCREMENT,
-                    userID INTEGER,
-                    bookID INTEGER,
-                    borrowDate VARCHAR(255),
-                    returnDate VARCHAR(255),
-                    FOREIGN KEY (userID) REFERENCES Users(userID),
-                    FOREIGN KEY (bookID) REFERENCES Books(bookID),
-                    INDEX (userID),
-                    INDEX (bookID))''')
-
-    # Create Book_Authors Table
-    cur.execute('''CREATE TABLE IF NOT EXISTS Book_Authors (
-                    bookID INTEGER,
-                    authorID INTEGER,
-                    PRIMARY KEY (bookID, authorID),
-                    FOREIGN KEY (bookID) REFERENCES Books(bookID),
-                    FOREIGN KEY (authorID) REFERENCES Authors(authorID),
-                    INDEX (bookID),
-                    INDEX (authorID))''')
-
-    # Create Book_Genres Table
-    cur.execute('''CREATE TABLE IF NOT EXISTS Book_Genres (
-                    bookID INTEGER,
-                    genreID INTEGER,
-                    PRIMARY KEY (bookID, genreID),
-                    FOREIGN KEY (bookID) REFERENCES Books(bookID),
-                    FOREIGN KEY (genreID) REFERENCES Genres(genreID),
-                    INDEX (bookID),
-                    INDEX (genreID))''')
-
-    # Create Cart Table
-    cur.execute('''CREATE TABLE IF NOT EXISTS Cart (
-                        cartID INTEGER PRIMARY KEY AUTO_INCREMENT,
+    try:
+        cur = connection.cursor()
+
+        # Create Authors Table
+        cur.execute('''CREATE TABLE IF NOT EXISTS Authors (
+                        authorID INTEGER PRIMARY KEY AUTO_INCREMENT,
+                        name VARCHAR(255) NOT NULL,
+                        bio VARCHAR(255))''')
+
+        # Create Genres Table
+        cur.execute('''CREATE TABLE IF NOT EXISTS Genres (
+                        genreID INTEGER PRIMARY KEY AUTO_INCREMENT,
+                        genreName VARCHAR(255) NOT NULL)''')
+
+        # Create Publishers Table
+        cur.execute('''CREATE TABLE IF NOT EXISTS Publishers (
+                        publisherID INTEGER PRIMARY KEY AUTO_INCREMENT,
+                        publisherName VARCHAR(255) NOT NULL,
+                        contactInfo VARCHAR(255),
+                        INDEX (publisherName))''')
+
+        # Create Books Table
+        cur.execute('''CREATE TABLE IF NOT EXISTS Books (
+                        bookID INTEGER PRIMARY KEY AUTO_INCREMENT,
+                        title VARCHAR(255) NOT NULL,
+                        publicationDate VARCHAR(255),
+                        publisherID INTEGER,
+                        availabilityStatus TINYINT(1) DEFAULT TRUE,
+                        bookCount INTEGER DEFAULT 1,
+                        FOREIGN KEY (publisherID) REFERENCES Publishers(publisherID),
+                        INDEX (title),
+                        INDEX (publicationDate),
+                        INDEX (publisherID))''')
+
+        # Create Users Table
+        cur.execute('''CREATE TABLE IF NOT EXISTS Users (
+                        userID INTEGER PRIMARY KEY AUTO_INCREMENT,
+                        name VARCHAR(255) NOT NULL,
+                        contactDetails VARCHAR(255),
+                        borrowingHistory VARCHAR(255),
+                        preferences VARCHAR(255),
+                        INDEX (name),
+                        INDEX (contactDetails))''')
+
+        # Create Transactions Table
+        cur.execute('''CREATE TABLE IF NOT EXISTS Transactions (
+                        transactionID INTEGER PRIMARY KEY AUTO_INCREMENT,
                         userID INTEGER,
+                        bookID INTEGER,
+                        borrowDate VARCHAR(255),
+                        returnDate VARCHAR(255),
                         FOREIGN KEY (userID) REFERENCES Users(userID),
-                        INDEX (userID))''')
+                        FOREIGN KEY (bookID) REFERENCES Books(bookID),
+                        INDEX (userID),
+                        INDEX (bookID))''')
 
-    # Create Cart_Items Table
-    cur.execute('''CREATE TABLE IF NOT EXISTS Cart_Items (
-                        cartID INTEGER,
+        # Create Book_Authors Table
+        cur.execute('''CREATE TABLE IF NOT EXISTS Book_Authors (
                         bookID INTEGER,
-                        bookName VARCHAR(255),
-                        PRIMARY KEY (cartID, bookID),
-                        FOREIGN KEY (cartID) REFERENCES Cart(cartID),
+                        authorID INTEGER,
+                        PRIMARY KEY (bookID, authorID),
                         FOREIGN KEY (bookID) REFERENCES Books(bookID),
-                        INDEX (cartID),
-                        INDEX (bookID))''')
+                        FOREIGN KEY (authorID) REFERENCES Authors(authorID),
+                        INDEX (bookID),
+                        INDEX (authorID))''')
+
+        # Create Book_Genres Table
+        cur.execute('''CREATE TABLE IF NOT EXISTS Book_Genres (
+                        bookID INTEGER,
+                        genreID INTEGER,
+                        PRIMARY KEY (bookID, genreID),
+                        FOREIGN KEY (bookID) REFERENCES Books(bookID),
+                        FOREIGN KEY (genreID) REFERENCES Genres(genreID),
+                        INDEX (bookID),
+                        INDEX (genreID))''')
+
+        # Create Cart Table
+        cur.execute('''CREATE TABLE IF NOT EXISTS Cart (
+                            cartID INTEGER PRIMARY KEY AUTO_INCREMENT,
+                            userID INTEGER,
+                            FOREIGN KEY (userID) REFERENCES Users(userID),
+                            INDEX (userID))''')
+
+        # Create Cart_Items Table
+        cur.execute('''CREATE TABLE IF NOT EXISTS Cart_Items (
+                            cartID INTEGER,
+                            bookID INTEGER,
+                            bookName VARCHAR(255),
+                            PRIMARY KEY (cartID, bookID),
+                            FOREIGN KEY (cartID) REFERENCES Cart(cartID),
+                            FOREIGN KEY (bookID) REFERENCES Books(bookID),
+                            INDEX (cartID),
+                            INDEX (bookID))''')
+
+        connection.commit()
 
-    connection.commit()
-    connection.close()
+        # Bring the tables above up to the latest schema version
+        migrate(connection, slots=inventory_config['slots'])
+    finally:
+        connection.close()
     print("Database initialized and tables created")
 
 
+@app.cli.command('migrate')
+@click.option('--target', type=int, default=None, help='Stop after this schema version.')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows copied per batch by column changes.')
+def migrate_command(target, batch_size):
+    """Apply pending schema migrations."""
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    connection = get_db_connection()
+    try:
+        applied = migrate(connection, target, batch_size, slots=inventory_config['slots'])
+        version = current_version(connection.cursor())
+    finally:
+        connection.close()
+    print(f"Applied migrations {applied}; schema is at version {version} (latest {LATEST_VERSION})")
+
+
+@app.cli.command('schema-version')
+def schema_version_command():
+    """Show the applied schema version."""
+    connection = get_db_connection()
+    try:
+        version = current_version(connection.cursor())
+    finally:
+        connection.close()
+    print(f"Schema is at version {version} (latest {LATEST_VERSION})")
+
+
 @app.route('/')
 def home():
     return render_template('index.html')
@@ -141,61 +683,67 @@ def populate_db():
 
 def insert_data():
     connection = get_db_connection()
-    cur = connection.cursor()
-
-    # Inserting Authors
-    authors = [
-        ('J.K. Rowling', 'British author known for the Harry Potter series.'),
-        ('George R.R. Martin', 'American novelist known for the A Song of Ice and Fire series.'),
-        ('Rick Riordan', 'American author known for the Percy Jackson & the Olympians series.'),
-        ('Suzanne Collins', 'American author known for The Hunger Games series.'),
-        ('Markus Zusak', 'Australian author known for The Book Thief.')
-    ]
-    cur.executemany("INSERT INTO Authors (name, bio) VALUES (%s, %s)", authors)
-
-    # Inserting Genres
-    genres = [('Fantasy',), ('Adventure',), ('Dystopian',), ('Historical Fiction',)]
-    cur.executemany("INSERT INTO Genres (genreName) VALUES (%s)", genres)
-
-    # Inserting Publishers
-    publishers = [
-        ('Bloomsbury', 'London, UK'),
-        ('Bantam Books', 'New York, USA'),
-        ('Disney Hyperion', 'New York, USA'),
-        ('Scholastic', 'Pennsylvania, USA'),
-        ('Picador', 'London, UK')
-    ]
-    cur.executemany("INSERT INTO Publishers (publisherName, contactInfo) VALUES (%s, %s)", publishers)
-
-    # Inserting Books
-    books = [
-        ('Harry Potter and the Philosopher\'s Stone', '1997-06-26', 1),
-        ('Harry Potter and the Chamber of Secrets', '1998-07-02', 1),
-        ('Harry Potter and the Prisoner of Azkaban', '1999-07-08', 1),
-        ('Harry Potter and the Goblet of Fire', '2000-07-08', 1),
-        ('Harry Potter and the Order of the Phoenix', '2003-06-21', 1),
-        ('Harry Potter and the Half-Blood Prince', '2005-07-16', 1),
-        ('Harry Potter and the Deathly Hallows', '2007-07-21', 1),
-        ('A Game of Thrones', '1996-08-01', 2),
-        ('A Clash of Kings', '1998-11-16', 2),
-        ('A Storm of Swords', '2000-08-08', 2),
-        ('A Feast for Crows', '2005-10-17', 2),
-        ('A Dance with Dragons', '2011-07-12', 2),
-        ('The Lightning Thief', '2005-06-28', 3),
-        ('The Sea of Monsters', '2006-04-03', 3),
-        ('The Titan\'s Curse', '2007-05-01', 3),
-        ('The Battle of the Labyrinth', '2008-05-06', 3),
-        ('The Last Olympian', '2009-05-05', 3),
-        ('The Hunger Games', '2008-09-14', 4),
-        ('Catching Fire', '2009-09-01', 4),
-        ('Mockingjay', '2010-08-24', 4),
-        ('The Book Thief', '2005-03-14', 5)
-    ]
-    cur.executemany("INSERT INTO Books (title, publicationDate, publisherID) VALUES (%s, %s, %s)", books)
+    try:
+        cur = connection.cursor()
+
+        # Inserting Authors
+        authors = [
+            ('J.K. Rowling', 'British author known for the Harry Potter series.'),
+            ('George R.R. Martin', 'American novelist known for the A Song of Ice and Fire series.'),
+            ('Rick Riordan', 'American author known for the Percy Jackson & the Olympians series.'),
+            ('Suzanne Collins', 'American author known for The Hunger Games series.'),
+            ('Markus Zusak', 'Australian author known for The Book Thief.')
+        ]
+        cur.executemany("INSERT INTO Authors (name, bio) VALUES (%s, %s)", authors)
+
+        # Inserting Genres
+        genres = [('Fantasy',), ('Adventure',), ('Dystopian',), ('Historical Fiction',)]
+        cur.executemany("INSERT INTO Genres (genreName) VALUES (%s)", genres)
+
+        # Inserting Publishers
+        publishers = [
+            ('Bloomsbury', 'London, UK'),
+            ('Bantam Books', 'New York, USA'),
+            ('Disney Hyperion', 'New York, USA'),
+            ('Scholastic', 'Pennsylvania, USA'),
+            ('Picador', 'London, UK')
+        ]
+        cur.executemany("INSERT INTO Publishers (publisherName, contactInfo) VALUES (%s, %s)", publishers)
+
+        # Inserting Books
+        books = [
+            ('Harry Potter and the Philosopher\'s Stone', '1997-06-26', 1),
+            ('Harry Potter and the Chamber of Secrets', '1998-07-02', 1),
+            ('Harry Potter and the Prisoner of Azkaban', '1999-07-08', 1),
+            ('Harry Potter and the Goblet of Fire', '2000-07-08', 1),
+            ('Harry Potter and the Order of the Phoenix', '2003-06-21', 1),
+            ('Harry Potter and the Half-Blood Prince', '2005-07-16', 1),
+            ('Harry Potter and the Deathly Hallows', '2007-07-21', 1),
+            ('A Game of Thrones', '1996-08-01', 2),
+            ('A Clash of Kings', '1998-11-16', 2),
+            ('A Storm of Swords', '2000-08-08', 2),
+            ('A Feast for Crows', '2005-10-17', 2),
+            ('A Dance with Dragons', '2011-07-12', 2),
+            ('The Lightning Thief', '2005-06-28', 3),
+            ('The Sea of Monsters', '2006-04-03', 3),
+            ('The Titan\'s Curse', '2007-05-01', 3),
+            ('The Battle of the Labyrinth', '2008-05-06', 3),
+            ('The Last Olympian', '2009-05-05', 3),
+            ('The Hunger Games', '2008-09-14', 4),
+            ('Catching Fire', '2009-09-01', 4),
+            ('Mockingjay', '2010-08-24', 4),
+            ('The Book Thief', '2005-03-14', 5)
+        ]
+        cur.executemany("INSERT INTO Books (title, publicationDate, publisherID) VALUES (%s, %s, %s)", books)
+        if inventory_config['enabled']:
+            # The sample books are the only ones without slots yet
+            inventory.seed_slots(cur, inventory_config['slots'])
 
-    # Committing the changes
-    connection.commit()
-    connection.close()
+        # Committing the changes
+        connection.commit()
+        invalidate_catalog(('Authors', 'Genres', 'Publishers', 'Books') + STOCK_TABLES)
+    finally:
+        connection.close()
 
 
 @app.route('/populate_associations', methods=['POST'])
@@ -210,58 +758,251 @@ def populate_associations():
 
 def populate_book_genres():
     connection = get_db_connection()
-    cur = connection.cursor()
+    try:
+        cur = connection.cursor()
 
-    # Assuming the genre IDs are 1: Fantasy, 2: Adventure, 3: Dystopian, 4: Historical Fiction
-    # Assuming the book IDs are in the order they were inserted
-    cur.executemany("INSERT INTO Book_Genres (bookID, genreID) VALUES (%s, %s)", [
-        (1, 1), (2, 1), (3, 1), (4, 1), (5, 1), (6, 1), (7, 1),  # Harry Potter series
-        (8, 1), (9, 1), (10, 1), (11, 1), (12, 1),  # Game of Thrones series
-        (13, 1), (13, 2), (14, 1), (14, 2), (15, 1), (15, 2), (16, 1), (16, 2), (17, 1), (17, 2),
-        # Percy Jackson series
-        (18, 2), (18, 3), (19, 2), (19, 3), (20, 2), (20, 3),  # Hunger Games series
-        (21, 4)  # The Book Thief
-    ])
+        # Assuming the genre IDs are 1: Fantasy, 2: Adventure, 3: Dystopian, 4: Historical Fiction
+        # Assuming the book IDs are in the order they were inserted
+        cur.executemany("INSERT INTO Book_Genres (bookID, genreID) VALUES (%s, %s)", [
+            (1, 1), (2, 1), (3, 1), (4, 1), (5, 1), (6, 1), (7, 1),  # Harry Potter series
+            (8, 1), (9, 1), (10, 1), (11, 1), (12, 1),  # Game of Thrones series
+            (13, 1), (13, 2), (14, 1), (14, 2), (15, 1), (15, 2), (16, 1), (16, 2), (17, 1), (17, 2),
+            # Percy Jackson series
+            (18, 2), (18, 3), (19, 2), (19, 3), (20, 2), (20, 3),  # Hunger Games series
+            (21, 4)  # The Book Thief
+        ])
 
-    connection.commit()
-    connection.close()
+        connection.commit()
+        invalidate_catalog(('Book_Genres',))
+    finally:
+        connection.close()
 
 
 def populate_book_authors():
     connection = get_db_connection()
-    cur = connection.cursor()
+    try:
+        cur = connection.cursor()
 
-    # Assuming the author IDs are 1: J.K. Rowling, 2: George R.R. Martin, 3: Rick Riordan, 4: Suzanne Collins, 5: Markus Zusak
-    # Assuming the book IDs are in the order they were inserted
-    cur.executemany("INSERT INTO Book_Authors (bookID, authorID) VALUES (%s, %s)", [
-        (1, 1), (2, 1), (3, 1), (4, 1), (5, 1), (6, 1), (7, 1),  # Harry Potter series
-        (8, 2), (9, 2), (10, 2), (11, 2), (12, 2),  # Game of Thrones series
-        (13, 3), (14, 3), (15, 3), (16, 3), (17, 3),  # Percy Jackson series
-        (18, 4), (19, 4), (20, 4),  # Hunger Games series
-        (21, 5)  # The Book Thief
-    ])
+        # Assuming the author IDs are 1: J.K. Rowling, 2: George R.R. Martin, 3: Rick Riordan, 4: Suzanne Collins, 5: Markus Zusak
+        # Assuming the book IDs are in the order they were inserted
+        cur.executemany("INSERT INTO Book_Authors (bookID, authorID) VALUES (%s, %s)", [
+            (1, 1), (2, 1), (3, 1), (4, 1), (5, 1), (6, 1), (7, 1),  # Harry Potter series
+            (8, 2), (9, 2), (10, 2), (11, 2), (12, 2),  # Game of Thrones series
+            (13, 3), (14, 3), (15, 3), (16, 3), (17, 3),  # Percy Jackson series
+            (18, 4), (19, 4), (20, 4),  # Hunger Games series
+            (21, 5)  # The Book Thief
+        ])
+
+        connection.commit()
+        invalidate_catalog(('Book_Authors',))
+    finally:
+        connection.close()
 
-    connection.commit()
-    connection.close()
 
+@app.route('/import/catalog', methods=['POST'])
+def import_catalog():
+    upload = request.files.get('file')
+    if not upload:
+        return jsonify({"error": "Upload a CSV or JSON Lines file in the 'file' field."}), 400
 
-@app.route('/books/all', methods=['GET'])
-def get_all_books():
     connection = None
     try:
+        file_format = request.form.get('format') or detect_format(upload.filename or '')
+        batch_size = int(request.form.get('batchSize') or 5000)
         connection = get_db_connection()
-        cur = connection.cursor()
-        cur.execute("SELECT * FROM Books")
-        books = cur.fetchall()  # Fetches all rows of a query result
+        # The upload is read record by record from werkzeug's spooled temporary file
+        importer = CatalogImporter(connection, batch_size, slots=return_slots())
+        stats = importer.run(iter_records(upload.stream, file_format))
+        return jsonify(stats), 201
+    except (CatalogImportError, ValueError) as val_err:
+        return jsonify({"error": str(val_err)}), 400
+    except mysql.connector.Error as db_err:
+        return jsonify({"error": "Database error: " + str(db_err)}), 500
+    finally:
+        if connection:
+            connection.close()
+        invalidate_catalog(('Authors', 'Genres', 'Publishers', 'Books', 'Book_Authors', 'Book_Genres')
+                           + STOCK_TABLES)
+
+
+@app.cli.command('import-catalog')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']), default=None)
+@click.option('--batch-size', default=5000, show_default=True)
+@server_stopped_option
+def import_catalog_command(path, file_format, batch_size, server_stopped):
+    """Stream a CSV or JSON Lines catalog file into the database."""
+    require_shared_versions(server_stopped)
+
+    def report_progress(books, elapsed, rate):
+        print(f"{books} books imported in {elapsed:.1f}s ({rate:.0f} books/s)")
+
+    connection = get_db_connection()
+    try:
+        importer = CatalogImporter(connection, batch_size, report_progress, return_slots())
+        with open(path, 'rb') as f:
+            stats = importer.run(iter_records(f, file_format or detect_format(path)))
+    finally:
         connection.close()
-        books_list = [dict(zip([column[0] for column in cur.description], book)) for book in books]
-        return jsonify({"books": books_list})
+        invalidate_catalog(('Authors', 'Genres', 'Publishers', 'Books', 'Book_Authors', 'Book_Genres')
+                           + STOCK_TABLES)
+    print(f"Imported {stats['books']} books in {stats['batches']} batches, skipped {stats['skipped']} records "
+          f"({stats['authors_created']} authors, {stats['genres_created']} genres, "
+          f"{stats['publishers_created']} publishers created)")
+
+
+# Page size limits for /books/all and the batch size used when streaming
+BOOKS_PAGE_DEFAULT = 100
+BOOKS_PAGE_MAX = 1000
+BOOKS_STREAM_BATCH = 500
+
+
+@app.route('/books/all', methods=['GET'])
+def get_all_books():
+    stream_format = request.args.get('stream')
+    limit = request.args.get('limit')
+    after = request.args.get('after')
+
+    try:
+        after = int(after) if after is not None else 0
+        if limit is not None:
+            limit = min(int(limit), BOOKS_PAGE_MAX)
+            if limit <= 0:
+                raise ValueError
+        elif after:
+            limit = BOOKS_PAGE_DEFAULT
+    except ValueError:
+        return jsonify({"error": "limit and after must be positive integers."}), 400
+
+    if stream_format and stream_format not in ('json', 'ndjson'):
+        return jsonify({"error": "stream must be 'json' or 'ndjson'."}), 400
+
+    fmt = None if stream_format else negotiate_format(request.accept_mimetypes)
+    etag, not_modified = catalog_etag(('books/all', after, limit, stream_format or fmt), BOOK_LIST_TABLES)
+    if not_modified:
+        return not_modified
+
+    if stream_format:
+        # Only an explicit limit caps a stream; after on its own streams every later book
+        return stream_books(stream_format, after, limit if request.args.get('limit') is not None else None, etag)
+
+    try:
+        books = catalog_cache.get_or_load(('books/all', after, limit), BOOK_LIST_TABLES,
+                                          lambda: load_books(after, limit))
     except Exception as e:
         # Error handling
-        if connection:
-            connection.close()
         return jsonify({"error": str(e)}), 500
 
+    extra = {}
+    if limit is not None:
+        extra["next_after"] = books.rows[-1][books.columns.index('bookID')] if len(books) == limit else None
+    return table_response(books, fmt, lambda: {"books": books.records(), **extra}, extra, etag)
+
+
+def load_books(after, limit):
+    connection = get_db_connection(readonly=True, tables=BOOK_LIST_TABLES)
+    try:
+        if limit is None:
+            return Table.from_cursor(statements.execute(connection, BOOKS_ALL))
+        # Keyset pagination: seek past the last bookID the client has seen
+        return Table.from_cursor(statements.execute(connection, BOOKS_PAGE, (after, limit)))
+    finally:
+        connection.close()
+
+
+def stream_books(stream_format, after, limit=None, etag=None):
+    connection = get_db_connection(readonly=True, tables=BOOK_LIST_TABLES)
+    try:
+        # The default cursor is unbuffered, so rows are pulled from the server as we go
+        cur = connection.cursor()
+        if limit is None:
+            cur.execute(f"SELECT {BOOK_COLUMNS} FROM Books b WHERE b.bookID > %s ORDER BY b.bookID", (after,))
+        else:
+            cur.execute(f"SELECT {BOOK_COLUMNS} FROM Books b WHERE b.bookID > %s ORDER BY b.bookID LIMIT %s",
+                        (after, limit))
+        columns = [column[0] for column in cur.description]
+    except Exception as e:
+        connection.close()
+        return jsonify({"error": str(e)}), 500
+
+    def generate():
+        try:
+            first = True
+            if stream_format == 'json':
+                yield '{"books": ['
+            while True:
+                rows = cur.fetchmany(BOOKS_STREAM_BATCH)
+                if not rows:
+                    break
+                chunk = []
+                for row in rows:
+                    encoded = app.json.dumps(dict(zip(columns, row)))
+                    if stream_format == 'ndjson':
+                        chunk.append(encoded + '\n')
+                    else:
+                        chunk.append(encoded if first else ',' + encoded)
+                    first = False
+                yield ''.join(chunk)
+            if stream_format == 'json':
+                yield ']}'
+        finally:
+            connection.close()
+
+    mimetype = 'application/x-ndjson' if stream_format == 'ndjson' else 'application/json'
+    return with_etag(Response(generate(), mimetype=mimetype), etag)
+
+
+# Page size and depth limits for /books/search
+SEARCH_PAGE_DEFAULT = 20
+SEARCH_PAGE_MAX = 100
+SEARCH_OFFSET_MAX = 1000
+
+
+@app.route('/books/search', methods=['GET'])
+def search_catalog():
+    text = request.args.get('q', '').strip()
+    genre = request.args.get('genre')
+    publisher = request.args.get('publisher')
+    available = request.args.get('available')
+
+    if not text:
+        return jsonify({"error": "A search query is required."}), 400
+    try:
+        limit = min(int(request.args.get('limit', SEARCH_PAGE_DEFAULT)), SEARCH_PAGE_MAX)
+        offset = int(request.args.get('offset', 0))
+        if limit <= 0 or offset < 0 or offset > SEARCH_OFFSET_MAX:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": f"limit must be positive and offset between 0 and {SEARCH_OFFSET_MAX}."}), 400
+    if available is not None:
+        if available not in ('0', '1'):
+            return jsonify({"error": "available must be 0 or 1."}), 400
+        available = available == '1'
+    terms, ignored = split_terms(text)
+    if not terms:
+        return jsonify({"error": f"Search terms must be at least {MIN_TOKEN_LENGTH} characters long.",
+                        "ignored_terms": ignored}), 400
+
+    def load():
+        connection = get_db_connection(readonly=True, tables=BOOK_SEARCH_TABLES)
+        try:
+            return search_books(connection.cursor(), text, genre, publisher, available, limit, offset,
+                                inventory_config['enabled'])
+        finally:
+            connection.close()
+
+    try:
+        key = ('books/search', text.lower(), genre, publisher, available, limit, offset)
+        results, has_more = catalog_cache.get_or_load(key, BOOK_SEARCH_TABLES, load)
+    except Exception as e:
+        return jsonify({"error": "An error occurred: " + str(e)}), 500
+
+    return jsonify({
+        "results": results,
+        "next_offset": offset + limit if has_more else None,
+        "ignored_terms": ignored
+    })
+
 
 @app.route('/books/add', methods=['POST'])
 def add_new_book():
@@ -272,6 +1013,10 @@ def add_new_book():
 
     if not all([title, publication_date, publisher_id, availability_status]):
         return jsonify({"error": "Please input all book information."}), 400
+    try:
+        datetime.date.fromisoformat(publication_date)
+    except ValueError:
+        return jsonify({"error": "publicationDate must be a date in YYYY-MM-DD format."}), 400
 
     connection = None
     try:
@@ -289,14 +1034,19 @@ def add_new_book():
         if existing_book:
             new_count = existing_book[1] + 1
             cur.execute("UPDATE Books SET bookCount = %s WHERE bookID = %s", (new_count, existing_book[0]))
+            if inventory_config['enabled']:
+                inventory.add_copies(cur, existing_book[0], 1, inventory_config['slots'])
             message = "Book count incremented successfully."
         else:
             cur.execute(
                 "INSERT INTO Books (title, publicationDate, publisherID, availabilityStatus) VALUES (%s, %s, %s, %s)",
                 (title, publication_date, publisher_id, availability_status))
+            if inventory_config['enabled']:
+                inventory.seed_slots(cur, inventory_config['slots'], [cur.lastrowid])
             message = "Book added successfully."
 
         connection.commit()
+        invalidate_catalog(('Books', 'Inventory_Slots') if inventory_config['enabled'] else ('Books',))
         return jsonify({"message": message}), 201
 
     except mysql.connector.Error as db_err:
@@ -329,10 +1079,19 @@ def remove_book():
         book = cur.fetchone()
         if not book:
             return jsonify({"error": "Book not found."}), 404
+        # Transactions has no foreign keys since it was partitioned, so check for loans here
+        history = ' OR '.join(f"EXISTS (SELECT 1 FROM {table} WHERE bookID=%s)" for table in loans.LOAN_TABLES)
+        cur.execute(f"SELECT {history}", (book_id,) * len(loans.LOAN_TABLES))
+        if cur.fetchone()[0]:
+            return jsonify({"error": "Book has loan history and cannot be removed."}), 409
 
         # Delete the book from the database
+        forget_book(cur, book_id)
+        if inventory_config['enabled']:
+            inventory.forget_book(cur, book_id)
         cur.execute("DELETE FROM Books WHERE bookID=%s", (book_id,))
         connection.commit()
+        invalidate_catalog(('Books',))
         return jsonify({"message": "Book removed successfully."}), 200
     except Exception as e:
         connection.rollback()
@@ -341,35 +1100,138 @@ def remove_book():
         connection.close()
 
 
+# Upper bound on the number of IDs accepted by /books/details
+BOOK_DETAILS_MAX_IDS = 500
+
+
+def fetch_book_details(connection, book_ids):
+    # Loads books with their authors and genres using one query per table instead of one per book
+    if not book_ids:
+        return {}
+    params = tuple(book_ids)
+
+    details = {}
+    for book in statements.fetch_dicts(connection, BOOKS_BY_IDS.expand(len(params)), params):
+        details[book['bookID']] = {"book": book, "authors": [], "genres": []}
+
+    for book_id, name in statements.fetchall(connection, statements.AUTHORS_BY_BOOK_IDS.expand(len(params)), params):
+        if book_id in details:
+            details[book_id]["authors"].append(name)
+
+    for book_id, genre_name in statements.fetchall(connection, statements.GENRES_BY_BOOK_IDS.expand(len(params)),
+                                                   params):
+        if book_id in details:
+            details[book_id]["genres"].append(genre_name)
+
+    return details
+
+
+def get_cached_book_details(book_ids):
+    # Serve what we can from the cache and load the rest with one batched fetch
+    details = {}
+    missing = []
+    versions = None
+    for book_id in book_ids:
+        cached, versions = catalog_cache.get(('book', book_id), BOOK_DETAIL_TABLES)
+        if cached is None:
+            missing.append(book_id)
+        else:
+            details[book_id] = cached
+
+    if missing:
+        connection = get_db_connection(readonly=True, tables=BOOK_DETAIL_TABLES)
+        try:
+            loaded = fetch_book_details(connection, missing)
+        finally:
+            connection.close()
+        for book_id, book_details in loaded.items():
+            catalog_cache.put(('book', book_id), versions, book_details)
+        details.update(loaded)
+
+    return details
+
+
+@app.route('/books/<int:book_id>/availability', methods=['GET'])
+def book_availability(book_id):
+    if not inventory_config['enabled']:
+        return jsonify({"error": "Sharded inventory is not enabled."}), 404
+
+    connection = None
+    try:
+        connection = get_db_connection(readonly=True, tables=('Inventory_Slots', 'Reservations'))
+        cur = connection.cursor()
+        available = inventory.available_copies(cur, [book_id])
+        if book_id not in available:
+            return jsonify({"error": "Book not found."}), 404
+        reserved = inventory.reserved_copies(cur, [book_id])
+        return jsonify({"bookID": book_id, "available": available[book_id], "reserved": reserved.get(book_id, 0)})
+    except Exception as e:
+        return jsonify({"error": "An error occurred: " + str(e)}), 500
+    finally:
+        if connection:
+            connection.close()
+
+
 @app.route('/books/<int:book_id>', methods=['GET'])
 def get_book_details(book_id):
-    connection = get_db_connection()
-    cur = connection.cursor()
+    etag, not_modified = catalog_etag(('book', book_id), BOOK_DETAIL_TABLES)
+    if not_modified:
+        return not_modified
+
+    details = get_cached_book_details([book_id])
+
+    if book_id not in details:
+        return jsonify({"error": "Book not found."}), 404
+    return with_etag(jsonify(details[book_id]), etag)
+
 
-    # Get book details
-    cur.execute("SELECT * FROM Books WHERE bookID=%s", (book_id,))
-    book = cur.fetchone()
+@app.route('/books/details', methods=['GET'])
+def get_books_details():
+    ids = request.args.get('ids', '')
+    try:
+        book_ids = list(dict.fromkeys(int(book_id) for book_id in ids.split(',') if book_id.strip()))
+    except ValueError:
+        return jsonify({"error": "ids must be a comma-separated list of book IDs."}), 400
 
-    # Get authors of the book
-    cur.execute('''SELECT a.name FROM Authors a
-                   JOIN Book_Authors ba ON a.authorID = ba.authorID
-                   WHERE ba.bookID=%s''', (book_id,))
-    authors = [author[0] for author in cur.fetchall()]
+    if not book_ids:
+        return jsonify({"error": "At least one book ID is required."}), 400
+    if len(book_ids) > BOOK_DETAILS_MAX_IDS:
+        return jsonify({"error": f"At most {BOOK_DETAILS_MAX_IDS} book IDs can be requested at once."}), 400
 
-    # Get genres of the book
-    cur.execute('''SELECT g.genreName FROM Genres g
-                   JOIN Book_Genres bg ON g.genreID = bg.genreID
-                   WHERE bg.bookID=%s''', (book_id,))
-    genres = [genre[0] for genre in cur.fetchall()]
+    try:
+        details = get_cached_book_details(book_ids)
+    except Exception as e:
+        return jsonify({"error": "An error occurred: " + str(e)}), 500
 
-    connection.close()
     return jsonify({
-        "book": book,
-        "authors": authors,
-        "genres": genres
+        "books": [details[book_id] for book_id in book_ids if book_id in details],
+        "missing": [book_id for book_id in book_ids if book_id not in details]
     })
 
 
+@app.route('/users/<int:user_id>/recommendations', methods=['GET'])
+def user_recommendations(user_id):
+    try:
+        limit = int(request.args.get('limit', 10))
+        if not 0 < limit <= REPORT_LIMIT_MAX:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": f"limit must be between 1 and {REPORT_LIMIT_MAX}."}), 400
+
+    connection = None
+    try:
+        connection = get_db_connection(readonly=True, tables=('User_Books', 'Book_Neighbours'))
+        rows = recommendations.recommend(connection.cursor(), user_id, limit)
+    except Exception as e:
+        return jsonify({"error": "An error occurred: " + str(e)}), 500
+    finally:
+        if connection:
+            connection.close()
+    table = Table(('bookID', 'title', 'score'), rows)
+    return table_response(table, negotiate_format(request.accept_mimetypes),
+                          lambda: {"userID": user_id, "recommendations": table.records()})
+
+
 @app.route('/register_user', methods=['POST'])
 def register_user():
     name = request.form.get('name')
@@ -381,13 +1243,11 @@ def register_user():
     connection = None
     try:
         connection = get_db_connection()
-        cur = connection.cursor()
 
-        cur.execute("SELECT * FROM Users WHERE contactDetails=%s", (contact_details,))
-        if cur.fetchone():
+        if statements.fetchone(connection, statements.USER_BY_CONTACT, (contact_details,)):
             return jsonify({"error": "Email ID already registered."}), 409
 
-        cur.execute("INSERT INTO Users (name, contactDetails) VALUES (%s, %s)", (name, contact_details))
+        statements.execute(connection, statements.INSERT_USER, (name, contact_details))
         connection.commit()
         return jsonify({"message": "User registered successfully!"}), 201
 
@@ -404,6 +1264,54 @@ def register_user():
             connection.close()
 
 
+# Upper bound on the number of items accepted by the batch routes
+BATCH_MAX_ITEMS = 1000
+
+
+def read_batch():
+    # Batch routes take a JSON array; returns (items, None) or (None, error response)
+    items = request.get_json(silent=True)
+    if not isinstance(items, list) or not items:
+        return None, (jsonify({"error": "Request body must be a non-empty JSON array."}), 400)
+    if len(items) > BATCH_MAX_ITEMS:
+        return None, (jsonify({"error": f"At most {BATCH_MAX_ITEMS} items can be sent at once."}), 400)
+    return items, None
+
+
+def batch_response(results):
+    succeeded = sum(1 for result in results if result["status"] < 300)
+    return jsonify({"results": results, "succeeded": succeeded, "failed": len(results) - succeeded}), 200
+
+
+def run_batch(operation, items):
+    # Applies every valid item in one transaction; invalid items are reported per item
+    connection = None
+    try:
+        connection = get_db_connection()
+        results = operation(connection.cursor(), items)
+        connection.commit()
+        return batch_response(results)
+    except mysql.connector.Error as db_err:
+        if connection:
+            connection.rollback()
+        return jsonify({"error": "Database error: " + str(db_err)}), 500
+    except Exception as e:
+        if connection:
+            connection.rollback()
+        return jsonify({"error": "An unexpected error occurred: " + str(e)}), 500
+    finally:
+        if connection:
+            connection.close()
+
+
+@app.route('/register_user/batch', methods=['POST'])
+def register_users_batch():
+    users, error = read_batch()
+    if error:
+        return error
+    return run_batch(register_users, users)
+
+
 @app.route('/update_user', methods=['POST'])
 def update_user():
     user_id = request.form.get('userID')
@@ -455,6 +1363,8 @@ def create_cart():
 
         cur.execute("INSERT INTO Cart (userID) VALUES (%s)", (user_id,))
         connection.commit()
+        if cart_store is not None:
+            cart_store.register(cur.lastrowid, int(user_id))
         return jsonify({"message": "Cart created successfully for the user."}), 201
 
     except mysql.connector.Error as err:
@@ -476,41 +1386,71 @@ def add_to_cart():
     cart_id = request.form.get('cartID')
     book_id = request.form.get('bookID')
 
+    if cart_store is not None:
+        return add_to_cart_store(cart_id, book_id)
+
     connection = get_db_connection()
-    cur = connection.cursor()
+    try:
+        # Check if the cart exists for the provided cartID
+        cart = statements.fetchone(connection, statements.CART_BY_ID, (cart_id,))
+        if not cart:
+            return jsonify({"error": "Cart not found. Please create a cart first."}), 404
 
-    print("Cart ID:", cart_id)
-    print("Book ID:", book_id)
+        # Fetch the book's name
+        book_result = statements.fetchone(connection, statements.BOOK_TITLE, (book_id,))
+        if not book_result:
+            return jsonify({"error": "Book not found."}), 404
+        book_name = book_result[0]
 
-    # Check if the cart exists for the provided cartID
-    cur.execute("SELECT * FROM Cart WHERE cartID=%s", (cart_id,))
-    cart = cur.fetchone()
-    if not cart:
-        print("No cart found for Cart ID:", cart_id)
-        connection.close()
-        return jsonify({"error": "Cart not found. Please create a cart first."}), 404
+        # Insert into Cart_Items
+        statements.execute(connection, statements.INSERT_CART_ITEM, (cart_id, book_id, book_name))
+        if event_writer is None:
+            record_cart_add(connection, book_id)
 
-    # Check if the cart exists for the provided cartID
-    cur.execute("SELECT * FROM Cart WHERE cartID=%s", (cart_id,))
-    cart = cur.fetchone()
-    if not cart:
-        connection.close()
-        return jsonify({"error": "Cart not found. Please create a cart first."}), 404
+        # Hold a copy for the cart; the item is only added if one is left
+        if reservations_enabled and not inventory.reserve(connection.cursor(), cart_id, book_id,
+                                                          inventory_config['reservation_ttl'],
+                                                          inventory_config['slots']):
+            connection.rollback()
+            return jsonify({"error": "No copies of this book are available."}), 409
 
-    # Fetch the book's name
-    cur.execute("SELECT title FROM Books WHERE bookID=%s", (book_id,))
-    book_result = cur.fetchone()
-    if not book_result:
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
         connection.close()
-        return jsonify({"error": "Book not found."}), 404
-    book_name = book_result[0]
 
-    # Insert into Cart_Items
-    cur.execute("INSERT INTO Cart_Items (cartID, bookID, bookName) VALUES (%s, %s, %s)", (cart_id, book_id, book_name))
+    if event_writer is not None:
+        event_writer.submit([(CART_ADD, [book_id])])
+    return jsonify({"message": "Book added to cart successfully!"}), 201
+
 
-    connection.commit()
-    connection.close()
+def parse_cart_ids(*values):
+    # Write-back carts are keyed by integer IDs
+    try:
+        return [int(value) for value in values]
+    except (TypeError, ValueError):
+        return None
+
+
+def add_to_cart_store(cart_id, book_id):
+    ids = parse_cart_ids(cart_id, book_id)
+    if ids is None:
+        return jsonify({"error": "cartID and bookID must be integers."}), 400
+    cart_id, book_id = ids
 
+    # The title comes from the cached catalog instead of a Books lookup
+    details = get_cached_book_details([book_id])
+    if book_id not in details:
+        return jsonify({"error": "Book not found."}), 404
+
+    try:
+        added = cart_store.add(cart_id, book_id, details[book_id]["book"]["title"])
+    except CartNotFoundError:
+        return jsonify({"error": "Cart not found. Please create a cart first."}), 404
+    if not added:
+        return jsonify({"error": "Book is already in the cart."}), 409
     return jsonify({"message": "Book added to cart successfully!"}), 201
 
 
@@ -520,18 +1460,34 @@ def remove_from_cart():
     cart_id = request.form.get('cartID')
     book_id = request.form.get('bookID')
 
+    if cart_store is not None:
+        ids = parse_cart_ids(cart_id, book_id)
+        if ids is None:
+            return jsonify({"error": "cartID and bookID must be integers."}), 400
+        try:
+            removed = cart_store.remove(*ids)
+        except CartNotFoundError:
+            removed = False
+        if not removed:
+            return jsonify({"error": "Book not found in the cart."}), 404
+        return jsonify({"message": "Book removed from cart successfully."}), 200
+
     connection = get_db_connection()
     try:
-        cur = connection.cursor()
         # Check if the book is in the cart
-        cur.execute("SELECT * FROM Cart_Items WHERE cartID=%s AND bookID=%s", (cart_id, book_id))
-        item = cur.fetchone()
+        item = statements.fetchone(connection, statements.CART_ITEM, (cart_id, book_id))
         if not item:
             return jsonify({"error": "Book not found in the cart."}), 404
 
         # Remove the book from the cart
-        cur.execute("DELETE FROM Cart_Items WHERE cartID=%s AND bookID=%s", (cart_id, book_id))
+        statements.execute(connection, statements.DELETE_CART_ITEM, (cart_id, book_id))
+        if event_writer is None:
+            record_cart_remove(connection, book_id)
+        if reservations_enabled:
+            inventory.release(connection.cursor(), cart_id, book_id)
         connection.commit()
+        if event_writer is not None:
+            event_writer.submit([(CART_REMOVE, [book_id])])
         return jsonify({"message": "Book removed from cart successfully."}), 200
     except Exception as e:
         connection.rollback()
@@ -540,29 +1496,82 @@ def remove_from_cart():
         connection.close()
 
 
+def run_cart_store_batch(items, adding):
+    # Write-back carts: validate the books against the catalog in one pass, then apply in memory
+    valid, results = parse_cart_items(items)
+    titles = {}
+    if adding and valid:
+        details = get_cached_book_details(list(dict.fromkeys(book_id for _, _, book_id in valid)))
+        titles = {book_id: book_details["book"]["title"] for book_id, book_details in details.items()}
+
+    for index, cart_id, book_id in valid:
+        fields = {"index": index, "cartID": cart_id, "bookID": book_id}
+        try:
+            if adding and book_id not in titles:
+                results[index] = dict(fields, status=404, error="Book not found.")
+            elif adding and not cart_store.add(cart_id, book_id, titles[book_id]):
+                results[index] = dict(fields, status=409, error="Book is already in the cart.")
+            elif not adding and not cart_store.remove(cart_id, book_id):
+                results[index] = dict(fields, status=404, error="Book not found in the cart.")
+            else:
+                results[index] = dict(fields, status=201 if adding else 200)
+        except CartNotFoundError:
+            error = "Cart not found. Please create a cart first." if adding else "Book not found in the cart."
+            results[index] = dict(fields, status=404, error=error)
+    return batch_response([results[index] for index in range(len(items))])
+
+
+@app.route('/add_to_cart/batch', methods=['POST'])
+def add_to_cart_batch():
+    # Body: [{"cartID": 1, "bookID": 2}, ...]
+    items, error = read_batch()
+    if error:
+        return error
+    if cart_store is not None:
+        return run_cart_store_batch(items, adding=True)
+    ttl = inventory_config['reservation_ttl'] if reservations_enabled else 0
+    return run_batch(lambda cur, batch: add_cart_items(cur, batch, ttl, inventory_config['slots']), items)
+
+
+@app.route('/remove_from_cart/batch', methods=['POST'])
+def remove_from_cart_batch():
+    items, error = read_batch()
+    if error:
+        return error
+    if cart_store is not None:
+        return run_cart_store_batch(items, adding=False)
+    return run_batch(lambda cur, batch: remove_cart_items(cur, batch, reservations_enabled), items)
+
+
 @app.route('/view_cart', methods=['GET'])
 def view_cart():
     cart_id = request.args.get('cartID')
     if not cart_id:
         return jsonify({"error": "Cart ID is required."}), 400
 
+    if cart_store is not None:
+        ids = parse_cart_ids(cart_id)
+        if ids is None:
+            return jsonify({"error": "cartID must be an integer."}), 400
+        try:
+            items = cart_store.items(ids[0])
+        except CartNotFoundError:
+            return jsonify({"error": "Cart not found."}), 404
+        titles = [book_name for _, book_name in items]
+        return cart_response(titles)
+
     connection = None
     try:
-        connection = get_db_connection()
-        cur = connection.cursor()
+        connection = get_db_connection(readonly=True)
 
         # Check if the cart exists for the provided cartID
-        cur.execute("SELECT * FROM Cart WHERE cartID=%s", (cart_id,))
-        cart = cur.fetchone()
+        cart = statements.fetchone(connection, statements.CART_BY_ID, (cart_id,))
         if not cart:
             return jsonify({"error": "Cart not found."}), 404
 
         # Retrieve the books in the cart
-        cur.execute('''SELECT b.title FROM Books b
-                       JOIN Cart_Items ci ON b.bookID = ci.bookID
-                       WHERE ci.cartID=%s''', (cart_id,))
-        books_in_cart = [book[0] for book in cur.fetchall()]
-        return jsonify({"books_in_cart": books_in_cart})
+        books_in_cart = [book[0] for book in statements.fetchall(connection, statements.CART_TITLES, (cart_id,))]
+        return cart_response(books_in_cart)
     except Exception as e:
         return jsonify({"error": "An error occurred: " + str(e)}), 500
     finally:
@@ -570,55 +1579,222 @@ def view_cart():
             connection.close()
 
 
+@app.cli.command('flush-carts')
+def flush_carts_command():
+    """Write carts left in the cart journal (e.g. after a crash) to Cart_Items."""
+    if cart_store is None:
+        print("Cart mode is 'db'; there is nothing to flush.")
+        return
+    flushed = cart_store.flush_all()
+    print(f"Flushed {flushed} carts")
+
+
+def cart_response(titles):
+    table = Table(('title',), [(title,) for title in titles])
+    return table_response(table, negotiate_format(request.accept_mimetypes), lambda: {"books_in_cart": titles})
+
+
+# Column names of /reports/advanced rows
+REPORT_COLUMNS = ('user_name', 'book_title', 'loan_count', 'publisher_name', 'cart_count')
+
+
 @app.route('/reports/advanced', methods=['GET'])
 def advanced_report():
     connection = None
     try:
-        connection = get_db_connection()
+        connection = get_db_connection(readonly=True)
         cur = connection.cursor()
-        cur.execute('''
-            SELECT 
-                Users.name AS user_name,
-                Books.title AS book_title,
-                COUNT(Transactions.bookID) AS loan_count,
-                Publishers.publisherName AS publisher_name,
-                (SELECT COUNT(*) FROM Cart_Items WHERE Cart_Items.bookID = Books.bookID) AS cart_count
-            FROM 
-                Users
-            JOIN 
-                Transactions ON Users.userID = Transactions.userID
-            JOIN 
-                Books ON Transactions.bookID = Books.bookID
-            JOIN 
-                Publishers ON Books.publisherID = Publishers.publisherID
-            GROUP BY 
-                Users.name, Books.title, Publishers.publisherName, Books.bookID
-            ORDER BY 
-                loan_count DESC, cart_count DESC
-            LIMIT 10;
-        ''')
-        report_data = cur.fetchall()
+        # Read from Loan_Summary and Cart_Summary instead of grouping the whole loan history
+        report_data = fetch_top_loans(cur, 10)
         connection.close()
 
-        # Format the report data into a JSON-friendly structure
-        report = [
-            {
-                "user_name": row[0],
-                "book_title": row[1],
-                "loan_count": row[2],
-                "publisher_name": row[3],
-                "cart_count": row[4]
-            }
-            for row in report_data
-        ]
-
-        return jsonify(report)
+        # One object per row by default; columnar and binary formats on request
+        return table_response(Table(REPORT_COLUMNS, report_data), negotiate_format(request.accept_mimetypes))
     except Exception as e:
         if connection:
             connection.close()
         return jsonify({"error": str(e)}), 500
 
 
+@app.cli.command('rebuild-inventory')
+@server_stopped_option
+def rebuild_inventory_command(server_stopped):
+    """Reset Inventory_Slots from Books.bookCount and drop all reservations."""
+    require_shared_versions(server_stopped)
+    connection = get_db_connection()
+    try:
+        rows = inventory.rebuild_slots(connection, inventory_config['slots'])
+    finally:
+        connection.close()
+    invalidate_catalog(('Inventory_Slots', 'Reservations'))
+    print(f"Rebuilt {rows} inventory slots")
+
+
+@app.cli.command('sync-book-counts')
+@server_stopped_option
+def sync_book_counts_command(server_stopped):
+    """Copy the sharded inventory's counts to Books.bookCount, e.g. before turning sharded inventory off."""
+    require_shared_versions(server_stopped)
+    connection = get_db_connection()
+    try:
+        rows = inventory.sync_book_counts(connection)
+    finally:
+        connection.close()
+    invalidate_catalog(('Books',))
+    print(f"Updated the bookCount of {rows} books")
+
+
+# Default window of the rollup reports, and their limits
+REPORT_WINDOW_DAYS = 30
+REPORT_LIMIT_MAX = 100
+TREND_DAYS_MAX = 1000
+
+
+def parse_report_range():
+    # start and end are inclusive ISO dates; the default is the last REPORT_WINDOW_DAYS days
+    try:
+        end = datetime.date.fromisoformat(request.args['end']) if 'end' in request.args else datetime.date.today()
+        start = (datetime.date.fromisoformat(request.args['start']) if 'start' in request.args
+                 else end - datetime.timedelta(days=REPORT_WINDOW_DAYS - 1))
+    except ValueError:
+        return None
+    return (start, end) if start <= end else None
+
+
+def parse_report_limit():
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        return None
+    return limit if 0 < limit <= REPORT_LIMIT_MAX else None
+
+
+def report_response(columns, rows, start, end, **fields):
+    table = Table(columns, rows)
+    extra = dict(fields, start=start.isoformat(), end=end.isoformat())
+    return table_response(table, negotiate_format(request.accept_mimetypes),
+                          lambda: dict(extra, results=table.records()), extra)
+
+
+@app.route('/reports/top', methods=['GET'])
+def top_report():
+    dimension = request.args.get('by', 'book')
+    date_range = parse_report_range()
+    limit = parse_report_limit()
+    if dimension not in rollups.NAMES:
+        return jsonify({"error": f"by must be one of {', '.join(rollups.NAMES)}."}), 400
+    if date_range is None:
+        return jsonify({"error": "start and end must be YYYY-MM-DD dates with start <= end."}), 400
+    if limit is None:
+        return jsonify({"error": f"limit must be between 1 and {REPORT_LIMIT_MAX}."}), 400
+
+    connection = None
+    try:
+        connection = get_db_connection(readonly=True, tables=('Loan_Rollups',))
+        rows = rollups.fetch_top(connection.cursor(), dimension, *date_range, limit)
+    except Exception as e:
+        return jsonify({"error": "An error occurred: " + str(e)}), 500
+    finally:
+        if connection:
+            connection.close()
+    return report_response(('id', 'name', 'loans'), rows, *date_range, by=dimension)
+
+
+@app.route('/reports/trends', methods=['GET'])
+def trend_report():
+    grain = request.args.get('grain', rollups.DAY)
+    dimension = request.args.get('by', 'total')
+    date_range = parse_report_range()
+    if grain not in (rollups.DAY, rollups.MONTH):
+        return jsonify({"error": "grain must be day or month."}), 400
+    if dimension not in rollups.DIMENSIONS:
+        return jsonify({"error": f"by must be one of {', '.join(rollups.DIMENSIONS)}."}), 400
+    if date_range is None:
+        return jsonify({"error": "start and end must be YYYY-MM-DD dates with start <= end."}), 400
+    if grain == rollups.DAY and (date_range[1] - date_range[0]).days >= TREND_DAYS_MAX:
+        return jsonify({"error": f"Daily trends cover at most {TREND_DAYS_MAX} days; use grain=month."}), 400
+    key_id = 0
+    if dimension != 'total':
+        try:
+            key_id = int(request.args['id'])
+        except (KeyError, ValueError):
+            return jsonify({"error": "id must be an integer when by is not total."}), 400
+
+    connection = None
+    try:
+        connection = get_db_connection(readonly=True, tables=('Loan_Rollups',))
+        rows = rollups.fetch_trend(connection.cursor(), *date_range, grain, dimension, key_id)
+    except Exception as e:
+        return jsonify({"error": "An error occurred: " + str(e)}), 500
+    finally:
+        if connection:
+            connection.close()
+    return report_response(('period', 'loans'), rows, *date_range, grain=grain, by=dimension, id=key_id)
+
+
+@app.route('/reports/genres', methods=['GET'])
+def genre_report():
+    date_range = parse_report_range()
+    limit = parse_report_limit()
+    if date_range is None:
+        return jsonify({"error": "start and end must be YYYY-MM-DD dates with start <= end."}), 400
+    if limit is None:
+        return jsonify({"error": f"limit must be between 1 and {REPORT_LIMIT_MAX}."}), 400
+
+    connection = None
+    try:
+        connection = get_db_connection(readonly=True, tables=('Loan_Rollups',))
+        cur = connection.cursor()
+        rows = rollups.fetch_top(cur, 'genre', *date_range, limit)
+        total = rollups.fetch_total(cur, *date_range)
+    except Exception as e:
+        return jsonify({"error": "An error occurred: " + str(e)}), 500
+    finally:
+        if connection:
+            connection.close()
+    # A book can have several genres, so the shares can add up to more than 1
+    rows = [(genre_id, name, loans, round(loans / total, 4) if total else 0.0) for genre_id, name, loans in rows]
+    return report_response(('id', 'name', 'loans', 'share'), rows, *date_range, total_loans=total)
+
+
+@app.cli.command('aggregate-rollups')
+@click.option('--rebuild', is_flag=True, help='Empty the rollups and recount every transaction.')
+def aggregate_rollups_command(rebuild):
+    """Fold new transactions into Loan_Rollups until caught up."""
+    if rebuild:
+        connection = get_db_connection()
+        try:
+            rollups.rebuild_rollups(connection)
+        finally:
+            connection.close()
+    advanced = rollup_aggregator.run_once()
+    print(f"Aggregated {advanced} transaction IDs into the loan rollups")
+
+
+@app.cli.command('rebuild-recommendations')
+def rebuild_recommendations_command():
+    """Recompute co-borrow counts and every book's neighbours from the whole borrowing history."""
+    connection = get_db_connection()
+    try:
+        counts = recommendations.rebuild(connection, recommendation_config['neighbours'],
+                                         rollup_config['settle_seconds'])
+    finally:
+        connection.close()
+    print(f"Rebuilt recommendations: {counts['users']} users, {counts['books']} books, "
+          f"{counts['neighbours']} neighbour rows")
+
+
+@app.cli.command('rebuild-summaries')
+def rebuild_summaries_command():
+    """Backfill Loan_Summary and Cart_Summary from Transactions and Cart_Items."""
+    connection = get_db_connection()
+    try:
+        counts = rebuild_summaries(connection)
+    finally:
+        connection.close()
+    print(f"Rebuilt summaries: {counts['loan_summary_rows']} loan rows, {counts['cart_summary_rows']} cart rows")
+
+
 @app.route('/checkout', methods=['POST'])
 def checkout():
     user_name = request.form.get('userName')
@@ -628,42 +1804,179 @@ def checkout():
 
     try:
         connection = get_db_connection()
-        cur = connection.cursor()
 
-        cur.execute("SELECT userID FROM Users WHERE name=%s", (user_name,))
-        user_result = cur.fetchone()
+        user_result = statements.fetchone(connection, statements.USER_BY_NAME, (user_name,))
         if not user_result:
             return jsonify({"error": "User not found."}), 404
 
-        cur.execute("SELECT bookID FROM Cart_Items WHERE cartID=%s", (cart_id,))
-        cart_items = cur.fetchall()
-        if not cart_items:
-            return jsonify({"error": "Cart is empty or does not exist."}), 400
+        # The whole cart is checked out in one locked, all-or-nothing transaction
+        if inventory_config['enabled']:
+            def run_checkout():
+                return checkout_cart_slots(connection, user_result[0], cart_id, inventory_config['slots'],
+                                           event_writer)
+            changed_tables = ('Inventory_Slots', 'Reservations')
+        else:
+            def run_checkout():
+                return checkout_cart(connection, user_result[0], cart_id, event_writer)
+            changed_tables = ('Books',)
+
+        if cart_store is not None and parse_cart_ids(cart_id) is not None:
+            # Write the in-memory cart to Cart_Items first; the checkout works from there
+            book_ids = cart_store.checkout(int(cart_id), connection, run_checkout)
+        else:
+            book_ids = run_checkout()
+        invalidate_catalog(changed_tables)
+        return jsonify({"message": "Checkout successful.", "bookIDs": book_ids}), 200
+
+    except CheckoutError as checkout_err:
+        if checkout_err.unavailable:
+            return jsonify({"error": str(checkout_err), "unavailable": checkout_err.unavailable}), 409
+        return jsonify({"error": str(checkout_err)}), 400
+    except mysql.connector.Error as db_err:
+        if connection:
+            connection.rollback()
+        return jsonify({"error": "Database error: " + str(db_err)}), 500
+    except Exception as e:
+        if connection:
+            connection.rollback()
+        return jsonify({"error": "An error occurred during checkout: " + str(e)}), 500
+    finally:
+        if connection:
+            connection.close()
+
 
-        for item in cart_items:
-            book_id = item[0]
-            cur.execute("SELECT bookCount FROM Books WHERE bookID=%s AND availabilityStatus=1", (book_id,))
-            book = cur.fetchone()
-            if not book or book[0] <= 0:
-                raise Exception(f"Book ID {book_id} is not available for checkout.")
+# Upper bound on the page size of /loans/overdue
+LOANS_PAGE_MAX = 1000
 
-            cur.execute("UPDATE Books SET bookCount = bookCount - 1 WHERE bookID=%s", (book_id,))
-            cur.execute("INSERT INTO Transactions (userID, bookID, borrowDate) VALUES (%s, %s, NOW())", (user_result[0], book_id))
 
-        cur.execute("DELETE FROM Cart_Items WHERE cartID=%s", (cart_id,))
+def return_slots():
+    return inventory_config['slots'] if inventory_config['enabled'] else None
+
+
+def returned_tables():
+    return ('Inventory_Slots',) if inventory_config['enabled'] else ('Books',)
+
+
+@app.route('/return_book', methods=['POST'])
+def return_book():
+    user_name = request.form.get('userName')
+    user_id = request.form.get('userID')
+    book_id = request.form.get('bookID')
+
+    if not (user_name or user_id) or not book_id:
+        return jsonify({"error": "userName or userID, and bookID are required."}), 400
+
+    connection = None
+    try:
+        connection = get_db_connection()
+        if not user_id:
+            user_result = statements.fetchone(connection, statements.USER_BY_NAME, (user_name,))
+            if not user_result:
+                return jsonify({"error": "User not found."}), 404
+            user_id = user_result[0]
+
+        result = return_books(connection.cursor(), [{"userID": user_id, "bookID": book_id}], return_slots())[0]
+        if result["status"] != 200:
+            connection.rollback()
+            return jsonify({"error": result["error"]}), result["status"]
         connection.commit()
-        return jsonify({"message": "Checkout successful."}), 200
+        invalidate_catalog(returned_tables())
+        return jsonify({"message": "Book returned successfully.", "transactionID": result["transactionID"]}), 200
 
     except mysql.connector.Error as db_err:
-        connection.rollback()
+        if connection:
+            connection.rollback()
         return jsonify({"error": "Database error: " + str(db_err)}), 500
     except Exception as e:
-        connection.rollback()
-        return jsonify({"error": "An error occurred during checkout: " + str(e)}), 500
+        if connection:
+            connection.rollback()
+        return jsonify({"error": "An error occurred: " + str(e)}), 500
     finally:
         if connection:
             connection.close()
 
 
+@app.route('/return_book/batch', methods=['POST'])
+def return_book_batch():
+    # Body: [{"userID": 1, "bookID": 2}, ...]
+    items, error = read_batch()
+    if error:
+        return error
+    response = run_batch(lambda cur, batch: return_books(cur, batch, return_slots()), items)
+    if response[1] == 200:
+        invalidate_catalog(returned_tables())
+    return response
+
+
+@app.route('/loans/open', methods=['GET'])
+def get_open_loans():
+    try:
+        user_id = int(request.args['userID']) if 'userID' in request.args else None
+        book_id = int(request.args['bookID']) if 'bookID' in request.args else None
+    except ValueError:
+        return jsonify({"error": "userID and bookID must be integers."}), 400
+    if user_id is None and book_id is None:
+        return jsonify({"error": "userID or bookID is required."}), 400
+
+    connection = None
+    try:
+        connection = get_db_connection(readonly=True, tables=loans.LOAN_TABLES)
+        rows = loans.open_loans(connection.cursor(), user_id, book_id)
+    except Exception as e:
+        return jsonify({"error": "An error occurred: " + str(e)}), 500
+    finally:
+        if connection:
+            connection.close()
+    table = Table(('transactionID', 'userID', 'bookID', 'borrowDate'), rows)
+    return table_response(table, negotiate_format(request.accept_mimetypes), lambda: {"loans": table.records()})
+
+
+@app.route('/loans/overdue', methods=['GET'])
+def get_overdue_loans():
+    # after is the next_after value of the previous page: "<borrowDate>,<transactionID>"
+    try:
+        as_of = datetime.date.fromisoformat(request.args['as_of']) if 'as_of' in request.args else datetime.date.today()
+        limit = int(request.args.get('limit', 100))
+        if not 0 < limit <= LOANS_PAGE_MAX:
+            raise ValueError
+        after = None
+        if 'after' in request.args:
+            borrow_date, transaction_id = request.args['after'].rsplit(',', 1)
+            after = (datetime.datetime.fromisoformat(borrow_date), int(transaction_id))
+    except ValueError:
+        return jsonify({"error": f"as_of must be a YYYY-MM-DD date, limit between 1 and {LOANS_PAGE_MAX} "
+                                 "and after a next_after value."}), 400
+
+    connection = None
+    try:
+        connection = get_db_connection(readonly=True, tables=loans.LOAN_TABLES)
+        rows = loans.overdue_loans(connection.cursor(), as_of, loan_config['loan_days'], limit, after)
+    except Exception as e:
+        return jsonify({"error": "An error occurred: " + str(e)}), 500
+    finally:
+        if connection:
+            connection.close()
+    table = Table(('transactionID', 'userID', 'name', 'bookID', 'title', 'borrowDate'), rows)
+    extra = {"as_of": as_of.isoformat(), "loan_days": loan_config['loan_days'],
+             "next_after": f"{rows[-1][5].isoformat()},{rows[-1][0]}" if len(rows) == limit else None}
+    return table_response(table, negotiate_format(request.accept_mimetypes),
+                          lambda: dict(extra, loans=table.records()), extra)
+
+
+@app.cli.command('rotate-transactions')
+@click.option('--export-dir', default=None, help="Write retired months here as gzip'd CSV instead of archiving them.")
+def rotate_transactions_command(export_dir):
+    """Add the coming months' Transactions partitions and retire the ones older than keep_months."""
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    connection = get_db_connection()
+    try:
+        changes = loans.rotate_partitions(connection, loan_config['keep_months'], loan_config['months_ahead'],
+                                          export_dir or loan_config['export_dir'])
+    finally:
+        connection.close()
+    print(f"Added partitions {changes['added']}; retired {changes['retired']}")
+
+
 if __name__ == "__main__":
+    # Single-process development server; see server.py for production
     app.run(port=5040)
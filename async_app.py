@@ -0,0 +1,522 @@
+"""
+Asyncio variant of the catalog, report, user and cart routes, served over ASGI.
+
+Requests run as coroutines on one event loop per process and talk to MySQL through
+async_db's pool of mysql.connector.aio connections, so a request waiting on the database
+holds neither a thread nor the loop. Independent queries run concurrently, each on its
+own pooled connection: the books, authors and genres of a /books/<id> or /books/details
+lookup are fetched together instead of one after the other.
+
+The routes answer like their counterparts in the Flask app, against the same database,
+config file and LIBRARY_* variables (see settings.py). It covers the classic setup only:
+carts in Cart_Items (cart mode 'db'), stock in Books.bookCount (sharded inventory off)
+and summaries written in the checkout's transaction (no event writer). Its catalog cache
+must see the Flask app's writes, so it needs the 'redis' cache backend or the cache
+turned off (max_entries or ttl 0). The module refuses to load with any other config.
+Administration, bulk and import routes, replicas and the background jobs stay in the
+Flask app.
+
+Needs Quart and an ASGI server, which are not required by the Flask app:
+
+    pip install quart hypercorn redis
+    LIBRARY_CACHE_BACKEND=redis hypercorn --workers 4 --bind 127.0.0.1:5050 async_app:app
+    LIBRARY_CACHE_BACKEND=redis uvicorn --workers 4 --port 5050 async_app:app
+"""
+import asyncio
+import datetime
+import logging
+
+import mysql.connector
+from quart import Quart, Response, jsonify, request
+from quart.json.provider import DefaultJSONProvider
+
+import async_db
+import statements
+from catalog_cache import AsyncLocalVersionStore, AsyncRedisVersionStore, CatalogCache
+from catalog_search import MIN_TOKEN_LENGTH, search_query, search_results, split_terms
+from checkout_engine import CheckoutError
+from db_pool import PoolTimeoutError
+from serializers import Table, negotiate_format, render
+from settings import ConfigError, Settings
+
+
+class LibraryJSONProvider(DefaultJSONProvider):
+    # DATE and DATETIME columns are sent as ISO 8601, as in the Flask app
+    @staticmethod
+    def default(o):
+        if isinstance(o, (datetime.date, datetime.datetime)):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
+
+
+logger = logging.getLogger('library.async_app')
+
+app = Quart(__name__)
+app.json = LibraryJSONProvider(app)
+
+settings = Settings()
+
+# Same sections and defaults as the Flask app, so one config file serves both
+db_config = settings.section('db', {
+    'host': 'localhost',
+    'user': 'user',
+    'password': 'password',
+    'database': 'library'
+})
+
+# 'prepare_statements' is accepted for compatibility; the async driver runs every statement as text
+pool_config = settings.section('pool', {
+    'size': 10,
+    'timeout': 5.0,
+    'recycle': 1800,
+    'ping_interval': 30,
+    'prepare_statements': True
+})
+
+cache_config = settings.section('cache', {
+    'max_entries': 10000,
+    'ttl': 300.0,
+    'backend': 'local',
+    'redis_url': 'redis://localhost:6379/0'
+})
+
+
+def unsupported_config(settings, cache_config):
+    """The settings this app cannot honour, as messages; empty when it can serve alongside the Flask app."""
+    problems = []
+    if settings.value('cart', 'mode', 'db') != 'db':
+        problems.append("cart.mode must be 'db'; write-back carts live in the Flask app's processes")
+    if settings.value('inventory', 'enabled', False):
+        problems.append("inventory.enabled must be false; checkouts here take stock from Books.bookCount")
+    if settings.value('event', 'enabled', False):
+        problems.append("event.enabled must be false; checkouts here write their summaries themselves")
+    cache_enabled = cache_config['max_entries'] > 0 and cache_config['ttl'] > 0
+    if cache_enabled and cache_config['backend'] != 'redis':
+        problems.append("cache.backend must be 'redis' (or the cache turned off with cache.max_entries=0) "
+                        "so catalog writes made through the Flask app reach this cache")
+    return problems
+
+
+config_problems = unsupported_config(settings, cache_config)
+if config_problems:
+    raise ConfigError("async_app cannot serve with this configuration: " + "; ".join(config_problems))
+
+db_pool = async_db.AsyncConnectionPool(db_config, pool_config['size'], pool_config['timeout'],
+                                       pool_config['recycle'], pool_config['ping_interval'])
+
+# Table versions are read and bumped through redis.asyncio, never on the cache itself, so a
+# cached read does not block the event loop on a Redis round trip
+if cache_config['backend'] == 'redis':
+    version_store = AsyncRedisVersionStore(cache_config['redis_url'])
+else:
+    # Only with the cache turned off (see unsupported_config), so no entry outlives a write
+    version_store = AsyncLocalVersionStore()
+catalog_cache = CatalogCache(cache_config['max_entries'], cache_config['ttl'])
+
+BOOK_LIST_TABLES = ('Books',)
+BOOK_DETAIL_TABLES = ('Books', 'Authors', 'Genres', 'Book_Authors', 'Book_Genres')
+BOOK_SEARCH_TABLES = BOOK_DETAIL_TABLES + ('Publishers',)
+
+
+@app.before_serving
+async def warm_up():
+    try:
+        await db_pool.warm()
+    except mysql.connector.Error as e:
+        # Serve anyway; connections are opened on demand once the database is back
+        logger.warning("Could not warm up the connection pool: %s", e)
+
+
+@app.after_serving
+async def shutdown():
+    await db_pool.close()
+    await version_store.close()
+
+
+async def cache_get(key, tables):
+    """catalog_cache.get with the table versions read without blocking. Returns (value or None, versions)."""
+    versions = await version_store.get(tables)
+    return catalog_cache.lookup(key, versions), versions
+
+
+def table_response(table, fmt, json_body=None, extra=None):
+    response = Response(render(table, fmt, json_body, extra), mimetype=fmt)
+    response.vary.add('Accept')
+    return response
+
+
+@app.errorhandler(PoolTimeoutError)
+async def pool_timeout(e):
+    return jsonify({"error": str(e)}), 503
+
+
+@app.route('/stats/pool', methods=['GET'])
+async def pool_stats():
+    return jsonify(db_pool.stats())
+
+
+@app.route('/stats/cache', methods=['GET'])
+async def cache_stats():
+    return jsonify(catalog_cache.stats())
+
+
+BOOKS_PAGE_DEFAULT = 100
+BOOKS_PAGE_MAX = 1000
+
+
+@app.route('/books/all', methods=['GET'])
+async def get_all_books():
+    limit = request.args.get('limit')
+    after = request.args.get('after')
+
+    try:
+        after = int(after) if after is not None else 0
+        if limit is not None:
+            limit = min(int(limit), BOOKS_PAGE_MAX)
+            if limit <= 0:
+                raise ValueError
+        elif after:
+            limit = BOOKS_PAGE_DEFAULT
+    except ValueError:
+        return jsonify({"error": "limit and after must be positive integers."}), 400
+
+    fmt = negotiate_format(request.accept_mimetypes)
+    key = ('books/all', after, limit)
+    try:
+        books, versions = await cache_get(key, BOOK_LIST_TABLES)
+        if books is None:
+            books = await load_books(after, limit)
+            catalog_cache.put(key, versions, books)
+    except mysql.connector.Error as e:
+        return jsonify({"error": str(e)}), 500
+
+    extra = {}
+    if limit is not None:
+        extra["next_after"] = books.rows[-1][books.columns.index('bookID')] if len(books) == limit else None
+    return table_response(books, fmt, lambda: {"books": books.records(), **extra}, extra)
+
+
+async def load_books(after, limit):
+    async with db_pool.connection() as connection:
+        if limit is None:
+            cur = await async_db.execute(connection, statements.BOOKS_ALL)
+        else:
+            # Keyset pagination: seek past the last bookID the client has seen
+            cur = await async_db.execute(connection, statements.BOOKS_PAGE, (after, limit))
+        try:
+            rows = await cur.fetchall()
+            return Table([column[0] for column in cur.description], rows)
+        finally:
+            await cur.close()
+
+
+SEARCH_PAGE_DEFAULT = 20
+SEARCH_PAGE_MAX = 100
+SEARCH_OFFSET_MAX = 1000
+
+
+@app.route('/books/search', methods=['GET'])
+async def search_catalog():
+    text = request.args.get('q', '').strip()
+    genre = request.args.get('genre')
+    publisher = request.args.get('publisher')
+    available = request.args.get('available')
+
+    if not text:
+        return jsonify({"error": "A search query is required."}), 400
+    try:
+        limit = min(int(request.args.get('limit', SEARCH_PAGE_DEFAULT)), SEARCH_PAGE_MAX)
+        offset = int(request.args.get('offset', 0))
+        if limit <= 0 or offset < 0 or offset > SEARCH_OFFSET_MAX:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": f"limit must be positive and offset between 0 and {SEARCH_OFFSET_MAX}."}), 400
+    if available is not None:
+        if available not in ('0', '1'):
+            return jsonify({"error": "available must be 0 or 1."}), 400
+        available = available == '1'
+    terms, ignored = split_terms(text)
+    if not terms:
+        return jsonify({"error": f"Search terms must be at least {MIN_TOKEN_LENGTH} characters long.",
+                        "ignored_terms": ignored}), 400
+
+    key = ('books/search', text.lower(), genre, publisher, available, limit, offset)
+    try:
+        found, versions = await cache_get(key, BOOK_SEARCH_TABLES)
+        if found is None:
+            found = await search(text, genre, publisher, available, limit, offset)
+            catalog_cache.put(key, versions, found)
+    except mysql.connector.Error as e:
+        return jsonify({"error": "An error occurred: " + str(e)}), 500
+
+    results, has_more = found
+    return jsonify({
+        "results": results,
+        "next_offset": offset + limit if has_more else None,
+        "ignored_terms": ignored
+    })
+
+
+async def search(text, genre, publisher, available, limit, offset):
+    query = search_query(text, genre, publisher, available, limit, offset)
+    if query is None:
+        return [], False
+    async with db_pool.connection() as connection:
+        cur = await connection.cursor()
+        try:
+            await cur.execute(*query)
+            rows = await cur.fetchall()
+            return search_results([column[0] for column in cur.description], rows, limit)
+        finally:
+            await cur.close()
+
+
+BOOK_DETAILS_MAX_IDS = 500
+
+
+async def fetch_on_own_connection(fetch, statement, params):
+    async with db_pool.connection() as connection:
+        return await fetch(connection, statement, params)
+
+
+async def fetch_book_details(book_ids):
+    """
+    Loads books with their authors and genres. The three queries are independent, so they
+    run at the same time on three pooled connections; each gives its connection back as
+    soon as it is done, so a request never holds one connection while waiting for another.
+    """
+    if not book_ids:
+        return {}
+    params = tuple(book_ids)
+    books, authors, genres = await asyncio.gather(
+        fetch_on_own_connection(async_db.fetch_dicts, statements.BOOKS_BY_IDS.expand(len(params)), params),
+        fetch_on_own_connection(async_db.fetchall, statements.AUTHORS_BY_BOOK_IDS.expand(len(params)), params),
+        fetch_on_own_connection(async_db.fetchall, statements.GENRES_BY_BOOK_IDS.expand(len(params)), params))
+
+    details = {}
+    for book in books:
+        details[book['bookID']] = {"book": book, "authors": [], "genres": []}
+    for book_id, name in authors:
+        if book_id in details:
+            details[book_id]["authors"].append(name)
+    for book_id, genre_name in genres:
+        if book_id in details:
+            details[book_id]["genres"].append(genre_name)
+    return details
+
+
+async def get_cached_book_details(book_ids):
+    details = {}
+    missing = []
+    # Every entry depends on the same tables, so one versions read serves them all
+    versions = await version_store.get(BOOK_DETAIL_TABLES)
+    for book_id in book_ids:
+        cached = catalog_cache.lookup(('book', book_id), versions)
+        if cached is None:
+            missing.append(book_id)
+        else:
+            details[book_id] = cached
+
+    if missing:
+        loaded = await fetch_book_details(missing)
+        for book_id, book_details in loaded.items():
+            catalog_cache.put(('book', book_id), versions, book_details)
+        details.update(loaded)
+
+    return details
+
+
+@app.route('/books/<int:book_id>', methods=['GET'])
+async def get_book_details(book_id):
+    details = await get_cached_book_details([book_id])
+
+    if book_id not in details:
+        return jsonify({"error": "Book not found."}), 404
+    return jsonify(details[book_id])
+
+
+@app.route('/books/details', methods=['GET'])
+async def get_books_details():
+    ids = request.args.get('ids', '')
+    try:
+        book_ids = list(dict.fromkeys(int(book_id) for book_id in ids.split(',') if book_id.strip()))
+    except ValueError:
+        return jsonify({"error": "ids must be a comma-separated list of book IDs."}), 400
+
+    if not book_ids:
+        return jsonify({"error": "At least one book ID is required."}), 400
+    if len(book_ids) > BOOK_DETAILS_MAX_IDS:
+        return jsonify({"error": f"At most {BOOK_DETAILS_MAX_IDS} book IDs can be requested at once."}), 400
+
+    try:
+        details = await get_cached_book_details(book_ids)
+    except mysql.connector.Error as e:
+        return jsonify({"error": "An error occurred: " + str(e)}), 500
+
+    return jsonify({
+        "books": [details[book_id] for book_id in book_ids if book_id in details],
+        "missing": [book_id for book_id in book_ids if book_id not in details]
+    })
+
+
+# Column names of /reports/advanced rows
+REPORT_COLUMNS = ('user_name', 'book_title', 'loan_count', 'publisher_name', 'cart_count')
+
+
+async def fetch_top_loans(connection, limit=10):
+    # As report_summaries.fetch_top_loans: find the limit-th loan count, then join only the pairs at or above it
+    threshold = await async_db.fetchone(connection, statements.TOP_LOANS_THRESHOLD, (limit - 1,))
+    threshold = threshold[0] if threshold else 0
+
+    rows = await async_db.fetchall(connection, statements.TOP_LOANS, (threshold, limit))
+    if len(rows) < limit and threshold > 1:
+        rows = await async_db.fetchall(connection, statements.TOP_LOANS, (1, limit))
+    return rows
+
+
+@app.route('/reports/advanced', methods=['GET'])
+async def advanced_report():
+    try:
+        async with db_pool.connection() as connection:
+            report_data = await fetch_top_loans(connection, 10)
+    except mysql.connector.Error as e:
+        return jsonify({"error": str(e)}), 500
+
+    return table_response(Table(REPORT_COLUMNS, report_data), negotiate_format(request.accept_mimetypes))
+
+
+@app.route('/register_user', methods=['POST'])
+async def register_user():
+    form = await request.form
+    name = form.get('name')
+    contact_details = form.get('contactDetails')
+
+    if not name or not contact_details:
+        return jsonify({"error": "Missing name or contact details in request."}), 400
+
+    try:
+        async with db_pool.connection() as connection:
+            if await async_db.fetchone(connection, statements.USER_BY_CONTACT, (contact_details,)):
+                return jsonify({"error": "Email ID already registered."}), 409
+
+            await async_db.write(connection, statements.INSERT_USER, (name, contact_details))
+            await connection.commit()
+        return jsonify({"message": "User registered successfully!"}), 201
+
+    except mysql.connector.Error as db_err:
+        # Uncommitted work is rolled back when the connection goes back to the pool
+        return jsonify({"error": "Database error: " + str(db_err)}), 500
+
+
+@app.route('/add_to_cart', methods=['POST'])
+async def add_to_cart():
+    form = await request.form
+    cart_id = form.get('cartID')
+    book_id = form.get('bookID')
+
+    async with db_pool.connection() as connection:
+        # Check if the cart exists for the provided cartID
+        cart = await async_db.fetchone(connection, statements.CART_BY_ID, (cart_id,))
+        if not cart:
+            return jsonify({"error": "Cart not found. Please create a cart first."}), 404
+
+        book_result = await async_db.fetchone(connection, statements.BOOK_TITLE, (book_id,))
+        if not book_result:
+            return jsonify({"error": "Book not found."}), 404
+
+        await async_db.write(connection, statements.INSERT_CART_ITEM, (cart_id, book_id, book_result[0]))
+        await async_db.write(connection, statements.CART_SUMMARY_ADD, (book_id,))
+        await connection.commit()
+
+    return jsonify({"message": "Book added to cart successfully!"}), 201
+
+
+@app.route('/remove_from_cart', methods=['POST'])
+async def remove_from_cart():
+    form = await request.form
+    cart_id = form.get('cartID')
+    book_id = form.get('bookID')
+
+    try:
+        async with db_pool.connection() as connection:
+            item = await async_db.fetchone(connection, statements.CART_ITEM, (cart_id, book_id))
+            if not item:
+                return jsonify({"error": "Book not found in the cart."}), 404
+
+            await async_db.write(connection, statements.DELETE_CART_ITEM, (cart_id, book_id))
+            await async_db.write(connection, statements.CART_SUMMARY_REMOVE, (book_id,))
+            await connection.commit()
+        return jsonify({"message": "Book removed from cart successfully."}), 200
+    except mysql.connector.Error as e:
+        return jsonify({"error": "An error occurred: " + str(e)}), 500
+
+
+@app.route('/view_cart', methods=['GET'])
+async def view_cart():
+    cart_id = request.args.get('cartID')
+    if not cart_id:
+        return jsonify({"error": "Cart ID is required."}), 400
+
+    try:
+        async with db_pool.connection() as connection:
+            cart = await async_db.fetchone(connection, statements.CART_BY_ID, (cart_id,))
+            if not cart:
+                return jsonify({"error": "Cart not found."}), 404
+
+            books_in_cart = [book[0] for book in await async_db.fetchall(connection, statements.CART_TITLES,
+                                                                         (cart_id,))]
+    except mysql.connector.Error as e:
+        return jsonify({"error": "An error occurred: " + str(e)}), 500
+
+    table = Table(('title',), [(title,) for title in books_in_cart])
+    return table_response(table, negotiate_format(request.accept_mimetypes),
+                          lambda: {"books_in_cart": books_in_cart})
+
+
+async def checkout_cart(connection, user_id, cart_id):
+    """checkout_engine.checkout_cart on an async connection; the caller rolls back on error."""
+    # Lock the cart's books in bookID order so concurrent checkouts queue instead of deadlocking
+    items = await async_db.fetchall(connection, statements.CHECKOUT_LOCK_ITEMS, (cart_id,))
+    if not items:
+        raise CheckoutError("Cart is empty or does not exist.")
+
+    unavailable = [book_id for book_id, count, status in items
+                   if count is None or count <= 0 or status != 1]
+    if unavailable:
+        raise CheckoutError("Some books are not available for checkout.", unavailable)
+
+    decremented, _ = await async_db.write(connection, statements.CHECKOUT_DECREMENT, (cart_id,))
+    if decremented != len(items):
+        raise CheckoutError("Book availability changed during checkout.")
+
+    await async_db.write(connection, statements.CHECKOUT_LOG_LOANS, (user_id, cart_id))
+    # The summaries must be updated before the cart's Cart_Items rows are deleted
+    await async_db.write(connection, statements.CHECKOUT_LOAN_SUMMARY, (user_id, cart_id))
+    await async_db.write(connection, statements.CHECKOUT_CART_SUMMARY, (cart_id,))
+    await async_db.write(connection, statements.CHECKOUT_CLEAR_CART, (cart_id,))
+    await connection.commit()
+    return [item[0] for item in items]
+
+
+@app.route('/checkout', methods=['POST'])
+async def checkout():
+    form = await request.form
+    user_name = form.get('userName')
+    cart_id = form.get('cartID')
+
+    try:
+        async with db_pool.connection() as connection:
+            user_result = await async_db.fetchone(connection, statements.USER_BY_NAME, (user_name,))
+            if not user_result:
+                return jsonify({"error": "User not found."}), 404
+
+            book_ids = await checkout_cart(connection, user_result[0], cart_id)
+        await version_store.bump(('Books',))
+        return jsonify({"message": "Checkout successful.", "bookIDs": book_ids}), 200
+
+    except CheckoutError as checkout_err:
+        if checkout_err.unavailable:
+            return jsonify({"error": str(checkout_err), "unavailable": checkout_err.unavailable}), 409
+        return jsonify({"error": str(checkout_err)}), 400
+    except mysql.connector.Error as db_err:
+        return jsonify({"error": "Database error: " + str(db_err)}), 500
@@ -0,0 +1,241 @@
+"""
+Asyncio connection pool and statement helpers for the async service (async_app.py).
+
+The pool keeps the contract of db_pool.ConnectionPool: at most size connections,
+acquire() waits up to timeout and then raises PoolTimeoutError, old connections are
+recycled and idle ones pinged before reuse, and a connection is rolled back when it is
+handed back. Connections come from mysql.connector.aio, so a query waits on its socket
+without holding a thread, and one event loop has as many queries in flight as the pool
+has connections.
+
+The helpers run the SQL of statements.py on plain cursors.
+"""
+import asyncio
+import contextlib
+import time
+from collections import deque
+
+import mysql.connector
+import mysql.connector.aio
+
+from db_pool import PoolTimeoutError
+
+
+class AsyncPooledConnection:
+    """A borrowed connection. Awaiting close() hands it back to the pool."""
+
+    def __init__(self, pool, connection, created_at):
+        self._pool = pool
+        self._connection = connection
+        self.created_at = created_at
+        self.last_used = time.monotonic()
+        self._returned = False
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    async def close(self):
+        if self._returned:
+            return
+        self._returned = True
+        await self._pool.release(self)
+
+
+class AsyncConnectionPool:
+    def __init__(self, config, size=10, timeout=5.0, recycle=1800, ping_interval=30):
+        self.config = config
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+
+        self._idle = deque()
+        self._created = 0
+        self._in_use = 0
+        self._closed = False
+        # Bound to the running loop on first use
+        self._cond = asyncio.Condition()
+
+        self._waits = 0
+        self._wait_time = 0.0
+        self._timeouts = 0
+        self._recycled = 0
+        self._borrowed = 0
+
+    async def _connect(self):
+        return await mysql.connector.aio.connect(**self.config)
+
+    async def _discard(self, pooled):
+        try:
+            await pooled._connection.close()
+        except mysql.connector.Error:
+            pass
+        async with self._cond:
+            self._created -= 1
+            self._cond.notify()
+
+    async def _is_healthy(self, pooled):
+        if self.recycle and time.monotonic() - pooled.created_at > self.recycle:
+            return False
+        if self.ping_interval and time.monotonic() - pooled.last_used > self.ping_interval:
+            try:
+                await pooled._connection.ping(reconnect=False)
+            except mysql.connector.Error:
+                return False
+        return True
+
+    async def acquire(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+
+        while True:
+            async with self._cond:
+                while not self._idle and self._created >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeoutError(
+                            f"Timed out after {self.timeout}s waiting for a database connection.")
+                    if not waited:
+                        waited = True
+                        self._waits += 1
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass
+
+                if self._idle:
+                    pooled = self._idle.pop()
+                else:
+                    pooled = None
+                    self._created += 1
+
+            if pooled is None:
+                try:
+                    connection = await self._connect()
+                except BaseException:
+                    async with self._cond:
+                        self._created -= 1
+                        self._cond.notify()
+                    raise
+                pooled = AsyncPooledConnection(self, connection, time.monotonic())
+            elif not await self._is_healthy(pooled):
+                self._recycled += 1
+                await self._discard(pooled)
+                continue
+
+            pooled._returned = False
+            self._in_use += 1
+            self._borrowed += 1
+            if waited:
+                self._wait_time += time.monotonic() - start
+            return pooled
+
+    async def release(self, pooled):
+        self._in_use -= 1
+
+        if self._closed:
+            await self._discard(pooled)
+            return
+
+        # Never hand a connection with leftover transaction state to the next borrower
+        connection = pooled._connection
+        try:
+            if connection.unread_result:
+                await connection.consume_results()
+            if connection.in_transaction:
+                await connection.rollback()
+        except mysql.connector.Error:
+            await self._discard(pooled)
+            return
+
+        pooled.last_used = time.monotonic()
+        async with self._cond:
+            self._idle.append(pooled)
+            self._cond.notify()
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        pooled = await self.acquire()
+        try:
+            yield pooled
+        finally:
+            await pooled.close()
+
+    async def warm(self, count=None):
+        """Opens up to count connections (default: the pool size) ahead of the first requests. Returns how many."""
+        count = min(self.size, count or self.size)
+        borrowed = []
+        try:
+            while len(borrowed) < count:
+                borrowed.append(await self.acquire())
+        finally:
+            for pooled in borrowed:
+                await pooled.close()
+        return len(borrowed)
+
+    async def close(self):
+        """Closes the idle connections; borrowed ones are closed as they come back after this."""
+        async with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+        for pooled in idle:
+            await self._discard(pooled)
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "open": self._created,
+            "in_use": self._in_use,
+            "idle": len(self._idle),
+            "borrowed": self._borrowed,
+            "waits": self._waits,
+            "wait_time": round(self._wait_time, 6),
+            "timeouts": self._timeouts,
+            "recycled": self._recycled
+        }
+
+
+async def execute(connection, statement, params=()):
+    """Runs a statement and returns its open cursor for reading the rows; the caller closes it."""
+    cur = await connection.cursor()
+    try:
+        await cur.execute(statement.sql, params)
+    except BaseException:
+        await cur.close()
+        raise
+    return cur
+
+
+async def write(connection, statement, params=()):
+    """Runs an INSERT, UPDATE or DELETE and closes its cursor. Returns (rowcount, lastrowid)."""
+    cur = await execute(connection, statement, params)
+    try:
+        return cur.rowcount, cur.lastrowid
+    finally:
+        await cur.close()
+
+
+async def fetchall(connection, statement, params=()):
+    cur = await execute(connection, statement, params)
+    try:
+        return await cur.fetchall()
+    finally:
+        await cur.close()
+
+
+async def fetchone(connection, statement, params=()):
+    rows = await fetchall(connection, statement, params)
+    return rows[0] if rows else None
+
+
+async def fetch_dicts(connection, statement, params=()):
+    cur = await execute(connection, statement, params)
+    try:
+        rows = await cur.fetchall()
+        columns = [column[0] for column in cur.description]
+    finally:
+        await cur.close()
+    return [dict(zip(columns, row)) for row in rows]
@@ -0,0 +1,105 @@
+"""
+Side-by-side load test of the Flask app and its asyncio variant (async_app.py).
+
+Runs the scenarios of bench_routes.py at each concurrency level against both servers,
+one after the other, and reports each run as bench_routes does plus the async/sync ratio
+of throughput and p99 latency per scenario and route. Throughput ratios above 1 and p99
+ratios below 1 favour the async app.
+
+Start both servers on the same database with the same number of processes and the same
+pool size, so they differ only in how a process waits for the database:
+
+    python benchmarks/datagen.py --database library_bench --scale 100000
+    export LIBRARY_DB_DATABASE=library_bench LIBRARY_POOL_SIZE=20
+    python server.py --bind 127.0.0.1:5040 --workers 4 --threads 20
+    hypercorn --workers 4 --bind 127.0.0.1:5050 async_app:app
+    python benchmarks/async_vs_sync.py --concurrency 64,256 --output async_vs_sync.json
+
+The cart scenario writes to the carts listed in the manifest; both servers share them, so
+checkouts in the second run can see carts emptied by the first and answer 400.
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_routes import catalog_iteration, make_cart_iteration, report_iteration, run_scenario
+from common import write_report
+
+
+def ratio(numerator, denominator):
+    return round(numerator / denominator, 3) if numerator is not None and denominator else None
+
+
+def compare_runs(sync_result, async_result):
+    routes = {}
+    for route, sync_stats in sync_result["routes"].items():
+        async_stats = async_result["routes"].get(route)
+        if async_stats is None:
+            continue
+        routes[route] = {
+            "throughput_ratio": ratio(async_stats["throughput_per_s"], sync_stats["throughput_per_s"]),
+            "p99_ratio": ratio(async_stats["p99_ms"], sync_stats["p99_ms"])
+        }
+    return {
+        "scenario": sync_result["scenario"],
+        "concurrency": sync_result["concurrency"],
+        "throughput_ratio": ratio(async_result["throughput_per_s"], sync_result["throughput_per_s"]),
+        "routes": routes
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sync-url', default='http://127.0.0.1:5040')
+    parser.add_argument('--async-url', default='http://127.0.0.1:5050')
+    parser.add_argument('--manifest', default='bench_manifest.json')
+    parser.add_argument('--scenarios', default='catalog,report,cart')
+    parser.add_argument('--concurrency', default='64,256', help='Comma-separated client concurrency levels.')
+    parser.add_argument('--duration', type=float, default=20.0, help='Seconds per server, scenario and level.')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--seed', type=int, default=431)
+    parser.add_argument('--output', help='Also write the JSON report to this file.')
+    args = parser.parse_args()
+
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+
+    scenarios = {
+        'catalog': catalog_iteration,
+        'report': report_iteration,
+        'cart': make_cart_iteration(manifest)
+    }
+    levels = [int(level) for level in args.concurrency.split(',')]
+    servers = {'sync': args.sync_url, 'async': args.async_url}
+
+    results = {name: [] for name in servers}
+    comparison = []
+    for scenario in args.scenarios.split(','):
+        for concurrency in levels:
+            runs = {}
+            for name, url in servers.items():
+                print(f"Running {scenario} at concurrency {concurrency} against the {name} app", file=sys.stderr)
+                # run_scenario reads the server from args.base_url
+                run_args = argparse.Namespace(**vars(args), base_url=url)
+                runs[name] = run_scenario(scenario, scenarios[scenario], run_args, manifest, concurrency)
+                results[name].append(runs[name])
+            comparison.append(compare_runs(runs['sync'], runs['async']))
+
+    report = {
+        "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "sync_url": args.sync_url,
+        "async_url": args.async_url,
+        "duration_s": args.duration,
+        "comparison": comparison,
+        "sync": results['sync'],
+        "async": results['async']
+    }
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
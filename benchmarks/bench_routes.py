@@ -0,0 +1,232 @@
+"""
+Load benchmark for the application's HTTP routes.
+
+Runs each scenario at every requested concurrency level against a running server and
+reports throughput, error counts and p50/p95/p99 latency per route as JSON. Generate the
+data first with datagen.py and point --manifest at the manifest it wrote.
+
+    python benchmarks/datagen.py --database library_bench --scale 100000
+    LIBRARY_DB_DATABASE=library_bench python server.py --bind 127.0.0.1:5040
+    python benchmarks/bench_routes.py --base-url http://127.0.0.1:5040 --concurrency 1,8,32 --output run.json
+    python benchmarks/bench_routes.py ... --compare run.json      # report changes against an earlier run
+
+Scenarios:
+  catalog  /books/all pages, /books/<id>, /books/details and /books/search
+  report   /reports/advanced
+  cart     add_to_cart x3, view_cart, remove_from_cart and checkout on a generated cart
+"""
+import argparse
+import datetime
+import http.client
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import percentile, write_report
+
+
+class Client:
+    """One keep-alive HTTP connection per worker thread."""
+
+    def __init__(self, base_url, timeout):
+        parsed = urllib.parse.urlsplit(base_url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.timeout = timeout
+        self.connection = None
+
+    def request(self, method, path, form=None):
+        body = None
+        headers = {}
+        if form is not None:
+            body = urllib.parse.urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        for attempt in (1, 2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.connection.request(method, path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                response.read()
+                return response.status
+            except (http.client.HTTPException, OSError):
+                self.connection.close()
+                self.connection = None
+                if attempt == 2:
+                    raise
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def timed(self, client, route, method, path, form=None, ok=(200, 201, 304)):
+        start = time.perf_counter()
+        try:
+            status = client.request(method, path, form)
+        except (http.client.HTTPException, OSError):
+            status = None
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.samples[route].append(elapsed)
+            if status not in ok:
+                self.errors[route] += 1
+        return status
+
+
+def catalog_iteration(client, recorder, rng, manifest):
+    first_book = manifest["first_ids"]["books"]
+    books = manifest["sizes"]["books"]
+    book_id = first_book + rng.randrange(books)
+    recorder.timed(client, 'GET /books/all', 'GET', f"/books/all?limit=100&after={book_id - 1}")
+    recorder.timed(client, 'GET /books/<id>', 'GET', f"/books/{book_id}")
+    ids = ','.join(str(first_book + rng.randrange(books)) for _ in range(20))
+    recorder.timed(client, 'GET /books/details', 'GET', f"/books/details?ids={ids}")
+    term = rng.choice(manifest["search_terms"])
+    recorder.timed(client, 'GET /books/search', 'GET', f"/books/search?q={term}")
+
+
+def report_iteration(client, recorder, rng, manifest):
+    recorder.timed(client, 'GET /reports/advanced', 'GET', "/reports/advanced")
+
+
+def make_cart_iteration(manifest):
+    carts = itertools.count()
+    lock = threading.Lock()
+
+    def cart_iteration(client, recorder, rng, manifest):
+        with lock:
+            index = next(carts) % manifest["sizes"]["carts"]
+        cart_id = manifest["first_ids"]["carts"] + index
+        user_name = manifest["user_name_pattern"].format(index=index)
+        first_book = manifest["first_ids"]["books"]
+        book_ids = rng.sample(range(first_book, first_book + manifest["sizes"]["books"]), 3)
+        for book_id in book_ids:
+            recorder.timed(client, 'POST /add_to_cart', 'POST', "/add_to_cart",
+                           {"cartID": cart_id, "bookID": book_id})
+        recorder.timed(client, 'GET /view_cart', 'GET', f"/view_cart?cartID={cart_id}")
+        recorder.timed(client, 'POST /remove_from_cart', 'POST', "/remove_from_cart",
+                       {"cartID": cart_id, "bookID": book_ids[0]})
+        # A cart holding a book that ran out of copies is a legitimate 409, not a failure
+        recorder.timed(client, 'POST /checkout', 'POST', "/checkout",
+                       {"userName": user_name, "cartID": cart_id}, ok=(200, 409))
+
+    return cart_iteration
+
+
+def run_scenario(name, iteration, args, manifest, concurrency):
+    recorder = Recorder()
+    deadline = time.perf_counter() + args.duration
+
+    def worker(worker_id):
+        rng = random.Random(f"{args.seed}:{name}:{concurrency}:{worker_id}")
+        client = Client(args.base_url, args.timeout)
+        iterations = 0
+        while time.perf_counter() < deadline:
+            iteration(client, recorder, rng, manifest)
+            iterations += 1
+        return iterations
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        iterations = sum(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    routes = {}
+    for route, samples in sorted(recorder.samples.items()):
+        routes[route] = {
+            "requests": len(samples),
+            "errors": recorder.errors[route],
+            "throughput_per_s": round(len(samples) / elapsed, 2),
+            "p50_ms": round(percentile(samples, 50) * 1000, 3),
+            "p95_ms": round(percentile(samples, 95) * 1000, 3),
+            "p99_ms": round(percentile(samples, 99) * 1000, 3)
+        }
+    total = sum(route["requests"] for route in routes.values())
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "iterations": iterations,
+        "requests": total,
+        "throughput_per_s": round(total / elapsed, 2) if elapsed else None,
+        "routes": routes
+    }
+
+
+def compare(previous, current):
+    # Pair results by scenario, concurrency and route, then print the relative change
+    def index(report):
+        return {(r["scenario"], r["concurrency"], route): stats
+                for r in report["results"] for route, stats in r["routes"].items()}
+
+    before = index(previous)
+    for key, stats in sorted(index(current).items()):
+        if key not in before:
+            continue
+        old = before[key]
+        changes = []
+        for metric in ("throughput_per_s", "p50_ms", "p99_ms"):
+            if old[metric]:
+                changes.append(f"{metric} {100.0 * (stats[metric] - old[metric]) / old[metric]:+.1f}%")
+        print(f"{key[0]:8} c={key[1]:<4} {key[2]:28} " + ", ".join(changes), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://127.0.0.1:5040')
+    parser.add_argument('--manifest', default='bench_manifest.json')
+    parser.add_argument('--scenarios', default='catalog,report,cart')
+    parser.add_argument('--concurrency', default='1,8,32', help='Comma-separated client concurrency levels.')
+    parser.add_argument('--duration', type=float, default=20.0, help='Seconds per scenario and level.')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--seed', type=int, default=431)
+    parser.add_argument('--output', help='Also write the JSON report to this file.')
+    parser.add_argument('--compare', help='Earlier JSON report to compare this run against.')
+    args = parser.parse_args()
+
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    scenarios = {
+        'catalog': catalog_iteration,
+        'report': report_iteration,
+        'cart': make_cart_iteration(manifest)
+    }
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    results = []
+    for name in args.scenarios.split(','):
+        for concurrency in levels:
+            print(f"Running {name} at concurrency {concurrency}", file=sys.stderr)
+            results.append(run_scenario(name, scenarios[name], args, manifest, concurrency))
+
+    report = {
+        "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "base_url": args.base_url,
+        "duration_s": args.duration,
+        "manifest": manifest,
+        "results": results
+    }
+    write_report(report, args.output)
+    if previous:
+        compare(previous, report)
+
+
+if __name__ == '__main__':
+    main()
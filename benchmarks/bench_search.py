@@ -0,0 +1,123 @@
+"""
+Latency of /books/search queries against the 10ms target.
+
+Runs the search SQL of catalog_search.py straight on a pooled connection (no HTTP, no
+cache) for several kinds of queries built from the words datagen.py puts in titles,
+author names and genres: whole words, 3-letter words (matched whole, see MIN_PREFIX_LENGTH),
+4-letter prefixes of those words, two-word queries and rare terms that match almost nothing.
+For each kind it reports p50/p99 latency, the number of books the query matched and whether
+its p99 meets --target-ms, plus the EXPLAIN of one representative query, so a missed target
+can be traced to its plan. It exits with status 1 when any kind misses the target.
+
+    python benchmarks/datagen.py --database library_bench --scale 1000000
+    python benchmarks/bench_search.py --database library_bench --iterations 200 --output search.json
+
+The FULLTEXT indexes must exist (initialize_db creates them).
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import add_db_arguments, load_app_module, percentile, write_report
+from datagen import FIRST_NAMES, GENRES, WORDS
+
+
+def query_kinds(rng):
+    # (kind, text factory); every factory draws from the vocabulary datagen.py writes
+    return [
+        ('word', lambda: rng.choice(WORDS)),
+        ('prefix3', lambda: rng.choice(WORDS)[:3]),
+        ('prefix4', lambda: rng.choice(WORDS)[:4]),
+        ('two_words', lambda: ' '.join(rng.sample(WORDS, 2))),
+        ('author_first_name', lambda: rng.choice(FIRST_NAMES)),
+        ('genre', lambda: rng.choice(GENRES).split()[0]),
+        ('rare', lambda: f"zq{rng.randrange(10 ** 6):06d}")
+    ]
+
+
+def count_matches(cur, sql, params):
+    # The search SQL without its trailing LIMIT %s OFFSET %s, counted: how many candidate books were ranked
+    unlimited = sql.rsplit('LIMIT', 1)[0]
+    cur.execute(f"SELECT COUNT(*) FROM ({unlimited}) counted", params[:-2])
+    return cur.fetchone()[0]
+
+
+def explain(cur, sql, params):
+    cur.execute("EXPLAIN " + sql, params)
+    columns = [column[0] for column in cur.description]
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+
+def run_kind(app, search_query, kind, make_text, iterations, limit, target_ms):
+    connection = app.get_db_connection()
+    try:
+        cur = connection.cursor()
+        samples = []
+        for _ in range(iterations):
+            search = search_query(make_text(), limit=limit)
+            start = time.perf_counter()
+            cur.execute(*search)
+            cur.fetchall()
+            samples.append(time.perf_counter() - start)
+
+        example = make_text()
+        matched = count_matches(cur, *search_query(example, limit=limit))
+        plan = explain(cur, *search_query(example, limit=limit))
+    finally:
+        connection.close()
+
+    p99_ms = percentile(samples, 99) * 1000
+    return {
+        "kind": kind,
+        "example": example,
+        "queries": len(samples),
+        "matched_books_example": matched,
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p99_ms": round(p99_ms, 3),
+        "meets_target": p99_ms <= target_ms,
+        "explain": plan
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_db_arguments(parser)
+    parser.add_argument('--iterations', type=int, default=200, help='Queries per kind.')
+    parser.add_argument('--limit', type=int, default=20, help='Page size of each search.')
+    parser.add_argument('--target-ms', type=float, default=10.0)
+    parser.add_argument('--seed', type=int, default=431)
+    parser.add_argument('--output', help='Also write the JSON report to this file.')
+    args = parser.parse_args()
+
+    app = load_app_module(args.database, args.host, args.user, args.password)
+    from catalog_search import search_query
+
+    connection = app.get_db_connection()
+    try:
+        cur = connection.cursor()
+        cur.execute("SELECT COUNT(*) FROM Books")
+        books = cur.fetchone()[0]
+    finally:
+        connection.close()
+
+    rng = random.Random(args.seed)
+    results = []
+    for kind, make_text in query_kinds(rng):
+        print(f"Running {kind} queries", file=sys.stderr)
+        results.append(run_kind(app, search_query, kind, make_text, args.iterations, args.limit, args.target_ms))
+
+    for result in results:
+        print(f"{result['kind']:18} p99 {result['p99_ms']:9.3f} ms  "
+              f"{'meets' if result['meets_target'] else 'MISSES'} the {args.target_ms:g}ms target "
+              f"({result['matched_books_example']} books matched '{result['example']}')", file=sys.stderr)
+    write_report({"books": books, "target_ms": args.target_ms, "limit": args.limit, "results": results},
+                 args.output)
+    return 0 if all(result['meets_target'] for result in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
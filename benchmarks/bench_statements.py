@@ -0,0 +1,152 @@
+"""
+Prepared statements against the plain text protocol.
+
+Runs the hot routes' statements from statements.py through two connection pools, one
+sending SQL text on a new cursor per call (what every route did before) and one using
+the per-connection prepared statement cache. It reports per-statement latency, overall
+throughput at each thread count and the server's statement counters, which show how
+often MySQL had to parse SQL in each mode.
+
+    python benchmarks/datagen.py --database library_bench --scale 10000
+    python benchmarks/bench_statements.py --database library_bench --threads 1,8 --iterations 2000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import add_db_arguments, load_app_module, percentile, write_report
+
+# Server counters compared between modes; Com_stmt_prepare counts parses of prepared statements,
+# and for the text protocol every Com_select/Com_insert/... is a parse
+STATUS_COUNTERS = ('Questions', 'Com_select', 'Com_stmt_prepare', 'Com_stmt_execute', 'Com_stmt_close',
+                   'Prepared_stmt_count')
+
+
+def workload(statements, ids):
+    # (label, statement, parameter factory) for the statements the hot routes run most
+    return [
+        ('book_title', statements.BOOK_TITLE, lambda rng: (rng.choice(ids['books']),)),
+        ('books_by_ids[20]', statements.BOOKS_BY_IDS.expand(20), lambda rng: tuple(rng.sample(ids['books'], 20))),
+        ('authors_by_book_ids[20]', statements.AUTHORS_BY_BOOK_IDS.expand(20),
+         lambda rng: tuple(rng.sample(ids['books'], 20))),
+        ('cart_by_id', statements.CART_BY_ID, lambda rng: (rng.choice(ids['carts']),)),
+        ('cart_titles', statements.CART_TITLES, lambda rng: (rng.choice(ids['carts']),)),
+        ('user_by_name', statements.USER_BY_NAME, lambda rng: (rng.choice(ids['user_names']),)),
+        ('books_page', statements.BOOKS_PAGE, lambda rng: (rng.choice(ids['books']), 100))
+    ]
+
+
+def sample_ids(app):
+    connection = app.get_db_connection()
+    try:
+        cur = connection.cursor()
+        cur.execute("SELECT bookID FROM Books ORDER BY RAND() LIMIT 5000")
+        books = [row[0] for row in cur.fetchall()]
+        cur.execute("SELECT cartID FROM Cart ORDER BY RAND() LIMIT 5000")
+        carts = [row[0] for row in cur.fetchall()]
+        cur.execute("SELECT name FROM Users ORDER BY RAND() LIMIT 5000")
+        user_names = [row[0] for row in cur.fetchall()]
+    finally:
+        connection.close()
+    if len(books) < 20 or not carts or not user_names:
+        sys.exit("The database needs at least 20 books and some carts and users; run datagen.py first.")
+    return {'books': books, 'carts': carts, 'user_names': user_names}
+
+
+def server_status(connection):
+    cur = connection.cursor()
+    placeholders = ', '.join(['%s'] * len(STATUS_COUNTERS))
+    cur.execute(f"SHOW GLOBAL STATUS WHERE Variable_name IN ({placeholders})", STATUS_COUNTERS)
+    return {name: int(value) for name, value in cur.fetchall()}
+
+
+def run_mode(app, statements, prepared, threads, iterations, ids, seed):
+    pool = app.ConnectionPool(app.db_config, size=threads, prepare_statements=prepared)
+    work = workload(statements, ids)
+    latencies = {label: [] for label, _, _ in work}
+
+    def worker(worker_id):
+        rng = random.Random(f"{seed}:{prepared}:{threads}:{worker_id}")
+        samples = {label: [] for label, _, _ in work}
+        connection = pool.acquire()
+        try:
+            for _ in range(iterations):
+                for label, statement, make_params in work:
+                    params = make_params(rng)
+                    start = time.perf_counter()
+                    statements.fetchall(connection, statement, params)
+                    samples[label].append(time.perf_counter() - start)
+        finally:
+            connection.close()
+        return samples
+
+    # Warm every connection first so the prepared run is measured with its statements already prepared
+    warmup = [pool.acquire() for _ in range(threads)]
+    for connection in warmup:
+        for _, statement, make_params in work:
+            statements.fetchall(connection, statement, make_params(random.Random(seed)))
+    for connection in warmup:
+        connection.close()
+
+    probe = app.mysql.connector.connect(**app.db_config)
+    try:
+        before = server_status(probe)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for samples in executor.map(worker, range(threads)):
+                for label, values in samples.items():
+                    latencies[label].extend(values)
+        elapsed = time.perf_counter() - start
+        after = server_status(probe)
+    finally:
+        probe.close()
+
+    total = sum(len(values) for values in latencies.values())
+    return {
+        "mode": "prepared" if prepared else "text",
+        "threads": threads,
+        "statements_run": total,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(total / elapsed, 1),
+        "statements": {label: {
+            "p50_us": round(percentile(values, 50) * 1e6, 1),
+            "p99_us": round(percentile(values, 99) * 1e6, 1)
+        } for label, values in latencies.items()},
+        # Includes the probe's own SHOW STATUS and any other traffic on the server
+        "server_counters": {name: after.get(name, 0) - before.get(name, 0) for name in STATUS_COUNTERS}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_db_arguments(parser)
+    parser.add_argument('--threads', default='1,8', help='Comma-separated thread counts.')
+    parser.add_argument('--iterations', type=int, default=2000, help='Passes over the workload per thread.')
+    parser.add_argument('--seed', type=int, default=431)
+    parser.add_argument('--output', help='Also write the JSON report to this file.')
+    args = parser.parse_args()
+
+    app = load_app_module(args.database, args.host, args.user, args.password)
+    statements = app.statements
+    ids = sample_ids(app)
+
+    results = []
+    for threads in (int(value) for value in args.threads.split(',')):
+        for prepared in (False, True):
+            print(f"Running {'prepared' if prepared else 'text'} with {threads} threads", file=sys.stderr)
+            results.append(run_mode(app, statements, prepared, threads, args.iterations, ids, args.seed))
+
+    for text, prepared in zip(results[::2], results[1::2]):
+        print(f"threads={text['threads']}: prepared throughput "
+              f"{100.0 * (prepared['throughput_per_s'] / text['throughput_per_s'] - 1):+.1f}% vs text",
+              file=sys.stderr)
+    write_report({"iterations": args.iterations, "results": results}, args.output)
+
+
+if __name__ == '__main__':
+    main()
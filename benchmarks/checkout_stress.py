@@ -0,0 +1,186 @@
+"""
+Concurrency stress test for checkout.
+
+Seeds a scratch database with a few scarce books and many carts that compete for them,
+then runs the same workload through the old per-item loop and the set-based engine.
+Reports throughput and whether any copy was loaned out more times than it existed.
+
+    python benchmarks/checkout_stress.py --database library_bench --threads 32
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import add_db_arguments, ensure_database, load_app_module, percentile, write_report
+
+TITLE_PREFIX = 'stress-checkout-'
+
+
+def legacy_checkout(connection, user_id, cart_id):
+    # The original loop: SELECT, UPDATE and INSERT per item with no lock between check and decrement
+    cur = connection.cursor()
+    try:
+        cur.execute("SELECT bookID FROM Cart_Items WHERE cartID=%s", (cart_id,))
+        cart_items = cur.fetchall()
+        for item in cart_items:
+            book_id = item[0]
+            cur.execute("SELECT bookCount FROM Books WHERE bookID=%s AND availabilityStatus=1", (book_id,))
+            book = cur.fetchone()
+            if not book or book[0] <= 0:
+                raise Exception(f"Book ID {book_id} is not available for checkout.")
+            cur.execute("UPDATE Books SET bookCount = bookCount - 1 WHERE bookID=%s", (book_id,))
+            cur.execute("INSERT INTO Transactions (userID, bookID, borrowDate) VALUES (%s, %s, NOW())",
+                        (user_id, book_id))
+        cur.execute("DELETE FROM Cart_Items WHERE cartID=%s", (cart_id,))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+
+def seed(app, books, copies, carts, items_per_cart, seed_value):
+    rng = random.Random(seed_value)
+    connection = app.get_db_connection()
+    try:
+        cur = connection.cursor()
+        cleanup(cur)
+        cur.execute("INSERT INTO Publishers (publisherName, contactInfo) VALUES (%s, %s)",
+                    (TITLE_PREFIX + 'publisher', 'stress test'))
+        publisher_id = cur.lastrowid
+        cur.executemany("INSERT INTO Books (title, publicationDate, publisherID, bookCount) VALUES (%s, %s, %s, %s)",
+                        [(f"{TITLE_PREFIX}{i}", '2000-01-01', publisher_id, copies) for i in range(books)])
+        cur.execute("SELECT bookID FROM Books WHERE publisherID=%s", (publisher_id,))
+        book_ids = [row[0] for row in cur.fetchall()]
+
+        jobs = []
+        for i in range(carts):
+            cur.execute("INSERT INTO Users (name, contactDetails) VALUES (%s, %s)",
+                        (f"{TITLE_PREFIX}user-{i}", f"{TITLE_PREFIX}{i}@example.com"))
+            user_id = cur.lastrowid
+            cur.execute("INSERT INTO Cart (userID) VALUES (%s)", (user_id,))
+            cart_id = cur.lastrowid
+            picks = rng.sample(book_ids, min(items_per_cart, len(book_ids)))
+            cur.executemany("INSERT INTO Cart_Items (cartID, bookID, bookName) VALUES (%s, %s, %s)",
+                            [(cart_id, book_id, '') for book_id in picks])
+            jobs.append((user_id, cart_id))
+        connection.commit()
+        return book_ids, jobs
+    finally:
+        connection.close()
+
+
+def cleanup(cur):
+    pattern = TITLE_PREFIX + '%'
+    cur.execute('''DELETE ci FROM Cart_Items ci JOIN Cart c ON c.cartID = ci.cartID
+                   JOIN Users u ON u.userID = c.userID WHERE u.name LIKE %s''', (pattern,))
+    cur.execute('''DELETE c FROM Cart c JOIN Users u ON u.userID = c.userID WHERE u.name LIKE %s''', (pattern,))
+    cur.execute('''DELETE t FROM Transactions t JOIN Books b ON b.bookID = t.bookID WHERE b.title LIKE %s''',
+                (pattern,))
+    cur.execute('''DELETE ls FROM Loan_Summary ls JOIN Books b ON b.bookID = ls.bookID WHERE b.title LIKE %s''',
+                (pattern,))
+    cur.execute('''DELETE cs FROM Cart_Summary cs JOIN Books b ON b.bookID = cs.bookID WHERE b.title LIKE %s''',
+                (pattern,))
+    cur.execute("DELETE FROM Books WHERE title LIKE %s", (pattern,))
+    cur.execute("DELETE FROM Users WHERE name LIKE %s", (pattern,))
+    cur.execute("DELETE FROM Publishers WHERE publisherName LIKE %s", (pattern,))
+
+
+def verify(app, book_ids, copies):
+    connection = app.get_db_connection()
+    try:
+        cur = connection.cursor()
+        placeholders = ', '.join(['%s'] * len(book_ids))
+        cur.execute(f'''SELECT b.bookID, b.bookCount, COUNT(t.transactionID) FROM Books b
+                        LEFT JOIN Transactions t ON t.bookID = b.bookID
+                        WHERE b.bookID IN ({placeholders}) GROUP BY b.bookID, b.bookCount''', tuple(book_ids))
+        rows = cur.fetchall()
+    finally:
+        connection.close()
+    oversold = [book_id for book_id, count, loans in rows if count < 0 or loans > copies]
+    return {
+        "oversold_books": oversold,
+        "negative_counts": sum(1 for _, count, _ in rows if count < 0),
+        "loans": sum(loans for _, _, loans in rows)
+    }
+
+
+def run(app, name, checkout, jobs, threads):
+    latencies = []
+    outcomes = {"ok": 0, "rejected": 0, "error": 0}
+
+    def one(job):
+        user_id, cart_id = job
+        connection = app.get_db_connection()
+        start = time.perf_counter()
+        try:
+            checkout(connection, user_id, cart_id)
+            outcome = "ok"
+        except app.CheckoutError:
+            outcome = "rejected"
+        except Exception as e:
+            outcome = "rejected" if "not available" in str(e) else "error"
+        finally:
+            connection.close()
+        return outcome, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for outcome, latency in pool.map(one, jobs):
+            outcomes[outcome] += 1
+            latencies.append(latency)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "implementation": name,
+        "checkouts": len(jobs),
+        "elapsed_s": round(elapsed, 4),
+        "throughput_per_s": round(len(jobs) / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "outcomes": outcomes
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_db_arguments(parser)
+    parser.add_argument('--books', type=int, default=20)
+    parser.add_argument('--copies', type=int, default=5)
+    parser.add_argument('--carts', type=int, default=400)
+    parser.add_argument('--items-per-cart', type=int, default=5)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--seed', type=int, default=431)
+    parser.add_argument('--output', help='Also write the JSON report to this file.')
+    args = parser.parse_args()
+
+    app = load_app_module(args.database, args.host, args.user, args.password)
+    app.db_pool.size = max(app.db_pool.size, args.threads + 2)
+    ensure_database(app)
+
+    results = []
+    for name, checkout in (('legacy_loop', legacy_checkout), ('set_based', app.checkout_cart)):
+        book_ids, jobs = seed(app, args.books, args.copies, args.carts, args.items_per_cart, args.seed)
+        result = run(app, name, checkout, jobs, args.threads)
+        result.update(verify(app, book_ids, args.copies))
+        results.append(result)
+
+    connection = app.get_db_connection()
+    try:
+        cleanup(connection.cursor())
+        connection.commit()
+    finally:
+        connection.close()
+
+    write_report({"parameters": vars(args) | {"password": None}, "results": results}, args.output)
+    if results[-1]["oversold_books"]:
+        sys.exit("set-based checkout oversold books: %s" % results[-1]["oversold_books"])
+
+
+if __name__ == '__main__':
+    main()
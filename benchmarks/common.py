@@ -0,0 +1,55 @@
+import json
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app_module(database=None, host=None, user=None, password=None):
+    # The application file name is not importable as a module, so wsgi.py loads it by path
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    import wsgi
+    module = wsgi.load_app_module()
+
+    # The pool connects lazily and shares this dict, so overrides apply to every connection
+    overrides = {'database': database, 'host': host, 'user': user, 'password': password}
+    module.db_config.update({key: value for key, value in overrides.items() if value is not None})
+    return module
+
+
+def add_db_arguments(parser):
+    parser.add_argument('--host', default=None)
+    parser.add_argument('--user', default=None)
+    parser.add_argument('--password', default=None)
+    parser.add_argument('--database', default='library_bench',
+                        help='Scratch database; benchmark fixtures are written into it.')
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def write_report(report, output=None):
+    text = json.dumps(report, indent=2, sort_keys=True, default=str)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+def ensure_database(module):
+    import mysql.connector
+
+    config = dict(module.db_config)
+    database = config.pop('database')
+    connection = mysql.connector.connect(**config)
+    try:
+        connection.cursor().execute(f"CREATE DATABASE IF NOT EXISTS `{database}`")
+    finally:
+        connection.close()
+    module.initialize_db()
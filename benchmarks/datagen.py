@@ -0,0 +1,225 @@
+"""
+Deterministic synthetic data for load testing.
+
+Generates publishers, authors, genres, books with their author and genre links, users,
+carts, cart items and transactions. The same --seed and sizes always produce the same
+rows. IDs are assigned explicitly, starting after the highest ID already in each table,
+and every table is written in batches so memory stays flat at any scale.
+
+    python benchmarks/datagen.py --database library_bench --scale 100000 --manifest manifest.json
+
+The manifest records the generated ID ranges and name patterns for bench_routes.py.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import add_db_arguments, ensure_database, load_app_module
+
+GENRES = [
+    'Fantasy', 'Adventure', 'Dystopian', 'Historical Fiction', 'Science Fiction', 'Mystery', 'Thriller',
+    'Romance', 'Horror', 'Biography', 'Memoir', 'Poetry', 'Drama', 'Young Adult', 'Children', 'Classics',
+    'Graphic Novel', 'Humor', 'Philosophy', 'History', 'Science', 'Travel', 'Cooking', 'Self Help',
+    'Business', 'Politics', 'Religion', 'Art', 'Music', 'Sports'
+]
+WORDS = [
+    'shadow', 'river', 'crown', 'winter', 'empire', 'garden', 'silent', 'storm', 'glass', 'dragon',
+    'secret', 'light', 'ocean', 'forest', 'broken', 'golden', 'iron', 'night', 'stone', 'fire',
+    'city', 'star', 'house', 'wolf', 'song', 'memory', 'bridge', 'mountain', 'dream', 'letter',
+    'hollow', 'summer', 'thief', 'queen', 'island', 'journey', 'machine', 'harbor', 'lantern', 'tide'
+]
+FIRST_NAMES = ['Ada', 'Ben', 'Chloe', 'Dev', 'Elena', 'Farah', 'Gus', 'Hana', 'Ivan', 'Jia', 'Kofi', 'Lena',
+               'Marco', 'Nia', 'Omar', 'Priya', 'Quinn', 'Rosa', 'Sam', 'Tariq', 'Uma', 'Victor', 'Wen', 'Yara']
+LAST_NAMES = ['Adams', 'Brooks', 'Chen', 'Diaz', 'Evans', 'Fischer', 'Garcia', 'Haddad', 'Ito', 'Jones',
+              'Kim', 'Lopez', 'Moreau', 'Novak', 'Okafor', 'Patel', 'Quist', 'Rossi', 'Singh', 'Tanaka']
+
+START_DATE = datetime.date(2015, 1, 1)
+DATE_SPAN_DAYS = 365 * 10
+
+
+def sizes_for_scale(scale):
+    return {
+        "books": scale,
+        "publishers": max(scale // 200, 1),
+        "authors": max(scale // 5, 1),
+        "users": max(scale // 2, 1),
+        "carts": max(scale // 8, 1),
+        "cart_items": max(scale // 4, 1),
+        "transactions": scale * 2
+    }
+
+
+def next_id(cur, table, column):
+    cur.execute(f"SELECT COALESCE(MAX({column}), 0) + 1 FROM {table}")
+    return cur.fetchone()[0]
+
+
+def write_batches(connection, sql, rows, batch_size, label, total):
+    cur = connection.cursor()
+    batch = []
+    written = 0
+    start = time.monotonic()
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            cur.executemany(sql, batch)
+            connection.commit()
+            written += len(batch)
+            batch = []
+            rate = written / max(time.monotonic() - start, 1e-9)
+            print(f"  {label}: {written}/{total} ({rate:.0f} rows/s)", file=sys.stderr)
+    if batch:
+        cur.executemany(sql, batch)
+        connection.commit()
+        written += len(batch)
+    print(f"  {label}: {written} rows in {time.monotonic() - start:.1f}s", file=sys.stderr)
+    return written
+
+
+def random_date(rng):
+    return START_DATE + datetime.timedelta(days=rng.randrange(DATE_SPAN_DAYS))
+
+
+def generate(app, sizes, seed, batch_size):
+    tag = f"gen{seed}"
+    connection = app.get_db_connection()
+    try:
+        cur = connection.cursor()
+        base = {
+            "publishers": next_id(cur, 'Publishers', 'publisherID'),
+            "authors": next_id(cur, 'Authors', 'authorID'),
+            "genres": next_id(cur, 'Genres', 'genreID'),
+            "books": next_id(cur, 'Books', 'bookID'),
+            "users": next_id(cur, 'Users', 'userID'),
+            "carts": next_id(cur, 'Cart', 'cartID')
+        }
+        connection.commit()
+        sizes = dict(sizes, genres=len(GENRES), carts=min(sizes["carts"], sizes["users"]))
+
+        # Each table gets its own generator seeded from the run seed, so one table's size can't shift another's rows
+        def rng_for(name):
+            return random.Random(f"{seed}:{name}")
+
+        rng = rng_for('publishers')
+        write_batches(connection, "INSERT INTO Publishers (publisherID, publisherName, contactInfo) VALUES (%s, %s, %s)",
+                      ((base["publishers"] + i, f"{rng.choice(WORDS).title()} House {tag}-{i}", f"contact-{i}@example.com")
+                       for i in range(sizes["publishers"])), batch_size, 'publishers', sizes["publishers"])
+
+        rng = rng_for('authors')
+        write_batches(connection, "INSERT INTO Authors (authorID, name, bio) VALUES (%s, %s, %s)",
+                      ((base["authors"] + i, f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {tag}-{i}",
+                        'Generated author.') for i in range(sizes["authors"])), batch_size, 'authors', sizes["authors"])
+
+        write_batches(connection, "INSERT INTO Genres (genreID, genreName) VALUES (%s, %s)",
+                      ((base["genres"] + i, f"{name} {tag}") for i, name in enumerate(GENRES)),
+                      batch_size, 'genres', len(GENRES))
+
+        rng = rng_for('books')
+        write_batches(connection, '''INSERT INTO Books (bookID, title, publicationDate, publisherID, availabilityStatus,
+                                                        bookCount) VALUES (%s, %s, %s, %s, %s, %s)''',
+                      ((base["books"] + i,
+                        ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 5))).title() + f" {i}",
+                        random_date(rng).isoformat(),
+                        base["publishers"] + rng.randrange(sizes["publishers"]),
+                        1 if rng.random() < 0.97 else 0,
+                        rng.randint(1, 10)) for i in range(sizes["books"])),
+                      batch_size, 'books', sizes["books"])
+
+        def book_links(name, target_base, target_count, max_links):
+            rng = rng_for(name)
+            for i in range(sizes["books"]):
+                for target in rng.sample(range(target_count), min(rng.randint(1, max_links), target_count)):
+                    yield base["books"] + i, target_base + target
+
+        write_batches(connection, "INSERT INTO Book_Authors (bookID, authorID) VALUES (%s, %s)",
+                      book_links('book_authors', base["authors"], sizes["authors"], 2),
+                      batch_size, 'book_authors', sizes["books"])
+        write_batches(connection, "INSERT INTO Book_Genres (bookID, genreID) VALUES (%s, %s)",
+                      book_links('book_genres', base["genres"], len(GENRES), 3),
+                      batch_size, 'book_genres', sizes["books"])
+
+        write_batches(connection, "INSERT INTO Users (userID, name, contactDetails) VALUES (%s, %s, %s)",
+                      ((base["users"] + i, f"user-{tag}-{i}", f"user-{tag}-{i}@example.com")
+                       for i in range(sizes["users"])), batch_size, 'users', sizes["users"])
+
+        write_batches(connection, "INSERT INTO Cart (cartID, userID) VALUES (%s, %s)",
+                      ((base["carts"] + i, base["users"] + i) for i in range(sizes["carts"])),
+                      batch_size, 'carts', sizes["carts"])
+
+        def cart_items():
+            rng = rng_for('cart_items')
+            per_cart, extra = divmod(sizes["cart_items"], sizes["carts"])
+            for cart in range(sizes["carts"]):
+                count = min(per_cart + (1 if cart < extra else 0), sizes["books"])
+                for book in rng.sample(range(sizes["books"]), count):
+                    yield base["carts"] + cart, base["books"] + book, ''
+
+        write_batches(connection, "INSERT INTO Cart_Items (cartID, bookID, bookName) VALUES (%s, %s, %s)",
+                      cart_items(), batch_size, 'cart_items', sizes["cart_items"])
+
+        def transactions():
+            rng = rng_for('transactions')
+            for _ in range(sizes["transactions"]):
+                # Skew borrowing towards a popular head of the catalog like real libraries see
+                book = int(sizes["books"] * rng.random() ** 3)
+                borrowed = random_date(rng)
+                returned = borrowed + datetime.timedelta(days=rng.randint(1, 60)) if rng.random() < 0.8 else None
+                yield (base["users"] + rng.randrange(sizes["users"]), base["books"] + book,
+                       borrowed.isoformat(), returned.isoformat() if returned else None)
+
+        write_batches(connection, "INSERT INTO Transactions (userID, bookID, borrowDate, returnDate) VALUES (%s, %s, %s, %s)",
+                      transactions(), batch_size, 'transactions', sizes["transactions"])
+    finally:
+        connection.close()
+
+    print("  rebuilding report summaries", file=sys.stderr)
+    connection = app.get_db_connection()
+    try:
+        app.rebuild_summaries(connection)
+    finally:
+        connection.close()
+
+    return {
+        "seed": seed,
+        "sizes": sizes,
+        "first_ids": base,
+        "user_name_pattern": f"user-{tag}-{{index}}",
+        "search_terms": WORDS[:10]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_db_arguments(parser)
+    parser.add_argument('--scale', type=int, default=1000,
+                        help='Number of books; the other tables are sized relative to it.')
+    for name in ('books', 'publishers', 'authors', 'users', 'carts', 'cart-items', 'transactions'):
+        parser.add_argument(f'--{name}', type=int, default=None, help=f'Override the number of {name}.')
+    parser.add_argument('--seed', type=int, default=431)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--manifest', default='bench_manifest.json',
+                        help='Where to write the generated ID ranges for bench_routes.py.')
+    args = parser.parse_args()
+
+    sizes = sizes_for_scale(args.scale)
+    for name in sizes:
+        override = getattr(args, name)
+        if override is not None:
+            sizes[name] = override
+
+    app = load_app_module(args.database, args.host, args.user, args.password)
+    ensure_database(app)
+    manifest = generate(app, sizes, args.seed, args.batch_size)
+    with open(args.manifest, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Wrote {args.manifest}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
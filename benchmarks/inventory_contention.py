@@ -0,0 +1,173 @@
+"""
+Row-lock contention on one popular title.
+
+Every thread repeatedly takes one copy of the same book and commits, first by decrementing
+Books.bookCount (one row every transaction queues on) and then through inventory.take,
+which spreads the copies over Inventory_Slots rows. Reports throughput, commit latency
+and the server's InnoDB row lock counters for each, plus whether copies were lost or
+handed out twice.
+
+    python benchmarks/inventory_contention.py --database library_bench --threads 32 --slots 8
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import add_db_arguments, ensure_database, load_app_module, percentile, write_report
+
+TITLE_PREFIX = 'contention-inventory-'
+
+LOCK_COUNTERS = ('Innodb_row_lock_waits', 'Innodb_row_lock_time', 'Innodb_row_lock_current_waits')
+
+
+def take_from_book_row(cur, book_id, slots):
+    cur.execute("UPDATE Books SET bookCount = bookCount - 1 WHERE bookID=%s AND bookCount > 0", (book_id,))
+    return cur.rowcount == 1
+
+
+def take_from_slots(inventory):
+    def take(cur, book_id, slots):
+        return inventory.take(cur, book_id, slots) is not None
+    return take
+
+
+def seed(app, copies, slots):
+    connection = app.get_db_connection()
+    try:
+        cur = connection.cursor()
+        app.inventory.create_inventory_tables(cur)
+        cleanup(cur)
+        cur.execute("INSERT INTO Publishers (publisherName, contactInfo) VALUES (%s, %s)",
+                    (TITLE_PREFIX + 'publisher', 'contention test'))
+        cur.execute("INSERT INTO Books (title, publicationDate, publisherID, bookCount) VALUES (%s, %s, %s, %s)",
+                    (TITLE_PREFIX + 'hot', '2000-01-01', cur.lastrowid, copies))
+        book_id = cur.lastrowid
+        app.inventory.seed_slots(cur, slots, [book_id])
+        connection.commit()
+        return book_id
+    finally:
+        connection.close()
+
+
+def cleanup(cur):
+    pattern = TITLE_PREFIX + '%'
+    for table in ('Reservations', 'Inventory_Slots'):
+        cur.execute(f'''DELETE x FROM {table} x JOIN Books b ON b.bookID = x.bookID WHERE b.title LIKE %s''',
+                    (pattern,))
+    cur.execute("DELETE FROM Books WHERE title LIKE %s", (pattern,))
+    cur.execute("DELETE FROM Publishers WHERE publisherName LIKE %s", (pattern,))
+
+
+def remaining(app, book_id):
+    connection = app.get_db_connection()
+    try:
+        cur = connection.cursor()
+        cur.execute("SELECT bookCount FROM Books WHERE bookID=%s", (book_id,))
+        book_count = cur.fetchone()[0]
+        slot_count = app.inventory.available_copies(cur, [book_id]).get(book_id, 0)
+    finally:
+        connection.close()
+    return book_count, slot_count
+
+
+def server_status(connection):
+    cur = connection.cursor()
+    placeholders = ', '.join(['%s'] * len(LOCK_COUNTERS))
+    cur.execute(f"SHOW GLOBAL STATUS WHERE Variable_name IN ({placeholders})", LOCK_COUNTERS)
+    return {name: int(value) for name, value in cur.fetchall()}
+
+
+def run(app, name, take, book_id, slots, threads, takes_per_thread):
+    def worker(_):
+        samples = []
+        taken = 0
+        connection = app.get_db_connection()
+        try:
+            cur = connection.cursor()
+            for _ in range(takes_per_thread):
+                start = time.perf_counter()
+                try:
+                    if take(cur, book_id, slots):
+                        taken += 1
+                    connection.commit()
+                except Exception:
+                    connection.rollback()
+                    raise
+                samples.append(time.perf_counter() - start)
+        finally:
+            connection.close()
+        return samples, taken
+
+    probe = app.mysql.connector.connect(**app.db_config)
+    try:
+        before = server_status(probe)
+        latencies = []
+        taken = 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for samples, count in executor.map(worker, range(threads)):
+                latencies.extend(samples)
+                taken += count
+        elapsed = time.perf_counter() - start
+        after = server_status(probe)
+    finally:
+        probe.close()
+
+    return {
+        "implementation": name,
+        "takes": len(latencies),
+        "copies_taken": taken,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_per_s": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        # Innodb_row_lock_current_waits is a gauge; the delta only shows waits left at the end
+        "row_locks": {counter: after.get(counter, 0) - before.get(counter, 0) for counter in LOCK_COUNTERS}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_db_arguments(parser)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--takes-per-thread', type=int, default=200)
+    parser.add_argument('--slots', type=int, default=8)
+    parser.add_argument('--copies', type=int, default=None,
+                        help='Copies of the hot book (default: enough for every take).')
+    parser.add_argument('--output', help='Also write the JSON report to this file.')
+    args = parser.parse_args()
+
+    app = load_app_module(args.database, args.host, args.user, args.password)
+    app.db_pool.size = max(app.db_pool.size, args.threads + 2)
+    ensure_database(app)
+    copies = args.copies if args.copies is not None else args.threads * args.takes_per_thread
+
+    results = []
+    for name, take in (('book_row', take_from_book_row), ('sharded_slots', take_from_slots(app.inventory))):
+        book_id = seed(app, copies, args.slots)
+        result = run(app, name, take, book_id, args.slots, args.threads, args.takes_per_thread)
+        book_count, slot_count = remaining(app, book_id)
+        left = book_count if name == 'book_row' else slot_count
+        result["copies_left"] = left
+        # Every copy is either taken or left, never both or neither
+        result["consistent"] = left >= 0 and left + result["copies_taken"] == copies
+        results.append(result)
+
+    connection = app.get_db_connection()
+    try:
+        cleanup(connection.cursor())
+        connection.commit()
+    finally:
+        connection.close()
+
+    write_report({"parameters": vars(args) | {"password": None}, "results": results}, args.output)
+    if not all(result["consistent"] for result in results):
+        sys.exit("copies were lost or handed out twice")
+
+
+if __name__ == '__main__':
+    main()
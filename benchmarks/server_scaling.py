@@ -0,0 +1,200 @@
+"""
+Throughput of the pre-forked server (server.py) as the number of workers grows.
+
+For each worker count, starts server.py on a free port, waits until it answers, then has
+several client processes (each with its own threads, so the load generator is not held
+back by one interpreter lock) request one path for a fixed time. Reports requests per
+second, p50/p99 latency and the scaling efficiency against one worker as JSON; on an
+otherwise idle machine the throughput should grow about linearly with the workers until
+they run out of cores.
+
+Client and server share the machine, so give them separate cores: --client-cpus pins the
+client processes and the server gets the remaining CPUs.
+
+    python benchmarks/datagen.py --database library_bench --scale 100000
+    LIBRARY_DB_DATABASE=library_bench python benchmarks/server_scaling.py --workers 1,2,4,8 --client-cpus 8-15
+
+The default path is served from each worker's warmed catalog cache; use --path to
+measure a route that goes to the database, e.g. --path '/books/1'.
+"""
+import argparse
+import datetime
+import http.client
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import REPO_ROOT, percentile, write_report
+
+SERVER_PATH = os.path.join(REPO_ROOT, 'server.py')
+
+
+def parse_cpus(spec):
+    cpus = set()
+    for part in spec.split(','):
+        first, _, last = part.partition('-')
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_serving(port, path, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', path)
+            connection.getresponse().read()
+            connection.close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def client_process(port, path, threads, duration, cpus, results):
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    samples = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def run():
+        local = []
+        failed = 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                # The server closes the connection after each response
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                connection.request('GET', path)
+                response = connection.getresponse()
+                response.read()
+                connection.close()
+                if response.status != 200:
+                    failed += 1
+            except OSError:
+                failed += 1
+            local.append(time.perf_counter() - start)
+        with lock:
+            samples.extend(local)
+            errors[0] += failed
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    results.put((samples, errors[0]))
+
+
+def measure(args, workers, server_cpus, client_cpus):
+    port = free_port()
+    env = dict(os.environ)
+    if args.config:
+        env['LIBRARY_CONFIG'] = os.path.abspath(args.config)
+    server = subprocess.Popen(
+        [sys.executable, SERVER_PATH, '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+         '--threads', str(args.threads)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        preexec_fn=(lambda: os.sched_setaffinity(0, server_cpus)) if server_cpus else None)
+    try:
+        if not wait_until_serving(port, args.path, args.startup_timeout):
+            raise RuntimeError(f"Server with {workers} workers did not answer within {args.startup_timeout}s")
+        # Let every worker finish warming up and the caches fill
+        time.sleep(args.warmup)
+
+        results = multiprocessing.Queue()
+        clients = [multiprocessing.Process(target=client_process,
+                                           args=(port, args.path, args.client_threads, args.duration,
+                                                 client_cpus, results))
+                   for _ in range(args.client_processes)]
+        for client in clients:
+            client.start()
+        samples = []
+        errors = 0
+        for _ in clients:
+            client_samples, client_errors = results.get()
+            samples.extend(client_samples)
+            errors += client_errors
+        for client in clients:
+            client.join()
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+
+    return {
+        "workers": workers,
+        "requests": len(samples),
+        "errors": errors,
+        "rps": round(len(samples) / args.duration, 1),
+        "p50_ms": round(percentile(samples, 50) * 1000, 3) if samples else None,
+        "p99_ms": round(percentile(samples, 99) * 1000, 3) if samples else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default=None,
+                        help='Comma-separated worker counts (default: 1, 2, 4, ... up to the server CPUs).')
+    parser.add_argument('--threads', type=int, default=10, help='Request threads per worker.')
+    parser.add_argument('--path', default='/books/all')
+    parser.add_argument('--config', help='Config file passed to the server.')
+    parser.add_argument('--client-cpus', help='CPUs for the load generator, e.g. 8-15; the server gets the rest.')
+    parser.add_argument('--client-processes', type=int, default=None,
+                        help='Load generator processes (default: one per client CPU, at least 2).')
+    parser.add_argument('--client-threads', type=int, default=16, help='Connections per client process.')
+    parser.add_argument('--duration', type=float, default=15.0, help='Seconds measured per worker count.')
+    parser.add_argument('--warmup', type=float, default=2.0)
+    parser.add_argument('--startup-timeout', type=float, default=60.0)
+    parser.add_argument('--output', help='Also write the JSON report to this file.')
+    args = parser.parse_args()
+
+    available = os.sched_getaffinity(0)
+    client_cpus = parse_cpus(args.client_cpus) & available if args.client_cpus else set()
+    server_cpus = (available - client_cpus) if client_cpus else set()
+    if args.client_processes is None:
+        args.client_processes = max(2, len(client_cpus))
+    if args.workers:
+        levels = [int(level) for level in args.workers.split(',')]
+    else:
+        levels = [1]
+        while levels[-1] * 2 <= len(server_cpus or available):
+            levels.append(levels[-1] * 2)
+
+    results = []
+    for workers in levels:
+        print(f"Measuring {workers} workers", file=sys.stderr)
+        results.append(measure(args, workers, server_cpus, client_cpus))
+    base = results[0]["rps"] / results[0]["workers"] if results and results[0]["rps"] else None
+    for result in results:
+        # 1.0 means the throughput grew in proportion to the workers
+        result["efficiency"] = round(result["rps"] / (base * result["workers"]), 3) if base else None
+
+    report = {
+        "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "path": args.path,
+        "threads_per_worker": args.threads,
+        "server_cpus": sorted(server_cpus or available),
+        "client_cpus": sorted(client_cpus),
+        "duration_s": args.duration,
+        "results": results
+    }
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""
+Set-based batch versions of the cart and user writes.
+
+Each function validates a whole batch with one query per table, writes every valid item
+with multi-row statements on the caller's connection (the caller commits) and returns
+one result per input item, in input order. A result carries the HTTP status the single-
+item route would have answered with, plus an "error" message when the item was rejected,
+so a few bad items never abort the rest of the batch.
+"""
+from collections import Counter
+
+import inventory
+import loans
+from report_summaries import record_cart_adds, record_cart_removes
+
+
+def _result(index, status, error=None, **fields):
+    result = {"index": index, "status": status, **fields}
+    if error:
+        result["error"] = error
+    return result
+
+
+def parse_cart_items(items):
+    """Splits raw JSON items into ((index, cartID, bookID) list, {index: error result})."""
+    valid = []
+    errors = {}
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, int(item['cartID']), int(item['bookID'])))
+        except (KeyError, TypeError, ValueError):
+            errors[index] = _result(index, 400, "cartID and bookID must be integers.")
+    return valid, errors
+
+
+def _in_clause(values):
+    return ', '.join(['%s'] * len(values)), tuple(values)
+
+
+def _pair_clause(pairs):
+    return ', '.join(['(%s, %s)'] * len(pairs)), tuple(value for pair in pairs for value in pair)
+
+
+def add_cart_items(cur, items, reservation_ttl=0, slots=inventory.DEFAULT_SLOTS):
+    """
+    Adds each {"cartID", "bookID"} item to its cart. With a reservation_ttl above zero each
+    added item also holds a copy for that many seconds, as /add_to_cart does, and items with
+    no copy left are rejected with 409.
+    """
+    valid, results = parse_cart_items(items)
+    if valid:
+        cart_ids = sorted({cart_id for _, cart_id, _ in valid})
+        book_ids = sorted({book_id for _, _, book_id in valid})
+
+        placeholders, params = _in_clause(cart_ids)
+        cur.execute(f"SELECT cartID FROM Cart WHERE cartID IN ({placeholders})", params)
+        carts = {row[0] for row in cur.fetchall()}
+
+        placeholders, params = _in_clause(book_ids)
+        cur.execute(f"SELECT bookID, title FROM Books WHERE bookID IN ({placeholders})", params)
+        titles = dict(cur.fetchall())
+
+        pairs = sorted({(cart_id, book_id) for _, cart_id, book_id in valid})
+        placeholders, params = _pair_clause(pairs)
+        cur.execute(f"SELECT cartID, bookID FROM Cart_Items WHERE (cartID, bookID) IN ({placeholders})", params)
+        in_cart = {tuple(row) for row in cur.fetchall()}
+
+        accepted = []
+        for index, cart_id, book_id in valid:
+            fields = {"cartID": cart_id, "bookID": book_id}
+            if cart_id not in carts:
+                results[index] = _result(index, 404, "Cart not found. Please create a cart first.", **fields)
+            elif book_id not in titles:
+                results[index] = _result(index, 404, "Book not found.", **fields)
+            elif (cart_id, book_id) in in_cart:
+                results[index] = _result(index, 409, "Book is already in the cart.", **fields)
+            else:
+                # Also catches the same pair listed twice in one batch
+                in_cart.add((cart_id, book_id))
+                accepted.append((index, cart_id, book_id))
+                results[index] = _result(index, 201, **fields)
+
+        if reservation_ttl > 0:
+            # Slots are locked in bookID order, so concurrent batches cannot deadlock on them
+            for index, cart_id, book_id in sorted(accepted, key=lambda item: (item[2], item[1])):
+                if not inventory.reserve(cur, cart_id, book_id, reservation_ttl, slots):
+                    results[index] = _result(index, 409, "No copies of this book are available.",
+                                             cartID=cart_id, bookID=book_id)
+            accepted = [item for item in accepted if results[item[0]]["status"] == 201]
+
+        rows = [(cart_id, book_id, titles[book_id]) for _, cart_id, book_id in accepted]
+        if rows:
+            cur.executemany("INSERT INTO Cart_Items (cartID, bookID, bookName) VALUES (%s, %s, %s)", rows)
+            record_cart_adds(cur, [book_id for _, book_id, _ in rows])
+
+    return [results[index] for index in range(len(items))]
+
+
+def remove_cart_items(cur, items, reservations=False):
+    """Removes each {"cartID", "bookID"} item from its cart, releasing its reserved copy when reservations is set."""
+    valid, results = parse_cart_items(items)
+    if valid:
+        pairs = sorted({(cart_id, book_id) for _, cart_id, book_id in valid})
+        placeholders, params = _pair_clause(pairs)
+        cur.execute(f"SELECT cartID, bookID FROM Cart_Items WHERE (cartID, bookID) IN ({placeholders})", params)
+        in_cart = {tuple(row) for row in cur.fetchall()}
+
+        removed = []
+        for index, cart_id, book_id in valid:
+            fields = {"cartID": cart_id, "bookID": book_id}
+            if (cart_id, book_id) in in_cart:
+                in_cart.discard((cart_id, book_id))
+                removed.append((cart_id, book_id))
+                results[index] = _result(index, 200, **fields)
+            else:
+                results[index] = _result(index, 404, "Book not found in the cart.", **fields)
+
+        if removed:
+            placeholders, params = _pair_clause(removed)
+            cur.execute(f"DELETE FROM Cart_Items WHERE (cartID, bookID) IN ({placeholders})", params)
+            record_cart_removes(cur, [book_id for _, book_id in removed])
+            if reservations:
+                for cart_id, book_id in sorted(removed, key=lambda pair: (pair[1], pair[0])):
+                    inventory.release(cur, cart_id, book_id)
+
+    return [results[index] for index in range(len(items))]
+
+
+def return_books(cur, items, slots=None):
+    """
+    Closes the oldest open loan for each {"userID", "bookID"} item and puts the copies back
+    on the shelf, into the inventory slots when slots is given.
+    """
+    results = {}
+    valid = []
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, int(item['userID']), int(item['bookID'])))
+        except (KeyError, TypeError, ValueError):
+            results[index] = _result(index, 400, "userID and bookID must be integers.")
+
+    if valid:
+        closed = loans.close_loans(cur, [(user_id, book_id) for _, user_id, book_id in valid])
+        returned = Counter()
+        for (index, user_id, book_id), transaction_id in zip(valid, closed):
+            fields = {"userID": user_id, "bookID": book_id}
+            if transaction_id is None:
+                results[index] = _result(index, 404, "No open loan of this book for the user.", **fields)
+            else:
+                returned[book_id] += 1
+                results[index] = _result(index, 200, transactionID=transaction_id, **fields)
+
+        for book_id, count in sorted(returned.items()):
+            if slots:
+                inventory.add_copies(cur, book_id, count, slots)
+            else:
+                cur.execute("UPDATE Books SET bookCount = bookCount + %s WHERE bookID=%s", (count, book_id))
+
+    return [results[index] for index in range(len(items))]
+
+
+def register_users(cur, users):
+    results = {}
+    valid = []
+    for index, user in enumerate(users):
+        name = user.get('name') if isinstance(user, dict) else None
+        contact_details = user.get('contactDetails') if isinstance(user, dict) else None
+        if not isinstance(name, str) or not isinstance(contact_details, str) or not name or not contact_details:
+            results[index] = _result(index, 400, "Missing name or contact details in request.")
+        else:
+            valid.append((index, name, contact_details))
+
+    if valid:
+        placeholders, params = _in_clause(sorted({contact for _, _, contact in valid}))
+        cur.execute(f"SELECT contactDetails FROM Users WHERE contactDetails IN ({placeholders})", params)
+        taken = {row[0] for row in cur.fetchall()}
+
+        rows = []
+        for index, name, contact_details in valid:
+            if contact_details in taken:
+                results[index] = _result(index, 409, "Email ID already registered.", contactDetails=contact_details)
+            else:
+                taken.add(contact_details)
+                rows.append((index, name, contact_details))
+
+        if rows:
+            cur.executemany("INSERT INTO Users (name, contactDetails) VALUES (%s, %s)",
+                            [(name, contact_details) for _, name, contact_details in rows])
+            # Read the new IDs back by contact details rather than relying on consecutive auto-increment values
+            placeholders, params = _in_clause([contact_details for _, _, contact_details in rows])
+            cur.execute(f"SELECT contactDetails, userID FROM Users WHERE contactDetails IN ({placeholders})", params)
+            user_ids = dict(cur.fetchall())
+            for index, _, contact_details in rows:
+                results[index] = _result(index, 201, contactDetails=contact_details,
+                                         userID=user_ids.get(contact_details))
+
+    return [results[index] for index in range(len(users))]
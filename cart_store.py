@@ -0,0 +1,400 @@
+"""
+Write-back cart store.
+
+Active carts are kept in memory, so adding, removing and viewing items needs no database
+round trip once a cart is loaded. Cart and Cart_Items are brought up to date only when a
+cart is flushed: before checkout, when it is evicted (least recently used beyond
+max_carts, or idle longer than idle_timeout) and at shutdown.
+
+Durability of changes that have not been flushed yet is set by 'durability':
+  none     kept in memory only; lost if the process dies
+  journal  every change is appended to a journal file, which survives a process crash
+  fsync    as journal, but fsynced after every change so it also survives a power loss
+Carts found in the journal at start-up are restored and flushed on their next eviction
+or by flush_all().
+
+The store lives in one process. When running several worker processes, route each cart
+to the same worker or keep the default 'db' cart mode.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from report_summaries import record_cart_adds, record_cart_removes
+
+logger = logging.getLogger('library.carts')
+
+DURABILITY_LEVELS = ('none', 'journal', 'fsync')
+
+
+class CartNotFoundError(Exception):
+    pass
+
+
+class CartState:
+    __slots__ = ('cart_id', 'user_id', 'items', 'persisted', 'version', 'last_used', 'flush_lock')
+
+    def __init__(self, cart_id, user_id, items, persisted):
+        self.cart_id = cart_id
+        self.user_id = user_id
+        self.items = items          # bookID -> bookName, in the order they were added
+        self.persisted = persisted  # bookIDs in Cart_Items as of the last flush, or None if unknown
+        self.version = 0
+        self.last_used = time.monotonic()
+        self.flush_lock = threading.Lock()
+
+    @property
+    def dirty(self):
+        return self.persisted is None or set(self.items) != self.persisted
+
+
+class CartJournal:
+    """
+    Append-only log of cart states. Each change writes the cart's full item list with
+    a per-cart sequence number, and a flush writes the sequence it made durable, so
+    replaying keeps the newest state of every cart that was not flushed.
+    """
+
+    def __init__(self, path, fsync=False, max_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.fsync = fsync
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def _append(self, record):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def write_state(self, cart_id, user_id, seq, items):
+        self._append({"cart": cart_id, "user": user_id, "seq": seq, "items": list(items.items())})
+
+    def write_flushed(self, cart_id, seq):
+        self._append({"cart": cart_id, "flushed": seq})
+
+    def replay(self):
+        states = {}
+        flushed = {}
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn last line from a crash mid-write
+                    continue
+                cart_id = record["cart"]
+                if "flushed" in record:
+                    flushed[cart_id] = max(flushed.get(cart_id, -1), record["flushed"])
+                elif record["seq"] >= states.get(cart_id, {"seq": -1})["seq"]:
+                    states[cart_id] = record
+        return [record for cart_id, record in states.items() if record["seq"] > flushed.get(cart_id, -1)]
+
+    def size(self):
+        with self._lock:
+            return self._file.tell()
+
+    def compact(self, snapshot):
+        # Rewrite the journal with just the carts that still have unflushed changes. snapshot is
+        # called with the journal locked, so no change can be appended between it and the rewrite.
+        temp_path = self.path + '.tmp'
+        with self._lock:
+            states = snapshot()
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                for cart_id, user_id, seq, items in states:
+                    f.write(json.dumps({"cart": cart_id, "user": user_id, "seq": seq,
+                                        "items": list(items.items())}, separators=(',', ':')) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._file.close()
+            os.replace(temp_path, self.path)
+            self._file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class CartStore:
+    def __init__(self, connection_factory, max_carts=10000, idle_timeout=900, durability='none',
+                 journal_path=None):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"durability must be one of {', '.join(DURABILITY_LEVELS)}")
+        if durability != 'none' and not journal_path:
+            raise ValueError("A journal_path is required unless durability is 'none'")
+
+        self.connection_factory = connection_factory
+        self.max_carts = max_carts
+        self.idle_timeout = idle_timeout
+        self.durability = durability
+
+        self._carts = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._loads = 0
+        self._hits = 0
+        self._flushes = 0
+        self._flush_errors = 0
+        self._evictions = 0
+
+        self.journal = None
+        if durability != 'none':
+            self.journal = CartJournal(journal_path, fsync=durability == 'fsync')
+            for record in self.journal.replay():
+                state = CartState(record["cart"], record["user"],
+                                  {book_id: name for book_id, name in record["items"]}, None)
+                state.version = record["seq"]
+                self._carts[state.cart_id] = state
+            if self._carts:
+                logger.info("Restored %s carts with unflushed changes from %s", len(self._carts), journal_path)
+
+    def _load(self, cart_id):
+        connection = self.connection_factory()
+        try:
+            cur = connection.cursor()
+            cur.execute("SELECT userID FROM Cart WHERE cartID=%s", (cart_id,))
+            cart = cur.fetchone()
+            if not cart:
+                return None
+            cur.execute("SELECT bookID, bookName FROM Cart_Items WHERE cartID=%s", (cart_id,))
+            items = {book_id: name for book_id, name in cur.fetchall()}
+        finally:
+            connection.close()
+        return CartState(cart_id, cart[0], items, set(items))
+
+    def _get(self, cart_id):
+        # Must be called without holding the store lock; loads the cart from the database on a miss
+        with self._lock:
+            state = self._carts.get(cart_id)
+            if state is not None:
+                self._carts.move_to_end(cart_id)
+                state.last_used = time.monotonic()
+                self._hits += 1
+                return state
+
+        loaded = self._load(cart_id)
+        if loaded is None:
+            raise CartNotFoundError(f"Cart {cart_id} not found.")
+        with self._lock:
+            # Another request may have loaded the same cart meanwhile; keep the first copy
+            state = self._carts.setdefault(cart_id, loaded)
+            self._carts.move_to_end(cart_id)
+            self._loads += 1
+            return state
+
+    def _changed(self, state):
+        # Called with the store lock held, right after state.items was modified
+        state.version += 1
+        state.last_used = time.monotonic()
+        return state.version, dict(state.items)
+
+    def _journal_change(self, state, seq, items):
+        if self.journal is not None:
+            self.journal.write_state(state.cart_id, state.user_id, seq, items)
+
+    def register(self, cart_id, user_id):
+        """Adds a cart that was just inserted into Cart, so its first use needs no load."""
+        with self._lock:
+            self._carts[cart_id] = CartState(cart_id, user_id, {}, set())
+        self._evict_excess()
+
+    def _modify(self, cart_id, change):
+        while True:
+            state = self._get(cart_id)
+            with self._lock:
+                if self._carts.get(cart_id) is not state:
+                    # Evicted between the lookup and now; load it again
+                    continue
+                if not change(state.items):
+                    return False
+                seq, items = self._changed(state)
+            self._journal_change(state, seq, items)
+            return True
+
+    def add(self, cart_id, book_id, book_name):
+        """Returns False if the book is already in the cart."""
+        def change(items):
+            if book_id in items:
+                return False
+            items[book_id] = book_name
+            return True
+
+        added = self._modify(cart_id, change)
+        if added:
+            self._evict_excess()
+        return added
+
+    def remove(self, cart_id, book_id):
+        """Returns False if the book was not in the cart."""
+        def change(items):
+            if book_id not in items:
+                return False
+            del items[book_id]
+            return True
+
+        return self._modify(cart_id, change)
+
+    def items(self, cart_id):
+        state = self._get(cart_id)
+        with self._lock:
+            return list(state.items.items())
+
+    def flush(self, cart_id, connection=None):
+        """Writes a cart's pending changes to Cart_Items. Does nothing if the cart is not in memory."""
+        with self._lock:
+            state = self._carts.get(cart_id)
+        if state is not None:
+            self._flush_state(state, connection)
+
+    def _flush_state(self, state, connection=None):
+        with state.flush_lock:
+            self._flush_locked(state, connection)
+
+    def _flush_locked(self, state, connection=None):
+        # The caller holds state.flush_lock, so only one flush of a cart runs at a time
+        with self._lock:
+            if not state.dirty:
+                return
+            seq = state.version
+            items = dict(state.items)
+            persisted = state.persisted
+
+        own_connection = connection is None
+        if own_connection:
+            connection = self.connection_factory()
+        try:
+            cur = connection.cursor()
+            if persisted is None:
+                # Restored from the journal; find out what the database already has
+                cur.execute("SELECT bookID FROM Cart_Items WHERE cartID=%s", (state.cart_id,))
+                persisted = {row[0] for row in cur.fetchall()}
+
+            removed = sorted(persisted - set(items))
+            added = [book_id for book_id in items if book_id not in persisted]
+            if added:
+                # Books deleted from the catalog since they were put in the cart are dropped
+                placeholders = ', '.join(['%s'] * len(added))
+                cur.execute(f"SELECT bookID FROM Books WHERE bookID IN ({placeholders})", tuple(added))
+                existing = {row[0] for row in cur.fetchall()}
+                added = [book_id for book_id in added if book_id in existing]
+
+            if removed:
+                placeholders = ', '.join(['%s'] * len(removed))
+                cur.execute(f"DELETE FROM Cart_Items WHERE cartID=%s AND bookID IN ({placeholders})",
+                            (state.cart_id, *removed))
+                record_cart_removes(cur, removed)
+            if added:
+                cur.executemany("INSERT INTO Cart_Items (cartID, bookID, bookName) VALUES (%s, %s, %s)",
+                                [(state.cart_id, book_id, items[book_id]) for book_id in added])
+                record_cart_adds(cur, added)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            with self._lock:
+                self._flush_errors += 1
+            raise
+        finally:
+            if own_connection:
+                connection.close()
+
+        with self._lock:
+            state.persisted = (persisted - set(removed)) | set(added)
+            for book_id in set(items) - state.persisted:
+                # Dropped above because the book no longer exists
+                state.items.pop(book_id, None)
+            self._flushes += 1
+        if self.journal is not None:
+            self.journal.write_flushed(state.cart_id, seq)
+
+    def checkout(self, cart_id, connection, checkout):
+        """
+        Flushes the cart and then runs checkout(), which must check out the cart's Cart_Items
+        and return the loaned book IDs. No other flush of the cart can run in between.
+        """
+        with self._lock:
+            state = self._carts.get(cart_id)
+        if state is None:
+            return checkout()
+
+        with state.flush_lock:
+            self._flush_locked(state, connection)
+            book_ids = checkout()
+            with self._lock:
+                # Books added while the checkout ran were never written, so nothing of this cart is persisted now
+                for book_id in book_ids:
+                    state.items.pop(book_id, None)
+                state.persisted = set()
+                seq, items = self._changed(state)
+        self._journal_change(state, seq, items)
+        return book_ids
+
+    def _evict_excess(self):
+        now = time.monotonic()
+        with self._lock:
+            candidates = []
+            for state in self._carts.values():
+                idle = self.idle_timeout and now - state.last_used > self.idle_timeout
+                if not idle and len(self._carts) - len(candidates) <= self.max_carts:
+                    break
+                candidates.append(state)
+        for state in candidates:
+            self._evict(state)
+        self.compact_journal(force=False)
+
+    def _evict(self, state):
+        try:
+            self._flush_state(state)
+        except Exception as e:
+            # Keep the cart in memory and try again on a later eviction
+            logger.warning("Could not flush cart %s: %s", state.cart_id, e)
+            return
+        with self._lock:
+            # Only drop it if nothing changed while it was being flushed
+            if self._carts.get(state.cart_id) is state and not state.dirty:
+                del self._carts[state.cart_id]
+                self._evictions += 1
+
+    def flush_all(self):
+        """Flushes every cart with pending changes and compacts the journal. Returns the number of carts flushed."""
+        with self._lock:
+            states = [state for state in self._carts.values() if state.dirty]
+        flushed = 0
+        for state in states:
+            try:
+                self._flush_state(state)
+                flushed += 1
+            except Exception as e:
+                logger.warning("Could not flush cart %s: %s", state.cart_id, e)
+        self.compact_journal()
+        return flushed
+
+    def compact_journal(self, force=True):
+        if self.journal is None or (not force and self.journal.size() < self.journal.max_bytes):
+            return
+
+        def snapshot():
+            with self._lock:
+                return [(state.cart_id, state.user_id, state.version, dict(state.items))
+                        for state in self._carts.values() if state.dirty]
+
+        self.journal.compact(snapshot)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "carts": len(self._carts),
+                "dirty": sum(1 for state in self._carts.values() if state.dirty),
+                "max_carts": self.max_carts,
+                "durability": self.durability,
+                "hits": self._hits,
+                "loads": self._loads,
+                "flushes": self._flushes,
+                "flush_errors": self._flush_errors,
+                "evictions": self._evictions
+            }
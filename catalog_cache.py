@@ -0,0 +1,187 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class LocalVersionStore:
+    """Per-table change counters kept in this process."""
+
+    def __init__(self):
+        self._versions = {}
+        self._written = {}
+        self._lock = threading.Lock()
+        # Counters restart at zero with the process, so anything derived from them also needs the epoch
+        self.epoch = uuid.uuid4().hex[:12]
+
+    def get(self, tables):
+        with self._lock:
+            return tuple(self._versions.get(table, 0) for table in tables)
+
+    def bump(self, tables):
+        now = time.time()
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+                self._written[table] = now
+
+    def last_written(self, tables):
+        """Wall-clock time of the latest bump of any of tables, or None."""
+        with self._lock:
+            return max((self._written[table] for table in tables if table in self._written), default=None)
+
+
+class RedisVersionStore:
+    """Per-table change counters shared through Redis so every worker sees the same versions."""
+
+    def __init__(self, url, prefix='library:version:'):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+        # Shared by every worker; only changes if Redis loses the counters
+        self._client.set(prefix + 'epoch', uuid.uuid4().hex[:12], nx=True)
+        self.epoch = self._client.get(prefix + 'epoch').decode()
+
+    def get(self, tables):
+        values = self._client.mget([self._prefix + table for table in tables])
+        return tuple(int(value) if value is not None else 0 for value in values)
+
+    def bump(self, tables):
+        # One MULTI/EXEC, so a worker that sees the new version also sees the write time
+        now = time.time()
+        pipe = self._client.pipeline()
+        for table in tables:
+            pipe.incr(self._prefix + table)
+            pipe.set(self._prefix + table + ':written', now)
+        pipe.execute()
+
+    def last_written(self, tables):
+        values = self._client.mget([self._prefix + table + ':written' for table in tables])
+        return max((float(value) for value in values if value is not None), default=None)
+
+
+class AsyncRedisVersionStore:
+    """
+    RedisVersionStore for asyncio code, on redis.asyncio so a lookup never blocks the event
+    loop. It reads and bumps the same keys, so it shares versions with the synchronous store.
+    """
+
+    def __init__(self, url, prefix='library:version:'):
+        import redis.asyncio
+        self._client = redis.asyncio.Redis.from_url(url)
+        self._prefix = prefix
+
+    async def get(self, tables):
+        values = await self._client.mget([self._prefix + table for table in tables])
+        return tuple(int(value) if value is not None else 0 for value in values)
+
+    async def bump(self, tables):
+        now = time.time()
+        pipe = self._client.pipeline()
+        for table in tables:
+            pipe.incr(self._prefix + table)
+            pipe.set(self._prefix + table + ':written', now)
+        await pipe.execute()
+
+    async def close(self):
+        await self._client.aclose()
+
+
+class AsyncLocalVersionStore:
+    """LocalVersionStore behind the coroutine interface of AsyncRedisVersionStore."""
+
+    def __init__(self):
+        self._store = LocalVersionStore()
+
+    async def get(self, tables):
+        return self._store.get(tables)
+
+    async def bump(self, tables):
+        self._store.bump(tables)
+
+    async def close(self):
+        pass
+
+
+class CatalogCache:
+    """
+    Bounded LRU cache with a TTL for catalog reads. Every entry is tagged with the
+    versions of the tables it was built from, so bumping a table's version makes
+    all entries that depend on it stale without having to find them.
+    """
+
+    def __init__(self, max_entries=10000, ttl=300, version_store=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.versions = version_store or LocalVersionStore()
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    def get(self, key, tables):
+        versions = self.versions.get(tables)
+        return self.lookup(key, versions), versions
+
+    def lookup(self, key, versions):
+        """The entry for key if it was built from exactly these table versions, else None."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, entry_versions, expires_at = entry
+                if entry_versions != versions:
+                    del self._entries[key]
+                    self._invalidations += 1
+                elif expires_at < now:
+                    del self._entries[key]
+                    self._expirations += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return value
+            self._misses += 1
+        return None
+
+    def put(self, key, versions, value):
+        with self._lock:
+            self._entries[key] = (value, versions, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def get_or_load(self, key, tables, loader):
+        value, versions = self.get(key, tables)
+        if value is None:
+            # Tag with the versions read before loading so a concurrent write can't be cached as current
+            value = loader()
+            self.put(key, versions, value)
+        return value
+
+    def invalidate(self, tables):
+        self.versions.bump(tables)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": round(self._hits / lookups, 4) if lookups else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "invalidations": self._invalidations
+            }
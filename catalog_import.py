@@ -0,0 +1,224 @@
+"""
+Streaming bulk import of books together with their authors, genres and publishers.
+
+Records are read one at a time from CSV or JSON Lines, so the file is never held in
+memory. Related rows are resolved by name through in-memory lookup maps and created
+when missing, and every batch is written with multi-row statements and committed on
+its own. CSV files use the columns title, publicationDate, publisher, authors, genres
+and optionally bookCount and availabilityStatus; authors and genres are separated by ';'.
+With sharded inventory, each batch also seeds the new books' Inventory_Slots in the same
+transaction as their rows, so imported books can be checked out straight away.
+"""
+import csv
+import datetime
+import io
+import json
+import time
+
+import inventory
+
+DEFAULT_BATCH_SIZE = 5000
+LIST_SEPARATOR = ';'
+
+
+class CatalogImportError(Exception):
+    pass
+
+
+def iter_records(stream, file_format):
+    # stream is a binary or text file object; records are yielded as (line number, dict) pairs
+    if isinstance(stream.read(0), bytes):
+        stream = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            record['authors'] = split_names(record.get('authors'))
+            record['genres'] = split_names(record.get('genres'))
+            yield reader.line_num, record
+    elif file_format == 'jsonl':
+        for line_number, line in enumerate(stream, 1):
+            if line.strip():
+                try:
+                    yield line_number, json.loads(line)
+                except ValueError as e:
+                    yield line_number, {"_error": f"invalid JSON: {e}"}
+    else:
+        raise CatalogImportError(f"Unsupported import format '{file_format}', expected 'csv' or 'jsonl'.")
+
+
+def detect_format(filename):
+    if filename.endswith('.csv'):
+        return 'csv'
+    if filename.endswith('.jsonl') or filename.endswith('.ndjson'):
+        return 'jsonl'
+    raise CatalogImportError(f"Cannot tell the format of '{filename}'; pass it explicitly.")
+
+
+def split_names(value):
+    if not value:
+        return []
+    if isinstance(value, list):
+        return [name.strip() for name in value if name and name.strip()]
+    return [name.strip() for name in value.split(LIST_SEPARATOR) if name.strip()]
+
+
+def chunked(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class CatalogImporter:
+    def __init__(self, connection, batch_size=DEFAULT_BATCH_SIZE, progress=None, slots=None):
+        self.connection = connection
+        self.cur = connection.cursor()
+        self.batch_size = batch_size
+        self.progress = progress
+        # Inventory slots per new book when sharded inventory is on, None otherwise
+        self.slots = slots
+
+        self.publishers = self._load_map("SELECT publisherName, publisherID FROM Publishers")
+        self.authors = self._load_map("SELECT name, authorID FROM Authors")
+        self.genres = self._load_map("SELECT genreName, genreID FROM Genres")
+
+        self.stats = {
+            "books": 0,
+            "authors_created": 0,
+            "genres_created": 0,
+            "publishers_created": 0,
+            "skipped": 0,
+            "batches": 0,
+            "errors": []
+        }
+
+    def _load_map(self, query):
+        self.cur.execute(query)
+        lookup = {}
+        for name, row_id in self.cur.fetchall():
+            lookup.setdefault(name, row_id)
+        return lookup
+
+    def _resolve(self, names, lookup, insert_sql, select_sql, stat):
+        # Create any names we have not seen yet, then read their IDs back by name
+        missing = sorted({name for name in names if name not in lookup})
+        if not missing:
+            return
+        self.cur.executemany(insert_sql, [(name,) for name in missing])
+        placeholders = ', '.join(['%s'] * len(missing))
+        self.cur.execute(select_sql.format(placeholders=placeholders), tuple(missing))
+        for name, row_id in self.cur.fetchall():
+            lookup.setdefault(name, row_id)
+        self.stats[stat] += len(missing)
+
+    def _validate(self, line_number, record):
+        error = record.get('_error') if isinstance(record, dict) else "record must be a JSON object"
+        if not error and not (record.get('title') or '').strip():
+            error = "missing title"
+        if not error:
+            try:
+                record['bookCount'] = int(record.get('bookCount') or 1)
+                record['availabilityStatus'] = int(record.get('availabilityStatus') or 1)
+            except (TypeError, ValueError):
+                error = "bookCount and availabilityStatus must be integers"
+        if not error and record.get('publicationDate'):
+            try:
+                datetime.date.fromisoformat(str(record['publicationDate'])[:10])
+            except ValueError:
+                error = "publicationDate must be a date in YYYY-MM-DD format"
+        if error:
+            self.stats["skipped"] += 1
+            if len(self.stats["errors"]) < 100:
+                self.stats["errors"].append({"line": line_number, "error": error})
+            return False
+        return True
+
+    def _insert_books(self, rows):
+        # A multi-row INSERT hands out consecutive IDs; verify that before trusting it
+        self.cur.executemany('''INSERT INTO Books (title, publicationDate, publisherID, availabilityStatus, bookCount)
+                                VALUES (%s, %s, %s, %s, %s)''', rows)
+        first_id = self.cur.lastrowid
+        self.cur.execute("SELECT bookID, title FROM Books WHERE bookID BETWEEN %s AND %s ORDER BY bookID",
+                         (first_id, first_id + len(rows) - 1))
+        inserted = self.cur.fetchall()
+        if [title for _, title in inserted] == [row[0] for row in rows]:
+            return [book_id for book_id, _ in inserted]
+
+        # IDs were interleaved with another writer: redo this batch one row at a time
+        self.connection.rollback()
+        book_ids = []
+        for row in rows:
+            self.cur.execute('''INSERT INTO Books (title, publicationDate, publisherID, availabilityStatus, bookCount)
+                                VALUES (%s, %s, %s, %s, %s)''', row)
+            book_ids.append(self.cur.lastrowid)
+        return book_ids
+
+    def import_batch(self, records):
+        records = [record for line_number, record in records if self._validate(line_number, record)]
+        if not records:
+            return
+
+        self._resolve([(r.get('publisher') or '').strip() for r in records if (r.get('publisher') or '').strip()],
+                      self.publishers,
+                      "INSERT INTO Publishers (publisherName) VALUES (%s)",
+                      "SELECT publisherName, publisherID FROM Publishers WHERE publisherName IN ({placeholders})",
+                      "publishers_created")
+        self._resolve([name for r in records for name in split_names(r.get('authors'))],
+                      self.authors,
+                      "INSERT INTO Authors (name) VALUES (%s)",
+                      "SELECT name, authorID FROM Authors WHERE name IN ({placeholders})",
+                      "authors_created")
+        self._resolve([name for r in records for name in split_names(r.get('genres'))],
+                      self.genres,
+                      "INSERT INTO Genres (genreName) VALUES (%s)",
+                      "SELECT genreName, genreID FROM Genres WHERE genreName IN ({placeholders})",
+                      "genres_created")
+        # Commit the new names now so the lookup maps stay valid even if the book insert is redone
+        self.connection.commit()
+
+        book_rows = [(
+            record['title'].strip(),
+            record.get('publicationDate') or None,
+            self.publishers.get((record.get('publisher') or '').strip()),
+            record['availabilityStatus'],
+            record['bookCount']
+        ) for record in records]
+        book_ids = self._insert_books(book_rows)
+        if self.slots:
+            inventory.seed_slots(self.cur, self.slots, book_ids)
+
+        book_authors = set()
+        book_genres = set()
+        for book_id, record in zip(book_ids, records):
+            book_authors.update((book_id, self.authors[name]) for name in split_names(record.get('authors')))
+            book_genres.update((book_id, self.genres[name]) for name in split_names(record.get('genres')))
+        if book_authors:
+            self.cur.executemany("INSERT IGNORE INTO Book_Authors (bookID, authorID) VALUES (%s, %s)",
+                                 sorted(book_authors))
+        if book_genres:
+            self.cur.executemany("INSERT IGNORE INTO Book_Genres (bookID, genreID) VALUES (%s, %s)",
+                                 sorted(book_genres))
+
+        self.connection.commit()
+        self.stats["books"] += len(records)
+        self.stats["batches"] += 1
+
+    def run(self, records):
+        start = time.monotonic()
+        try:
+            for batch in chunked(records, self.batch_size):
+                self.import_batch(batch)
+                if self.progress:
+                    elapsed = time.monotonic() - start
+                    self.progress(self.stats["books"], elapsed,
+                                  self.stats["books"] / elapsed if elapsed else 0.0)
+        except Exception:
+            self.connection.rollback()
+            raise
+        self.stats["elapsed"] = round(time.monotonic() - start, 3)
+        return self.stats
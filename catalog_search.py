@@ -0,0 +1,146 @@
+"""
+Ranked search over book titles, author names and genre names.
+
+Each column has an InnoDB FULLTEXT index, which MySQL keeps up to date as rows are
+inserted and deleted. A query is split into words; words of MIN_PREFIX_LENGTH or more
+letters become prefix terms, so "pott rowl" matches "Harry Potter" by "J.K. Rowling", and
+shorter words match whole words only, since a 3-letter prefix such as "sha" expands to a
+large part of the catalog. Scores from the three columns are added up per book, with title
+matches weighted above author matches and author matches above genre matches.
+
+Each column contributes at most MAX_CANDIDATES of its best-scoring matches (or enough to
+reach the requested page), so the GROUP BY and the final sort see a bounded number of rows
+however common a term is. A book outside every column's candidates is not returned, and the
+genre, publisher and availability filters apply to the candidates only. Finding the matches
+in the FULLTEXT index still grows with their number, so a term shared by much of the catalog
+can stay above a 10ms target on a million books; benchmarks/bench_search.py measures each
+kind of query on datagen.py data, shows their plans and exits non-zero when one misses.
+"""
+import re
+
+from statements import SLOT_BOOK_COUNT
+
+SEARCH_INDEXES = [
+    ('Books', 'ft_books_title', 'title'),
+    ('Authors', 'ft_authors_name', 'name'),
+    ('Genres', 'ft_genres_genre_name', 'genreName')
+]
+
+TITLE_WEIGHT = 3
+AUTHOR_WEIGHT = 2
+GENRE_WEIGHT = 1
+
+# InnoDB ignores tokens shorter than innodb_ft_min_token_size (3 by default)
+MIN_TOKEN_LENGTH = 3
+MAX_TERMS = 8
+# Shorter terms match whole words only
+MIN_PREFIX_LENGTH = 4
+# Best matches per column that are ranked together
+MAX_CANDIDATES = 1000
+
+
+def create_search_indexes(cur):
+    for table, index, column in SEARCH_INDEXES:
+        cur.execute('''SELECT 1 FROM information_schema.statistics
+                       WHERE table_schema = DATABASE() AND table_name=%s AND index_name=%s
+                       LIMIT 1''', (table, index))
+        if not cur.fetchone():
+            cur.execute(f"ALTER TABLE {table} ADD FULLTEXT INDEX {index} ({column})")
+
+
+def split_terms(text):
+    """Returns (the terms searched for, the words ignored as too short or beyond MAX_TERMS)."""
+    # Keep only word characters so user input can't inject boolean-mode operators
+    words = list(dict.fromkeys(re.findall(r'\w+', text.lower())))
+    terms = [word for word in words if len(word) >= MIN_TOKEN_LENGTH][:MAX_TERMS]
+    return terms, [word for word in words if word not in terms]
+
+
+def build_boolean_query(text):
+    terms, _ = split_terms(text)
+    return ' '.join(term + '*' if len(term) >= MIN_PREFIX_LENGTH else term for term in terms)
+
+
+def search_query(text, genre=None, publisher=None, available=None, limit=20, offset=0, slot_counts=False):
+    """
+    Returns the (sql, params) of a search, or None when text has no searchable terms.
+    slot_counts takes bookCount from sharded inventory (see statements.SLOT_BOOK_COUNT).
+    """
+    query = build_boolean_query(text)
+    if not query:
+        return None
+    count = SLOT_BOOK_COUNT if slot_counts else 'b.bookCount'
+
+    # Deep pages still see enough candidates to fill them
+    candidates = max(MAX_CANDIDATES, offset + limit + 1)
+    filters = []
+    params = [query, query, candidates] * 3
+    if genre:
+        filters.append('''EXISTS (SELECT 1 FROM Book_Genres fbg
+                                  JOIN Genres fg ON fg.genreID = fbg.genreID
+                                  WHERE fbg.bookID = b.bookID AND fg.genreName=%s)''')
+        params.append(genre)
+    if publisher:
+        if str(publisher).isdigit():
+            filters.append("b.publisherID=%s")
+        else:
+            filters.append("p.publisherName=%s")
+        params.append(publisher)
+    if available is not None:
+        if available:
+            filters.append(f"b.availabilityStatus=1 AND {count} > 0")
+        else:
+            filters.append(f"(b.availabilityStatus<>1 OR {count} <= 0)")
+
+    where = ("WHERE " + " AND ".join(filters)) if filters else ""
+    params.extend([limit + 1, offset])
+
+    sql = f'''
+        SELECT b.bookID, b.title, b.publicationDate, b.publisherID, p.publisherName,
+               b.availabilityStatus, {count} AS bookCount, SUM(m.score) AS score
+        FROM (
+            (SELECT bookID, MATCH(title) AGAINST (%s IN BOOLEAN MODE) * {TITLE_WEIGHT} AS score
+             FROM Books
+             WHERE MATCH(title) AGAINST (%s IN BOOLEAN MODE)
+             ORDER BY score DESC
+             LIMIT %s)
+            UNION ALL
+            (SELECT ba.bookID, MATCH(a.name) AGAINST (%s IN BOOLEAN MODE) * {AUTHOR_WEIGHT} AS score
+             FROM Authors a
+             JOIN Book_Authors ba ON ba.authorID = a.authorID
+             WHERE MATCH(a.name) AGAINST (%s IN BOOLEAN MODE)
+             ORDER BY score DESC
+             LIMIT %s)
+            UNION ALL
+            (SELECT bg.bookID, MATCH(g.genreName) AGAINST (%s IN BOOLEAN MODE) * {GENRE_WEIGHT} AS score
+             FROM Genres g
+             JOIN Book_Genres bg ON bg.genreID = g.genreID
+             WHERE MATCH(g.genreName) AGAINST (%s IN BOOLEAN MODE)
+             ORDER BY score DESC
+             LIMIT %s)
+        ) m
+        JOIN Books b ON b.bookID = m.bookID
+        LEFT JOIN Publishers p ON p.publisherID = b.publisherID
+        {where}
+        GROUP BY b.bookID, b.title, b.publicationDate, b.publisherID, p.publisherName,
+                 b.availabilityStatus, b.bookCount
+        ORDER BY score DESC, b.bookID
+        LIMIT %s OFFSET %s'''
+    return sql, tuple(params)
+
+
+def search_results(columns, rows, limit):
+    """Turns the rows of a search_query into (up to limit result dicts, whether more results exist)."""
+    rows = [dict(zip(columns, row)) for row in rows]
+    for row in rows:
+        row['score'] = round(float(row['score']), 4)
+    return rows[:limit], len(rows) > limit
+
+
+def search_books(cur, text, genre=None, publisher=None, available=None, limit=20, offset=0, slot_counts=False):
+    """Returns up to limit matching books as dicts, best match first, and whether more results exist."""
+    search = search_query(text, genre, publisher, available, limit, offset, slot_counts)
+    if search is None:
+        return [], False
+    cur.execute(*search)
+    return search_results([column[0] for column in cur.description], cur.fetchall(), limit)
@@ -0,0 +1,98 @@
+import inventory
+import statements
+from event_writer import loan_events
+from report_summaries import record_checkout
+
+
+class CheckoutError(Exception):
+    """Raised when a cart cannot be checked out. Nothing has been written when this is raised."""
+
+    def __init__(self, message, unavailable=None):
+        super().__init__(message)
+        self.unavailable = unavailable or []
+
+
+def checkout_cart(connection, user_id, cart_id, events=None):
+    """
+    Checks out every book in a cart with a fixed number of statements, whatever the cart size.
+    The cart's Books rows are locked up front so the availability check and the decrement
+    are atomic, and either every book is loaned or none is. Returns the loaned book IDs.
+
+    With an EventWriter as events, the summary updates are queued to it after the commit
+    instead of being written in the checkout's transaction. The Transactions rows always are.
+    """
+    try:
+        # Lock the cart's books in bookID order so concurrent checkouts queue instead of deadlocking
+        items = statements.fetchall(connection, statements.CHECKOUT_LOCK_ITEMS, (cart_id,))
+        if not items:
+            raise CheckoutError("Cart is empty or does not exist.")
+
+        unavailable = [book_id for book_id, count, status in items
+                       if count is None or count <= 0 or status != 1]
+        if unavailable:
+            raise CheckoutError("Some books are not available for checkout.", unavailable)
+
+        cur = statements.execute(connection, statements.CHECKOUT_DECREMENT, (cart_id,))
+        if cur.rowcount != len(items):
+            raise CheckoutError("Book availability changed during checkout.")
+
+        log_checkout(connection, user_id, cart_id, events)
+        statements.execute(connection, statements.CHECKOUT_CLEAR_CART, (cart_id,))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+    book_ids = [item[0] for item in items]
+    if events is not None:
+        events.submit(loan_events(user_id, book_ids))
+    return book_ids
+
+
+def log_checkout(connection, user_id, cart_id, events):
+    # The loans commit with the checkout; without an event writer so do the summaries
+    statements.execute(connection, statements.CHECKOUT_LOG_LOANS, (user_id, cart_id))
+    if events is None:
+        record_checkout(connection.cursor(), user_id, cart_id)
+
+
+def checkout_cart_slots(connection, user_id, cart_id, slots=inventory.DEFAULT_SLOTS, events=None):
+    """
+    checkout_cart for sharded inventory. Copies come from Inventory_Slots (or from the cart's
+    reservations) instead of Books.bookCount, so checkouts of the same title no longer
+    serialize on its Books row. Either every book is loaned or none is. events is as for
+    checkout_cart.
+    """
+    cur = connection.cursor()
+    try:
+        # Lock only the cart's own rows; stock is locked per slot by inventory.take
+        cur.execute('''SELECT ci.bookID, b.availabilityStatus FROM Cart_Items ci
+                       LEFT JOIN Books b ON b.bookID = ci.bookID
+                       WHERE ci.cartID=%s
+                       ORDER BY ci.bookID
+                       FOR UPDATE OF ci''', (cart_id,))
+        items = cur.fetchall()
+        if not items:
+            raise CheckoutError("Cart is empty or does not exist.")
+
+        unavailable = [book_id for book_id, status in items if status != 1]
+        if unavailable:
+            raise CheckoutError("Some books are not available for checkout.", unavailable)
+
+        reserved = inventory.claim_reservations(cur, cart_id)
+        unavailable = [book_id for book_id, _ in items
+                       if book_id not in reserved and inventory.take(cur, book_id, slots) is None]
+        if unavailable:
+            raise CheckoutError("Some books are not available for checkout.", unavailable)
+
+        log_checkout(connection, user_id, cart_id, events)
+        statements.execute(connection, statements.CHECKOUT_CLEAR_CART, (cart_id,))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+    book_ids = [item[0] for item in items]
+    if events is not None:
+        events.submit(loan_events(user_id, book_ids))
+    return book_ids
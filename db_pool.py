@@ -0,0 +1,181 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+import mysql.connector
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection could be borrowed within the pool timeout."""
+
+
+class PooledConnection:
+    """A borrowed MySQL connection. Calling close() hands it back to the pool."""
+
+    def __init__(self, pool, connection, created_at):
+        self._pool = pool
+        self._connection = connection
+        self.created_at = created_at
+        self.last_used = time.monotonic()
+        self._returned = False
+        # Prepared cursors by statement, filled in by statements.cursor_for
+        self.statement_cache = OrderedDict() if pool.prepare_statements else None
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def cursor(self, *args, **kwargs):
+        cursor = self._connection.cursor(*args, **kwargs)
+        if self._pool.cursor_wrapper:
+            return self._pool.cursor_wrapper(cursor)
+        return cursor
+
+    def is_connected(self):
+        if self._returned:
+            return False
+        return self._connection.is_connected()
+
+    def close(self):
+        if self._returned:
+            return
+        self._returned = True
+        self._pool.release(self)
+
+
+class ConnectionPool:
+    def __init__(self, config, size=10, timeout=5.0, recycle=1800, ping_interval=30, cursor_wrapper=None,
+                 prepare_statements=False):
+        self.config = config
+        self.cursor_wrapper = cursor_wrapper
+        self.prepare_statements = prepare_statements
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+
+        self._idle = deque()
+        self._created = 0
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+        self._waits = 0
+        self._wait_time = 0.0
+        self._timeouts = 0
+        self._recycled = 0
+        self._borrowed = 0
+
+    def _connect(self):
+        return mysql.connector.connect(**self.config)
+
+    def _discard(self, pooled):
+        try:
+            pooled._connection.close()
+        except mysql.connector.Error:
+            pass
+        with self._cond:
+            self._created -= 1
+            self._cond.notify()
+
+    def _is_healthy(self, pooled):
+        # Replace connections that are too old, and ping the ones that sat idle for a while
+        if self.recycle and time.monotonic() - pooled.created_at > self.recycle:
+            return False
+        if self.ping_interval and time.monotonic() - pooled.last_used > self.ping_interval:
+            try:
+                pooled._connection.ping(reconnect=False)
+            except mysql.connector.Error:
+                return False
+        return True
+
+    def acquire(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+
+        while True:
+            with self._cond:
+                while not self._idle and self._created >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeoutError(
+                            f"Timed out after {self.timeout}s waiting for a database connection.")
+                    if not waited:
+                        waited = True
+                        self._waits += 1
+                    self._cond.wait(remaining)
+
+                if self._idle:
+                    pooled = self._idle.pop()
+                else:
+                    pooled = None
+                    self._created += 1
+
+            if pooled is None:
+                try:
+                    connection = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._created -= 1
+                        self._cond.notify()
+                    raise
+                pooled = PooledConnection(self, connection, time.monotonic())
+            elif not self._is_healthy(pooled):
+                with self._cond:
+                    self._recycled += 1
+                self._discard(pooled)
+                continue
+
+            pooled._returned = False
+            with self._cond:
+                self._in_use += 1
+                self._borrowed += 1
+                if waited:
+                    self._wait_time += time.monotonic() - start
+            return pooled
+
+    def release(self, pooled):
+        with self._cond:
+            self._in_use -= 1
+
+        # Never hand a connection with leftover transaction state to the next borrower
+        connection = pooled._connection
+        try:
+            if connection.unread_result:
+                connection.consume_results()
+            if connection.in_transaction:
+                connection.rollback()
+        except mysql.connector.Error:
+            self._discard(pooled)
+            return
+
+        pooled.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(pooled)
+            self._cond.notify()
+
+    def warm(self, count=None):
+        """Opens up to count connections (default: the pool size) ahead of the first requests. Returns how many."""
+        count = min(self.size, count or self.size)
+        borrowed = []
+        try:
+            while len(borrowed) < count:
+                borrowed.append(self.acquire())
+        finally:
+            for pooled in borrowed:
+                pooled.close()
+        return len(borrowed)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self.size,
+                "open": self._created,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "borrowed": self._borrowed,
+                "waits": self._waits,
+                "wait_time": round(self._wait_time, 6),
+                "timeouts": self._timeouts,
+                "recycled": self._recycled
+            }
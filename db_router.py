@@ -0,0 +1,152 @@
+"""
+Read/write splitting between one primary and any number of read replicas.
+
+Writes always use the primary pool. Reads that can tolerate a little replication delay
+ask for read_pool(), which round-robins over the replicas currently in rotation. A
+background thread checks every replica's lag with SHOW REPLICA STATUS and takes a replica
+out of rotation while it is unreachable, not replicating, or more than max_lag seconds
+behind; it goes back in once it catches up. With no replica in rotation, reads fall back
+to the primary.
+
+A read that depends on tables changed within the last max_lag seconds is also sent to
+the primary, so a fresh write is never cached from a replica that has not applied it yet.
+By default only this process's own writes (note_write) count. With several worker
+processes sharing a catalog cache, pass write_times so every worker sees every worker's
+writes; the application uses the shared RedisVersionStore for this.
+"""
+import itertools
+import logging
+import threading
+import time
+
+import mysql.connector
+
+logger = logging.getLogger('library.replicas')
+
+LAG_COLUMNS = ('Seconds_Behind_Source', 'Seconds_Behind_Master')
+
+
+class ReplicaRouter:
+    def __init__(self, primary, replicas, max_lag=5, check_interval=2, write_times=None):
+        """
+        primary is a ConnectionPool; replicas maps a replica name to its ConnectionPool.
+        A max_lag of None skips the lag check and keeps every reachable replica in rotation.
+        write_times, if given, is called with a tuple of tables and returns the wall-clock
+        time any of them was last written by any process, or None.
+        """
+        self.primary = primary
+        self.replicas = dict(replicas)
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.write_times = write_times
+
+        self._rotation = []
+        self._status = {name: {"lag": None, "in_rotation": False, "error": None} for name in self.replicas}
+        self._turn = itertools.count()
+        self._writes = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._replica_reads = 0
+        self._primary_reads = 0
+
+    def start(self):
+        if self.replicas and self._thread is None:
+            self.check()
+            self._thread = threading.Thread(target=self._run, name='replica-lag-check', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            self.check()
+
+    def _replica_lag(self, pool):
+        connection = pool.acquire()
+        try:
+            cur = connection.cursor()
+            try:
+                cur.execute("SHOW REPLICA STATUS")
+            except mysql.connector.ProgrammingError:
+                # Servers older than 8.0.22
+                cur.execute("SHOW SLAVE STATUS")
+            row = cur.fetchone()
+            columns = [column[0] for column in cur.description] if cur.description else []
+        finally:
+            connection.close()
+        if row is None:
+            return None
+        status = dict(zip(columns, row))
+        for column in LAG_COLUMNS:
+            if column in status:
+                return status[column]
+        return None
+
+    def check(self):
+        rotation = []
+        for name, pool in self.replicas.items():
+            lag = None
+            error = None
+            try:
+                lag = self._replica_lag(pool)
+            except Exception as e:
+                error = str(e)
+
+            if error is not None:
+                in_rotation = False
+            elif self.max_lag is None:
+                in_rotation = True
+            else:
+                # A NULL lag means replication is stopped or the server is not a replica
+                in_rotation = lag is not None and lag <= self.max_lag
+
+            with self._lock:
+                was_in_rotation = self._status[name]["in_rotation"]
+                self._status[name] = {"lag": lag, "in_rotation": in_rotation, "error": error}
+            if was_in_rotation != in_rotation:
+                logger.warning("Replica %s %s rotation (lag=%s, error=%s)", name,
+                               "back in" if in_rotation else "out of", lag, error)
+            if in_rotation:
+                rotation.append(pool)
+
+        with self._lock:
+            self._rotation = rotation
+
+    def note_write(self, tables):
+        now = time.monotonic()
+        with self._lock:
+            for table in tables:
+                self._writes[table] = now
+
+    def _recently_written(self, tables):
+        if self.max_lag is None or not tables:
+            return False
+        if self.write_times is not None:
+            written = self.write_times(tables)
+            return written is not None and time.time() - written < self.max_lag
+        with self._lock:
+            return any(time.monotonic() - self._writes.get(table, float('-inf')) < self.max_lag for table in tables)
+
+    def read_pool(self, tables=()):
+        # Checked before taking the lock, as write_times may ask another server
+        recently_written = bool(self.replicas) and self._recently_written(tables)
+        with self._lock:
+            rotation = self._rotation
+            if not rotation or recently_written:
+                self._primary_reads += 1
+                return self.primary
+            self._replica_reads += 1
+            return rotation[next(self._turn) % len(rotation)]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_lag": self.max_lag,
+                "replica_reads": self._replica_reads,
+                "primary_reads": self._primary_reads,
+                "replicas": {name: dict(status, pool=self.replicas[name].stats())
+                             for name, status in self._status.items()}
+            }
@@ -0,0 +1,209 @@
+"""
+Group-commit writer for the summary tables fed by loans and cart changes.
+
+With the writer enabled, a checkout commits its inventory change, its Transactions rows
+and its cart cleanup, and nothing else. The Loan_Summary and Cart_Summary updates that go
+with it, like those of cart adds and removes, are put on a bounded in-process queue, and
+a background thread writes them in batches: it waits for the first event, keeps collecting
+for up to 'linger' seconds or until 'batch_size' rows, then writes every kind in the batch
+as multi-row statements and commits once. Requests then no longer wait on the hot summary
+rows, and many of them share one commit for their summary updates.
+
+Loans never go through the writer: Transactions is the record of who holds which book,
+so each loan is written in its checkout's transaction, with the database's NOW() as its
+borrowDate.
+
+When the queue is full, submit() waits up to put_timeout for room and then writes the
+events itself, so a database that falls behind slows producers down instead of growing
+the queue or losing events. close() drains the queue; events submitted after that are
+written directly by the caller.
+
+Queued events are lost if the process dies before they are written, and a batch that
+still fails after max_retries is dropped. Either way only summary counts go missing, and
+rebuild-summaries recomputes them from Transactions and Cart_Items.
+"""
+import logging
+import queue
+import threading
+import time
+
+from report_summaries import record_cart_adds, record_cart_removes, record_loans
+
+logger = logging.getLogger('library.events')
+
+LOAN_SUMMARY = 'loan_summary'
+CART_ADD = 'cart_add'
+CART_REMOVE = 'cart_remove'
+
+
+# How each kind of event is written, in the order a batch writes them. Only derived counts
+# belong here, since a batch that cannot be written is dropped.
+WRITERS = (
+    (LOAN_SUMMARY, record_loans),
+    (CART_ADD, record_cart_adds),
+    (CART_REMOVE, record_cart_removes)
+)
+
+_STOP = object()
+
+
+def loan_events(user_id, book_ids):
+    """The summary events a checkout of book_ids by user_id produces, as (kind, rows) pairs."""
+    return [
+        (LOAN_SUMMARY, [(user_id, book_id) for book_id in book_ids]),
+        (CART_REMOVE, list(book_ids))
+    ]
+
+
+class EventWriter:
+    def __init__(self, connection_factory, batch_size=500, linger=0.005, max_queue=10000, put_timeout=1.0,
+                 max_retries=3):
+        self.connection_factory = connection_factory
+        self.batch_size = batch_size
+        self.linger = linger
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self._submitted = 0
+        self._written = 0
+        self._batches = 0
+        self._direct_writes = 0
+        self._dropped = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='event-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, events):
+        """Queues (kind, rows) pairs to be written together. Blocks while the queue is full."""
+        kinds = {kind for kind, _ in WRITERS}
+        unknown = [kind for kind, _ in events if kind not in kinds]
+        if unknown:
+            raise ValueError(f"Unknown event kinds: {unknown}")
+        events = [(kind, rows) for kind, rows in events if rows]
+        if not events:
+            return
+        with self._lock:
+            self._submitted += sum(len(rows) for _, rows in events)
+        if self._closed:
+            # Shutting down: nothing will read the queue any more
+            self._write(events)
+            return
+        try:
+            self._queue.put(events, timeout=self.put_timeout)
+        except queue.Full:
+            # Backpressure: the caller pays for the write instead of the queue growing
+            with self._lock:
+                self._direct_writes += 1
+            self._write(events)
+
+    def close(self, timeout=30):
+        """Stops accepting events and waits up to timeout seconds for queued ones to be written."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is None:
+            self._drain()
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error("Event writer did not drain within %ss; %s batches still queued",
+                         timeout, self._queue.qsize())
+        else:
+            # Events queued by a submit that raced with close
+            self._drain()
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                batch.extend(item)
+        if batch:
+            self._write(batch)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = list(item)
+            pending = sum(len(rows) for _, rows in item)
+            stopping = False
+            deadline = time.monotonic() + self.linger
+            while pending < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.extend(item)
+                pending += sum(len(rows) for _, rows in item)
+            self._write(batch)
+            if stopping:
+                break
+        self._drain()
+
+    def _write(self, events):
+        rows_by_kind = {}
+        for kind, rows in events:
+            rows_by_kind.setdefault(kind, []).extend(rows)
+        total = sum(len(rows) for rows in rows_by_kind.values())
+
+        for attempt in range(self.max_retries + 1):
+            connection = None
+            try:
+                connection = self.connection_factory()
+                cur = connection.cursor()
+                for kind, write in WRITERS:
+                    if rows_by_kind.get(kind):
+                        write(cur, rows_by_kind[kind])
+                connection.commit()
+                with self._lock:
+                    self._written += total
+                    self._batches += 1
+                return
+            except Exception as e:
+                if connection:
+                    try:
+                        connection.rollback()
+                    except Exception:
+                        pass
+                logger.warning("Writing %s events failed (attempt %s): %s", total, attempt + 1, e)
+                time.sleep(min(0.1 * 2 ** attempt, 2))
+            finally:
+                if connection:
+                    connection.close()
+
+        with self._lock:
+            self._dropped += total
+        logger.error("Dropped %s summary events after %s attempts; run rebuild-summaries to recount them: %r",
+                     total, self.max_retries + 1, rows_by_kind)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "submitted": self._submitted,
+                "written": self._written,
+                "batches": self._batches,
+                "direct_writes": self._direct_writes,
+                "dropped": self._dropped,
+                "batch_size": self.batch_size,
+                "linger": self.linger
+            }
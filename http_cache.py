@@ -0,0 +1,95 @@
+"""
+Conditional GET and response compression.
+
+Catalog responses carry a strong ETag built from the versions of the tables they are read
+from, so it can be computed, and a matching If-None-Match answered with 304, before any
+query runs. Compressed representations get the encoding appended to their ETag, since a
+strong ETag has to identify the exact bytes sent.
+
+Response bodies above a minimum size are compressed with Brotli when the brotli package
+is installed and the client accepts it, otherwise with gzip.
+"""
+import gzip
+import hashlib
+import zlib
+
+from serializers import COLUMNAR_JSON, MSGPACK
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/plain', 'text/html', COLUMNAR_JSON, MSGPACK)
+
+
+def make_etag(epoch, key, versions):
+    digest = hashlib.blake2b(repr(key).encode(), digest_size=8).hexdigest()
+    return f"{epoch}-{'.'.join(str(version) for version in versions)}-{digest}"
+
+
+def available_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate_encoding(accept_encodings):
+    # accept_encodings is werkzeug's parsed Accept-Encoding header; q=0 entries are never chosen
+    return accept_encodings.best_match(available_encodings())
+
+
+def matching_etag(if_none_match, etag, encoding):
+    """Returns the ETag of the representation the client already holds, or None."""
+    if not if_none_match:
+        return None
+    if encoding is not None and if_none_match.contains(f"{etag}-{encoding}"):
+        return f"{etag}-{encoding}"
+    if if_none_match.contains(etag):
+        return etag
+    return None
+
+
+def _compress_stream(chunks, encoding, gzip_level, brotli_quality):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=brotli_quality)
+        compress, finish = compressor.process, compressor.finish
+    else:
+        # wbits=31 writes a gzip header and trailer around the deflate stream
+        compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+        compress, finish = compressor.compress, compressor.flush
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = compress(chunk)
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def compress_response(response, encoding, min_size=1024, gzip_level=6, brotli_quality=5):
+    if (encoding is None or response.status_code != 200 or response.direct_passthrough
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+
+    if response.is_streamed:
+        # Streams are compressed chunk by chunk as they are generated; their size is not known up front
+        response.response = _compress_stream(response.response, encoding, gzip_level, brotli_quality)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        if encoding == 'br':
+            response.set_data(brotli.compress(data, quality=brotli_quality))
+        else:
+            response.set_data(gzip.compress(data, compresslevel=gzip_level))
+    response.headers['Content-Encoding'] = encoding
+
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak=weak)
+    return response
@@ -0,0 +1,259 @@
+"""
+Sharded inventory counters and time-limited reservations.
+
+A book's available copies are spread over a fixed number of rows in Inventory_Slots. Taking
+a copy decrements one randomly chosen slot, so concurrent checkouts of the same title
+usually lock different rows instead of queueing on one. If that slot is empty the next
+non-empty slot nobody else has locked is used (SKIP LOCKED), and only when every
+remaining copy sits in a locked slot does the caller wait. Availability is the sum of a
+book's slots, a primary-key range read of a few rows.
+
+A reservation takes a copy when a book is put in a cart and holds it until expiresAt. Expired
+reservations are returned to their slot by expire_reservations, which ReservationReaper
+runs in the background.
+
+Books.bookCount is not updated while the slots are in use, as that would put every checkout
+of a title back on its one Books row. Catalog reads compute the count from the slots instead
+(statements.SLOT_BOOK_COUNT), and sync_book_counts writes it back to Books.bookCount before
+sharded inventory is turned off.
+"""
+import logging
+import random
+import threading
+from collections import Counter
+
+logger = logging.getLogger('library.inventory')
+
+DEFAULT_SLOTS = 8
+
+
+def create_inventory_tables(cur):
+    cur.execute('''CREATE TABLE IF NOT EXISTS Inventory_Slots (
+                    bookID INTEGER,
+                    slot TINYINT UNSIGNED,
+                    available INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (bookID, slot),
+                    FOREIGN KEY (bookID) REFERENCES Books(bookID))''')
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS Reservations (
+                    reservationID INTEGER PRIMARY KEY AUTO_INCREMENT,
+                    cartID INTEGER NOT NULL,
+                    bookID INTEGER NOT NULL,
+                    slot TINYINT UNSIGNED NOT NULL,
+                    expiresAt DATETIME NOT NULL,
+                    FOREIGN KEY (cartID) REFERENCES Cart(cartID),
+                    FOREIGN KEY (bookID) REFERENCES Books(bookID),
+                    INDEX (cartID, bookID),
+                    INDEX (expiresAt))''')
+
+
+def seed_slots(cur, slots=DEFAULT_SLOTS, book_ids=None):
+    """Spreads Books.bookCount over the slots of books that have none yet. Returns the rows written."""
+    numbers = ' UNION ALL '.join(f'SELECT {slot} AS slot' for slot in range(slots))
+    where = ''
+    params = (slots, slots)
+    if book_ids:
+        where = f"AND b.bookID IN ({', '.join(['%s'] * len(book_ids))})"
+        params += tuple(book_ids)
+    # Slot n gets count DIV slots copies, plus one of the remainder while n < count MOD slots
+    cur.execute(f'''INSERT INTO Inventory_Slots (bookID, slot, available)
+                    SELECT b.bookID, s.slot,
+                           GREATEST(COALESCE(b.bookCount, 0), 0) DIV %s
+                           + (s.slot < GREATEST(COALESCE(b.bookCount, 0), 0) MOD %s)
+                    FROM Books b CROSS JOIN ({numbers}) s
+                    WHERE NOT EXISTS (SELECT 1 FROM Inventory_Slots i WHERE i.bookID = b.bookID) {where}''',
+                params)
+    return cur.rowcount
+
+
+def rebuild_slots(connection, slots=DEFAULT_SLOTS):
+    """
+    Resets every book's slots from Books.bookCount and drops all reservations. Use it when
+    turning sharded inventory on after checkouts have been decrementing Books.bookCount.
+    """
+    cur = connection.cursor()
+    try:
+        cur.execute("DELETE FROM Reservations")
+        cur.execute("DELETE FROM Inventory_Slots")
+        rows = seed_slots(cur, slots)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return rows
+
+
+def sync_book_counts(connection):
+    """Sets Books.bookCount to the copies in each book's slots and reservations. Returns the rows changed."""
+    cur = connection.cursor()
+    try:
+        cur.execute('''UPDATE Books b
+                       JOIN (SELECT bookID, SUM(available) AS copies FROM Inventory_Slots GROUP BY bookID) s
+                         ON s.bookID = b.bookID
+                       LEFT JOIN (SELECT bookID, COUNT(*) AS held FROM Reservations GROUP BY bookID) r
+                         ON r.bookID = b.bookID
+                       SET b.bookCount = s.copies + COALESCE(r.held, 0)''')
+        rows = cur.rowcount
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return rows
+
+
+def forget_book(cur, book_id):
+    # Slots and reservations would otherwise block deleting the book through their foreign keys
+    cur.execute("DELETE FROM Reservations WHERE bookID=%s", (book_id,))
+    cur.execute("DELETE FROM Inventory_Slots WHERE bookID=%s", (book_id,))
+
+
+def add_copies(cur, book_id, copies=1, slots=DEFAULT_SLOTS):
+    cur.execute('''INSERT INTO Inventory_Slots (bookID, slot, available) VALUES (%s, %s, %s)
+                   ON DUPLICATE KEY UPDATE available = available + VALUES(available)''',
+                (book_id, random.randrange(slots), copies))
+
+
+def give_back(cur, book_id, slot, copies=1):
+    cur.execute("UPDATE Inventory_Slots SET available = available + %s WHERE bookID=%s AND slot=%s",
+                (copies, book_id, slot))
+
+
+def take(cur, book_id, slots=DEFAULT_SLOTS):
+    """
+    Takes one copy of a book inside the caller's transaction and returns the slot it came
+    from, or None when no copy is left.
+    """
+    slot = random.randrange(slots)
+    cur.execute('''UPDATE Inventory_Slots SET available = available - 1
+                   WHERE bookID=%s AND slot=%s AND available > 0''', (book_id, slot))
+    if cur.rowcount == 1:
+        return slot
+
+    # That slot was empty; try any non-empty slot no other transaction holds, then wait for one
+    for lock_clause in ('FOR UPDATE SKIP LOCKED', 'FOR UPDATE'):
+        cur.execute(f'''SELECT slot FROM Inventory_Slots WHERE bookID=%s AND available > 0
+                        ORDER BY available DESC LIMIT 1 {lock_clause}''', (book_id,))
+        row = cur.fetchone()
+        if row is not None:
+            cur.execute("UPDATE Inventory_Slots SET available = available - 1 WHERE bookID=%s AND slot=%s",
+                        (book_id, row[0]))
+            return row[0]
+    return None
+
+
+def available_copies(cur, book_ids):
+    if not book_ids:
+        return {}
+    placeholders = ', '.join(['%s'] * len(book_ids))
+    cur.execute(f'''SELECT bookID, SUM(available) FROM Inventory_Slots
+                    WHERE bookID IN ({placeholders}) GROUP BY bookID''', tuple(book_ids))
+    return {book_id: int(total) for book_id, total in cur.fetchall()}
+
+
+def reserved_copies(cur, book_ids):
+    if not book_ids:
+        return {}
+    placeholders = ', '.join(['%s'] * len(book_ids))
+    cur.execute(f'''SELECT bookID, COUNT(*) FROM Reservations
+                    WHERE bookID IN ({placeholders}) AND expiresAt > NOW() GROUP BY bookID''', tuple(book_ids))
+    return dict(cur.fetchall())
+
+
+def reserve(cur, cart_id, book_id, ttl, slots=DEFAULT_SLOTS):
+    """Takes a copy for a cart for ttl seconds, inside the caller's transaction. Returns False if none is left."""
+    slot = take(cur, book_id, slots)
+    if slot is None:
+        return False
+    cur.execute('''INSERT INTO Reservations (cartID, bookID, slot, expiresAt)
+                   VALUES (%s, %s, %s, NOW() + INTERVAL %s SECOND)''', (cart_id, book_id, slot, ttl))
+    return True
+
+
+def release(cur, cart_id, book_id):
+    """Cancels a cart's reservation of a book and returns its copy."""
+    cur.execute("SELECT reservationID, slot FROM Reservations WHERE cartID=%s AND bookID=%s FOR UPDATE",
+                (cart_id, book_id))
+    rows = cur.fetchall()
+    for reservation_id, slot in rows:
+        give_back(cur, book_id, slot)
+        cur.execute("DELETE FROM Reservations WHERE reservationID=%s", (reservation_id,))
+    return len(rows)
+
+
+def claim_reservations(cur, cart_id):
+    """
+    Locks a cart's unexpired reservations for checkout and returns the reserved book IDs.
+    The lock keeps expire_reservations, which skips locked rows, from handing them back meanwhile.
+    """
+    cur.execute('''SELECT reservationID, bookID FROM Reservations
+                   WHERE cartID=%s AND expiresAt > NOW() FOR UPDATE''', (cart_id,))
+    rows = cur.fetchall()
+    if rows:
+        placeholders = ', '.join(['%s'] * len(rows))
+        cur.execute(f"DELETE FROM Reservations WHERE reservationID IN ({placeholders})",
+                    tuple(reservation_id for reservation_id, _ in rows))
+    return {book_id for _, book_id in rows}
+
+
+def expire_reservations(connection, batch_size=500):
+    """Returns the copies of expired reservations to their slots. Returns the number expired."""
+    cur = connection.cursor()
+    try:
+        cur.execute('''SELECT reservationID, bookID, slot FROM Reservations
+                       WHERE expiresAt <= NOW() ORDER BY expiresAt LIMIT %s
+                       FOR UPDATE SKIP LOCKED''', (batch_size,))
+        rows = cur.fetchall()
+        if not rows:
+            connection.rollback()
+            return 0
+        for (book_id, slot), copies in sorted(Counter((book_id, slot) for _, book_id, slot in rows).items()):
+            give_back(cur, book_id, slot, copies)
+        placeholders = ', '.join(['%s'] * len(rows))
+        cur.execute(f"DELETE FROM Reservations WHERE reservationID IN ({placeholders})",
+                    tuple(row[0] for row in rows))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return len(rows)
+
+
+class ReservationReaper:
+    """Background thread that expires reservations every interval seconds."""
+
+    def __init__(self, connection_factory, interval=30, batch_size=500):
+        self.connection_factory = connection_factory
+        self.interval = interval
+        self.batch_size = batch_size
+        self.expired = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='reservation-reaper', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.warning("Expiring reservations failed: %s", e)
+
+    def run_once(self):
+        expired = 0
+        while True:
+            connection = self.connection_factory()
+            try:
+                count = expire_reservations(connection, self.batch_size)
+            finally:
+                connection.close()
+            expired += count
+            if count < self.batch_size:
+                break
+        self.expired += expired
+        return expired
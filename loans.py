@@ -0,0 +1,293 @@
+"""
+Loan returns, open and overdue loan lookups, and the monthly partitions of Transactions.
+
+Transactions is RANGE partitioned by borrowDate, one partition per month, with p_before
+below the first month and p_future for anything past the last one. Lookups that filter
+on borrowDate only touch the partitions in range, and old months can be removed as a
+whole instead of row by row. Open loans are found through (userID, returnDate, bookID),
+(bookID, returnDate) and (returnDate, borrowDate), where the open ones are the
+returnDate IS NULL entries at the front of each partition's index.
+
+rotate_partitions adds the partitions of the coming months and retires the ones older
+than keep_months: a partition is swapped with the empty Transactions_Exchange table
+(a metadata change), then dropped, and the swapped-out rows are copied to
+Transactions_Archive or exported as a gzip'd CSV file. Loans still open when their month
+is retired are always kept in Transactions_Archive. Between the swap and the copy they
+are only in Transactions_Exchange, so returns and lookups check Transactions, then
+Transactions_Exchange, then Transactions_Archive, and the copy moves open loans out of
+Transactions_Exchange in one transaction with their rows locked. A return running
+meanwhile either closes the loan before it is copied or finds it in the archive.
+Run it at least once a month, e.g. from cron:
+
+    flask rotate-transactions
+"""
+import csv
+import datetime
+import gzip
+import logging
+import os
+
+logger = logging.getLogger('library.loans')
+
+ROTATION_LOCK = 'library_transactions_rotation'
+EXCHANGE_TABLE = 'Transactions_Exchange'
+ARCHIVE_TABLE = 'Transactions_Archive'
+COLUMNS = ('transactionID', 'userID', 'bookID', 'borrowDate', 'returnDate')
+# Every table a loan can be in, in the order returns look for it
+LOAN_TABLES = ('Transactions', EXCHANGE_TABLE, ARCHIVE_TABLE)
+
+# Partitioned tables cannot be referenced by or have foreign keys, and need the
+# partitioning column in the primary key
+TRANSACTIONS_COLUMNS = '''transactionID INTEGER AUTO_INCREMENT,
+                    userID INTEGER,
+                    bookID INTEGER,
+                    borrowDate DATETIME NOT NULL,
+                    returnDate DATETIME,
+                    PRIMARY KEY (transactionID, borrowDate),
+                    INDEX idx_transactions_user_borrow (userID, borrowDate),
+                    INDEX idx_transactions_book_borrow (bookID, borrowDate),
+                    INDEX idx_transactions_user_open (userID, returnDate, bookID),
+                    INDEX idx_transactions_book_open (bookID, returnDate),
+                    INDEX idx_transactions_open_borrow (returnDate, borrowDate)'''
+
+# Stand-in borrowDate for loans whose date was unreadable (NULL since migration 4)
+UNKNOWN_BORROW_DATE = '1970-01-01'
+
+
+def month_start(day):
+    return datetime.date(day.year, day.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"p{month:%Y%m}"
+
+
+def _partition_clause(month, last_month):
+    partitions = [f"PARTITION p_before VALUES LESS THAN ('{month}')"]
+    while month <= last_month:
+        partitions.append(f"PARTITION {partition_name(month)} VALUES LESS THAN ('{add_months(month, 1)}')")
+        month = add_months(month, 1)
+    partitions.append("PARTITION p_future VALUES LESS THAN (MAXVALUE)")
+    return (',\n' + ' ' * 20).join(partitions)
+
+
+def partitioned_transactions_ddl(table, first_month, last_month):
+    """CREATE TABLE for a Transactions table with one partition per month from first_month to last_month."""
+    return f'''CREATE TABLE {table} (
+                    {TRANSACTIONS_COLUMNS})
+                PARTITION BY RANGE COLUMNS (borrowDate) (
+                    {_partition_clause(first_month, last_month)})'''
+
+
+def create_archive_table(cur):
+    cur.execute(f'''CREATE TABLE IF NOT EXISTS {ARCHIVE_TABLE} (
+                    {TRANSACTIONS_COLUMNS})''')
+    # Returns and open-loan lookups read the exchange table too, so it must always exist
+    cur.execute(f"CREATE TABLE IF NOT EXISTS {EXCHANGE_TABLE} LIKE {ARCHIVE_TABLE}")
+
+
+def is_partitioned(cur, table='Transactions'):
+    cur.execute('''SELECT COUNT(*) FROM information_schema.partitions
+                   WHERE table_schema = DATABASE() AND table_name=%s AND partition_name IS NOT NULL''', (table,))
+    return cur.fetchone()[0] > 0
+
+
+def partition_names(cur):
+    cur.execute('''SELECT partition_name FROM information_schema.partitions
+                   WHERE table_schema = DATABASE() AND table_name = 'Transactions' AND partition_name IS NOT NULL
+                   ORDER BY partition_ordinal_position''')
+    return [row[0] for row in cur.fetchall()]
+
+
+def monthly_partitions(names):
+    """Returns the months that have their own partition, oldest first."""
+    return [datetime.date(int(name[1:5]), int(name[5:7]), 1)
+            for name in names if name.startswith('p') and name[1:].isdigit()]
+
+
+def _archive_exchanged(connection, export_dir, label):
+    """Moves the rows in Transactions_Exchange to the archive table or an export file."""
+    cur = connection.cursor()
+    if export_dir:
+        path = os.path.join(export_dir, f"transactions_{label}.csv.gz")
+        cur.execute(f"SELECT {', '.join(COLUMNS)} FROM {EXCHANGE_TABLE} ORDER BY transactionID")
+        rows = 0
+        with gzip.open(path + '.tmp', 'wt', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            while True:
+                chunk = cur.fetchmany(10000)
+                if not chunk:
+                    break
+                writer.writerows(chunk)
+                rows += len(chunk)
+        with open(path + '.tmp', 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        logger.info("Exported %s loans to %s", rows, path)
+        # Open loans must stay returnable, so they are archived in the database as well
+        where = "WHERE returnDate IS NULL"
+    else:
+        where = ""
+    # Lock the open loans first: a return holding one finishes before it is copied, and
+    # a return that comes later waits here and then finds the loan in the archive
+    cur.execute(f"SELECT transactionID FROM {EXCHANGE_TABLE} WHERE returnDate IS NULL FOR UPDATE")
+    cur.fetchall()
+    # IGNORE makes a rerun after an interruption harmless
+    cur.execute(f"INSERT IGNORE INTO {ARCHIVE_TABLE} ({', '.join(COLUMNS)}) "
+                f"SELECT {', '.join(COLUMNS)} FROM {EXCHANGE_TABLE} {where}")
+    cur.execute(f"DELETE FROM {EXCHANGE_TABLE} WHERE returnDate IS NULL")
+    connection.commit()
+    # Only returned loans are left, which returns and open-loan lookups never read
+    cur.execute(f"TRUNCATE TABLE {EXCHANGE_TABLE}")
+
+
+def rotate_partitions(connection, keep_months=24, months_ahead=3, export_dir=None, today=None):
+    """
+    Adds monthly partitions up to months_ahead past the current month and retires those
+    entirely older than keep_months. Returns the names of the added and retired partitions.
+    """
+    cur = connection.cursor()
+    cur.execute("SELECT GET_LOCK(%s, 0)", (ROTATION_LOCK,))
+    if cur.fetchone()[0] != 1:
+        raise RuntimeError("Another process is rotating the Transactions partitions.")
+    try:
+        if not is_partitioned(cur):
+            raise RuntimeError("Transactions is not partitioned yet; run the schema migrations first.")
+        current = month_start(today or datetime.date.today())
+        names = partition_names(cur)
+        months = monthly_partitions(names)
+
+        added = []
+        target = add_months(current, months_ahead)
+        month = add_months(months[-1], 1) if months else current
+        while month <= target:
+            added.append(month)
+            month = add_months(month, 1)
+        if added:
+            # p_future is empty in normal operation, which makes splitting it cheap
+            new_partitions = ', '.join(f"PARTITION {partition_name(month)} VALUES LESS THAN ('{add_months(month, 1)}')"
+                                       for month in added)
+            cur.execute(f'''ALTER TABLE Transactions REORGANIZE PARTITION p_future INTO (
+                                {new_partitions}, PARTITION p_future VALUES LESS THAN (MAXVALUE))''')
+
+        create_archive_table(cur)
+        # A previous run was interrupted after swapping a partition out
+        cur.execute(f"SELECT MIN(borrowDate) FROM {EXCHANGE_TABLE}")
+        leftover = cur.fetchone()[0]
+        connection.commit()
+        if leftover is not None:
+            _archive_exchanged(connection, export_dir, partition_name(month_start(leftover)))
+
+        # EXCHANGE PARTITION needs an identical, unpartitioned table, so it is recreated from
+        # Transactions and renamed into place, leaving no moment without an exchange table
+        cur.execute(f"DROP TABLE IF EXISTS {EXCHANGE_TABLE}_new, {EXCHANGE_TABLE}_old")
+        cur.execute(f"CREATE TABLE {EXCHANGE_TABLE}_new LIKE Transactions")
+        cur.execute(f"ALTER TABLE {EXCHANGE_TABLE}_new REMOVE PARTITIONING")
+        cur.execute(f"RENAME TABLE {EXCHANGE_TABLE} TO {EXCHANGE_TABLE}_old, {EXCHANGE_TABLE}_new TO {EXCHANGE_TABLE}")
+        cur.execute(f"DROP TABLE {EXCHANGE_TABLE}_old")
+
+        cutoff = add_months(current, -keep_months)
+        retired = []
+        # p_before goes first, as soon as the oldest monthly partition is due too
+        candidates = (['p_before'] if 'p_before' in names and months and months[0] <= cutoff else []) + \
+                     [partition_name(month) for month in months if add_months(month, 1) <= cutoff]
+        for name in candidates:
+            cur.execute(f"ALTER TABLE Transactions EXCHANGE PARTITION {name} WITH TABLE {EXCHANGE_TABLE}")
+            cur.execute(f"ALTER TABLE Transactions DROP PARTITION {name}")
+            _archive_exchanged(connection, export_dir, name)
+            retired.append(name)
+            logger.info("Retired partition %s", name)
+        return {"added": [partition_name(month) for month in added], "retired": retired}
+    finally:
+        cur.execute("SELECT RELEASE_LOCK(%s)", (ROTATION_LOCK,))
+        cur.fetchone()
+
+
+def _pair_clause(pairs):
+    return ', '.join(['(%s, %s)'] * len(pairs)), tuple(value for pair in pairs for value in pair)
+
+
+def close_loans(cur, pairs):
+    """
+    Marks the oldest open loan of each (userID, bookID) pair returned, inside the caller's
+    transaction. A pair listed twice closes two loans. Returns one transactionID per pair,
+    or None where the user has no open loan of that book.
+    """
+    closed = [None] * len(pairs)
+    pending = list(range(len(pairs)))
+    for table in LOAN_TABLES:
+        if not pending:
+            break
+        wanted = sorted({pairs[index] for index in pending})
+        placeholders, params = _pair_clause(wanted)
+        cur.execute(f'''SELECT transactionID, borrowDate, userID, bookID FROM {table}
+                        WHERE (userID, bookID) IN ({placeholders}) AND returnDate IS NULL
+                        ORDER BY borrowDate, transactionID
+                        FOR UPDATE''', params)
+        open_loans = {}
+        for transaction_id, borrow_date, user_id, book_id in cur.fetchall():
+            open_loans.setdefault((user_id, book_id), []).append((transaction_id, borrow_date))
+
+        keys = []
+        still_pending = []
+        for index in pending:
+            loans = open_loans.get(pairs[index])
+            if loans:
+                keys.append(loans.pop(0))
+                closed[index] = keys[-1][0]
+            else:
+                still_pending.append(index)
+        if keys:
+            placeholders, params = _pair_clause(sorted(keys))
+            cur.execute(f'''UPDATE {table} SET returnDate = NOW()
+                            WHERE (transactionID, borrowDate) IN ({placeholders})''', params)
+        pending = still_pending
+    return closed
+
+
+def open_loans(cur, user_id=None, book_id=None):
+    """Returns (transactionID, userID, bookID, borrowDate) of the open loans of a user, a book or both."""
+    conditions = ["returnDate IS NULL"]
+    params = []
+    if user_id is not None:
+        conditions.append("userID=%s")
+        params.append(user_id)
+    if book_id is not None:
+        conditions.append("bookID=%s")
+        params.append(book_id)
+    where = ' AND '.join(conditions)
+    union = '\nUNION ALL\n'.join(f"SELECT transactionID, userID, bookID, borrowDate FROM {table} WHERE {where}"
+                                  for table in LOAN_TABLES)
+    cur.execute(f"{union}\nORDER BY borrowDate, transactionID", tuple(params) * len(LOAN_TABLES))
+    return cur.fetchall()
+
+
+def overdue_loans(cur, as_of, loan_days, limit=100, after=None):
+    """
+    Returns loans still open on as_of that were borrowed more than loan_days days before it,
+    oldest first, as (transactionID, userID, user name, bookID, title, borrowDate) rows.
+    after is the (borrowDate, transactionID) of the last row of the previous page.
+    """
+    due_before = datetime.datetime.combine(as_of, datetime.time()) - datetime.timedelta(days=loan_days)
+    conditions = "returnDate IS NULL AND borrowDate < %s"
+    params = [due_before]
+    if after is not None:
+        conditions += " AND (borrowDate > %s OR (borrowDate = %s AND transactionID > %s))"
+        params.extend((after[0], after[0], after[1]))
+    # Each table is cut to the page size first, so only limit rows per table are joined
+    union = '\nUNION ALL\n'.join(f"(SELECT transactionID, userID, bookID, borrowDate FROM {table} "
+                                  f"WHERE {conditions} ORDER BY borrowDate, transactionID LIMIT %s)"
+                                  for table in LOAN_TABLES)
+    cur.execute(f'''SELECT o.transactionID, o.userID, u.name, o.bookID, b.title, o.borrowDate
+                    FROM ({union}) o
+                    LEFT JOIN Users u ON u.userID = o.userID
+                    LEFT JOIN Books b ON b.bookID = o.bookID
+                    ORDER BY o.borrowDate, o.transactionID
+                    LIMIT %s''', (tuple(params) + (limit,)) * len(LOAN_TABLES) + (limit,))
+    return cur.fetchall()
@@ -0,0 +1,195 @@
+"""
+Per-request timing and query instrumentation exported in Prometheus text format.
+
+Each request gets a RequestStats object held in a context variable. Instrumented
+cursors add their query count, database time and fetched rows to it without taking
+any lock, and the totals are merged into the shared per-route metrics once, when the
+response is finished.
+"""
+import contextvars
+import threading
+import time
+from collections import defaultdict
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ACQUIRE_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+_current = contextvars.ContextVar('request_stats', default=None)
+
+
+def _format(value):
+    return str(value) if isinstance(value, int) else f'{value:.6f}'
+
+
+class RequestStats:
+    __slots__ = ('start', 'queries', 'db_time', 'rows', 'acquire_time')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.acquire_time = 0.0
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class InstrumentedCursor:
+    """
+    Wraps a DB-API cursor and charges its statements and fetched rows to the current request.
+    Each listener is called as listener(operation, params, seconds, many) after every statement.
+    """
+
+    def __init__(self, cursor, listeners=()):
+        self._cursor = cursor
+        self._listeners = listeners
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        for row in self._cursor:
+            stats = _current.get()
+            if stats is not None:
+                stats.rows += 1
+            yield row
+
+    def _timed(self, method, args, kwargs, many):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            stats = _current.get()
+            if stats is not None:
+                stats.queries += 1
+                stats.db_time += elapsed
+            if self._listeners:
+                operation = args[0] if args else kwargs.get('operation')
+                params = args[1] if len(args) > 1 else kwargs.get('params', kwargs.get('seq_params'))
+                for listener in self._listeners:
+                    listener(operation, params, elapsed, many)
+
+    def execute(self, *args, **kwargs):
+        return self._timed(self._cursor.execute, args, kwargs, False)
+
+    def executemany(self, *args, **kwargs):
+        return self._timed(self._cursor.executemany, args, kwargs, True)
+
+    def _count_rows(self, rows, start):
+        stats = _current.get()
+        if stats is not None:
+            stats.db_time += time.perf_counter() - start
+            stats.rows += rows
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._count_rows(1 if row is not None else 0, start)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        start = time.perf_counter()
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._count_rows(len(rows), start)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._count_rows(len(rows), start)
+        return rows
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self._acquire = defaultdict(lambda: Histogram(ACQUIRE_BUCKETS))
+        self._queries = defaultdict(int)
+        self._db_time = defaultdict(float)
+        self._rows = defaultdict(int)
+
+    def start_request(self):
+        stats = RequestStats()
+        return stats, _current.set(stats)
+
+    def end_request(self, token):
+        _current.reset(token)
+
+    def record_acquire(self, seconds):
+        stats = _current.get()
+        if stats is not None:
+            stats.acquire_time += seconds
+
+    def finish_request(self, stats, route, method, status):
+        elapsed = time.perf_counter() - stats.start
+        with self._lock:
+            self._latency[(route, method, status)].observe(elapsed)
+            self._acquire[(route, method)].observe(stats.acquire_time)
+            self._queries[(route, method)] += stats.queries
+            self._db_time[(route, method)] += stats.db_time
+            self._rows[(route, method)] += stats.rows
+        return elapsed
+
+    def render(self, gauges=(), counters=()):
+        # gauges and counters are iterables of (name, help, {label string: value}) added as-is; counters
+        # must only ever grow (totals since the process started) so rate() works on them
+        with self._lock:
+            lines = [
+                '# HELP library_http_request_duration_seconds Request latency by route.',
+                '# TYPE library_http_request_duration_seconds histogram'
+            ]
+            for (route, method, status), histogram in sorted(self._latency.items()):
+                lines.extend(histogram.render('library_http_request_duration_seconds',
+                                              f'route="{route}",method="{method}",status="{status}"'))
+
+            lines += [
+                '# HELP library_db_connection_acquire_seconds Time spent borrowing pooled connections per request.',
+                '# TYPE library_db_connection_acquire_seconds histogram'
+            ]
+            for (route, method), histogram in sorted(self._acquire.items()):
+                lines.extend(histogram.render('library_db_connection_acquire_seconds',
+                                              f'route="{route}",method="{method}"'))
+
+            for name, help_text, values in (
+                    ('library_db_queries_total', 'Statements executed.', self._queries),
+                    ('library_db_time_seconds_total', 'Time spent in execute and fetch calls.', self._db_time),
+                    ('library_db_rows_fetched_total', 'Rows fetched from the database.', self._rows)):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+                for (route, method), value in sorted(values.items()):
+                    lines.append(f'{name}{{route="{route}",method="{method}"}} {_format(value)}')
+
+        for metric_type, metrics in (('gauge', gauges), ('counter', counters)):
+            for name, help_text, values in metrics:
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}']
+                for labels, value in sorted(values.items()):
+                    lines.append(f'{name}{{{labels}}} {_format(value)}' if labels else f'{name} {_format(value)}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,317 @@
+"""
+Versioned schema migrations.
+
+initialize_db creates the original (version 0) tables; every later schema change is a
+numbered migration here. Applied versions are recorded in Schema_Version, and a MySQL
+named lock makes sure only one process migrates at a time. Migrations are written so
+they can be re-run after an interruption.
+
+Column type changes are done online: a shadow column is added, kept in sync by
+triggers while existing rows are copied over in primary-key batches (one commit per
+batch), and then swapped in under a short table lock. A table that needs a new
+definition, such as partitioning, is rebuilt the same way as a whole: a new table kept in
+sync by triggers is filled in batches and swapped in with one atomic RENAME. Indexes are
+built with ALGORITHM=INPLACE, LOCK=NONE so reads and writes continue while they build.
+"""
+import datetime
+import logging
+import time
+
+from catalog_search import create_search_indexes
+from inventory import DEFAULT_SLOTS, create_inventory_tables, seed_slots
+from loans import (UNKNOWN_BORROW_DATE, add_months, create_archive_table, is_partitioned, month_start,
+                   partitioned_transactions_ddl)
+from recommendations import create_recommendation_tables
+from report_summaries import create_summary_tables
+from rollups import create_rollup_tables
+
+logger = logging.getLogger('library.migrations')
+
+LOCK_NAME = 'library_schema_migration'
+DEFAULT_BATCH_SIZE = 5000
+
+DATE_PATTERN = '^[0-9]{4}-[0-9]{2}-[0-9]{2}'
+DATETIME_PATTERN = '^[0-9]{4}-[0-9]{2}-[0-9]{2}( [0-9]{2}:[0-9]{2}:[0-9]{2}(\\\\.[0-9]+)?)?$'
+
+
+class MigrationError(Exception):
+    pass
+
+
+def create_version_table(cur):
+    cur.execute('''CREATE TABLE IF NOT EXISTS Schema_Version (
+                    version INTEGER PRIMARY KEY,
+                    name VARCHAR(255) NOT NULL,
+                    appliedAt DATETIME NOT NULL)''')
+
+
+def current_version(cur):
+    create_version_table(cur)
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM Schema_Version")
+    return cur.fetchone()[0]
+
+
+def column_type(cur, table, column):
+    cur.execute('''SELECT DATA_TYPE FROM information_schema.columns
+                   WHERE table_schema = DATABASE() AND table_name=%s AND column_name=%s''', (table, column))
+    row = cur.fetchone()
+    return row[0].lower() if row else None
+
+
+def index_exists(cur, table, index):
+    cur.execute('''SELECT 1 FROM information_schema.statistics
+                   WHERE table_schema = DATABASE() AND table_name=%s AND index_name=%s
+                   LIMIT 1''', (table, index))
+    return cur.fetchone() is not None
+
+
+def add_index(cur, table, index, columns):
+    if not index_exists(cur, table, index):
+        cur.execute(f"ALTER TABLE {table} ADD INDEX {index} ({columns}), ALGORITHM=INPLACE, LOCK=NONE")
+
+
+def drop_index(cur, table, index):
+    if index_exists(cur, table, index):
+        cur.execute(f"ALTER TABLE {table} DROP INDEX {index}, ALGORITHM=INPLACE, LOCK=NONE")
+
+
+def convert_columns_online(connection, table, key, conversions, batch_size, pause=0.0):
+    """
+    Changes the type of one or more columns without blocking writers for the whole copy.
+    conversions maps a column name to (new SQL type, SQL expression computing the new
+    value, where {col} stands for the old column).
+    """
+    cur = connection.cursor()
+    for column in conversions:
+        # A previous run was interrupted after the swap; only the old copy is left to drop
+        if column_type(cur, table, column + '_old') is not None:
+            cur.execute(f"ALTER TABLE {table} DROP COLUMN {column}_old, ALGORITHM=INPLACE, LOCK=NONE")
+
+    pending = {column: spec for column, spec in conversions.items()
+               if column_type(cur, table, column) != spec[0].split('(')[0].lower()}
+    if not pending:
+        return
+
+    trigger_prefix = f"migrate_{table.lower()}"
+    for column, (new_type, expression) in pending.items():
+        if column_type(cur, table, column + '_new') is None:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {column}_new {new_type} NULL")
+
+    # Triggers keep the shadow columns current for rows written while the copy runs
+    assignments = '; '.join(f"SET NEW.{column}_new = {expression.replace('{col}', 'NEW.' + column)}"
+                            for column, (_, expression) in pending.items())
+    for event in ('INSERT', 'UPDATE'):
+        cur.execute(f"DROP TRIGGER IF EXISTS {trigger_prefix}_{event.lower()}")
+        cur.execute(f'''CREATE TRIGGER {trigger_prefix}_{event.lower()} BEFORE {event} ON {table}
+                        FOR EACH ROW BEGIN {assignments}; END''')
+
+    cur.execute(f"SELECT COALESCE(MIN({key}), 0), COALESCE(MAX({key}), 0) FROM {table}")
+    low, high = cur.fetchone()
+    connection.commit()
+    updates = ', '.join(f"{column}_new = {expression.replace('{col}', column)}"
+                        for column, (_, expression) in pending.items())
+    start = low
+    while start <= high:
+        end = start + batch_size - 1
+        cur.execute(f"UPDATE {table} SET {updates} WHERE {key} BETWEEN %s AND %s", (start, end))
+        connection.commit()
+        logger.info("%s: converted %s rows up to %s=%s of %s", table, cur.rowcount, key, end, high)
+        start = end + 1
+        if pause:
+            time.sleep(pause)
+
+    # Swap the columns under a brief write lock so no write can slip between the trigger drop and the rename
+    renames = ', '.join(f"RENAME COLUMN {column} TO {column}_old, RENAME COLUMN {column}_new TO {column}"
+                        for column in pending)
+    cur.execute(f"LOCK TABLES {table} WRITE")
+    try:
+        for event in ('INSERT', 'UPDATE'):
+            cur.execute(f"DROP TRIGGER IF EXISTS {trigger_prefix}_{event.lower()}")
+        cur.execute(f"ALTER TABLE {table} {renames}")
+    finally:
+        cur.execute("UNLOCK TABLES")
+
+    drops = ', '.join(f"DROP COLUMN {column}_old" for column in pending)
+    cur.execute(f"ALTER TABLE {table} {drops}, ALGORITHM=INPLACE, LOCK=NONE")
+
+
+def table_exists(cur, table):
+    cur.execute('''SELECT 1 FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name=%s''',
+                (table,))
+    return cur.fetchone() is not None
+
+
+def rebuild_table_online(connection, table, create_sql, key, columns, expressions, batch_size, pause=0.0):
+    """
+    Replaces a table with a new definition (create_sql, creating {table}_new) without
+    blocking writers for the whole copy. Triggers mirror writes into the new table while
+    existing rows are copied in batches of key, then the two are swapped with one atomic
+    RENAME. expressions maps a column to the SQL computing its new value, with {col}
+    standing for the old column; other columns are copied as they are.
+    """
+    cur = connection.cursor()
+    # A previous run was interrupted after the swap; only the old copy is left to drop
+    if table_exists(cur, table + '_old'):
+        cur.execute(f"DROP TABLE {table}_old")
+        return
+
+    # Starting over is simpler than working out how far an interrupted copy got
+    cur.execute(f"DROP TABLE IF EXISTS {table}_new")
+    cur.execute(create_sql)
+
+    def values(prefix):
+        return ', '.join(expressions.get(column, '{col}').replace('{col}', prefix + column) for column in columns)
+
+    column_list = ', '.join(columns)
+    trigger_prefix = f"rebuild_{table.lower()}"
+    triggers = {
+        'insert': f"REPLACE INTO {table}_new ({column_list}) VALUES ({values('NEW.')})",
+        'update': f"DELETE FROM {table}_new WHERE {key} = OLD.{key}; "
+                  f"REPLACE INTO {table}_new ({column_list}) VALUES ({values('NEW.')})",
+        'delete': f"DELETE FROM {table}_new WHERE {key} = OLD.{key}"
+    }
+    for event, body in triggers.items():
+        cur.execute(f"DROP TRIGGER IF EXISTS {trigger_prefix}_{event}")
+        cur.execute(f'''CREATE TRIGGER {trigger_prefix}_{event} AFTER {event.upper()} ON {table}
+                        FOR EACH ROW BEGIN {body}; END''')
+
+    cur.execute(f"SELECT COALESCE(MIN({key}), 0), COALESCE(MAX({key}), 0) FROM {table}")
+    low, high = cur.fetchone()
+    connection.commit()
+    start = low
+    while start <= high:
+        end = start + batch_size - 1
+        # IGNORE keeps rows the triggers already wrote, which are at least as new as the copy
+        cur.execute(f'''INSERT IGNORE INTO {table}_new ({column_list})
+                        SELECT {values('')} FROM {table} WHERE {key} BETWEEN %s AND %s''', (start, end))
+        connection.commit()
+        logger.info("%s: copied %s rows up to %s=%s of %s", table, cur.rowcount, key, end, high)
+        start = end + 1
+        if pause:
+            time.sleep(pause)
+
+    # Triggers travel with the renamed table, so they are dropped only once nothing writes to it
+    cur.execute(f"RENAME TABLE {table} TO {table}_old, {table}_new TO {table}")
+    for event in triggers:
+        cur.execute(f"DROP TRIGGER IF EXISTS {trigger_prefix}_{event}")
+    cur.execute(f"DROP TABLE {table}_old")
+
+
+def date_expression(pattern, sql_type):
+    # Values that don't look like dates become NULL instead of failing the whole batch
+    return f"CASE WHEN {{col}} REGEXP '{pattern}' THEN CAST(LEFT({{col}}, 19) AS {sql_type}) END"
+
+
+def migrate_summary_tables(connection, options):
+    create_summary_tables(connection.cursor())
+
+
+def migrate_search_indexes(connection, options):
+    create_search_indexes(connection.cursor())
+
+
+def migrate_books_publication_date(connection, options):
+    convert_columns_online(connection, 'Books', 'bookID', {
+        'publicationDate': ('DATE', date_expression(DATE_PATTERN, 'DATE'))
+    }, options['batch_size'])
+    add_index(connection.cursor(), 'Books', 'idx_books_publication_date', 'publicationDate')
+
+
+def migrate_transactions_dates(connection, options):
+    convert_columns_online(connection, 'Transactions', 'transactionID', {
+        'borrowDate': ('DATETIME', date_expression(DATETIME_PATTERN, 'DATETIME')),
+        'returnDate': ('DATETIME', date_expression(DATETIME_PATTERN, 'DATETIME'))
+    }, options['batch_size'])
+
+
+def migrate_access_path_indexes(connection, options):
+    cur = connection.cursor()
+    # Loan history per user and per book is always read by date
+    add_index(cur, 'Transactions', 'idx_transactions_user_borrow', 'userID, borrowDate')
+    add_index(cur, 'Transactions', 'idx_transactions_book_borrow', 'bookID, borrowDate')
+    # The composite indexes lead with the same columns, so they also serve the foreign keys
+    drop_index(cur, 'Transactions', 'userID')
+    drop_index(cur, 'Transactions', 'bookID')
+    # add_new_book looks a title up for its bookID and bookCount; this covers that read
+    add_index(cur, 'Books', 'idx_books_title_count', 'title, bookCount')
+    drop_index(cur, 'Books', 'title')
+
+
+def migrate_inventory_slots(connection, options):
+    cur = connection.cursor()
+    create_inventory_tables(cur)
+    # Books that already have slots are skipped, so a re-run only seeds the rest. The slot
+    # count must be the configured one: request paths never touch slots at or above it.
+    seed_slots(cur, options['slots'])
+
+
+def migrate_loan_rollups(connection, options):
+    # The aggregator fills the new tables from the whole loan history on its first runs
+    create_rollup_tables(connection.cursor())
+
+
+def migrate_recommendation_tables(connection, options):
+    # Filled by 'flask rebuild-recommendations' and kept current by the updater
+    create_recommendation_tables(connection.cursor())
+
+
+def migrate_partition_transactions(connection, options):
+    cur = connection.cursor()
+    create_archive_table(cur)
+    if is_partitioned(cur) and not table_exists(cur, 'Transactions_old'):
+        return
+    # Monthly partitions from the oldest loan to three months ahead; rotation adds the rest
+    cur.execute("SELECT MIN(borrowDate) FROM Transactions WHERE borrowDate > %s", (UNKNOWN_BORROW_DATE,))
+    oldest = cur.fetchone()[0]
+    current = month_start(datetime.date.today())
+    first_month = month_start(oldest) if oldest else current
+    rebuild_table_online(
+        connection, 'Transactions',
+        partitioned_transactions_ddl('Transactions_new', first_month, add_months(current, 3)),
+        'transactionID', ('transactionID', 'userID', 'bookID', 'borrowDate', 'returnDate'),
+        # borrowDate is part of the primary key now, so it cannot stay NULL
+        {'borrowDate': f"COALESCE({{col}}, '{UNKNOWN_BORROW_DATE}')"}, options['batch_size'])
+
+
+MIGRATIONS = [
+    (1, 'report summary tables', migrate_summary_tables),
+    (2, 'full-text search indexes', migrate_search_indexes),
+    (3, 'Books.publicationDate as DATE', migrate_books_publication_date),
+    (4, 'Transactions dates as DATETIME', migrate_transactions_dates),
+    (5, 'composite access-path indexes', migrate_access_path_indexes),
+    (6, 'sharded inventory slots', migrate_inventory_slots),
+    (7, 'daily loan rollups', migrate_loan_rollups),
+    (8, 'co-borrow recommendation tables', migrate_recommendation_tables),
+    (9, 'Transactions partitioned by borrow month', migrate_partition_transactions)
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate(connection, target=None, batch_size=DEFAULT_BATCH_SIZE, lock_timeout=60, slots=DEFAULT_SLOTS):
+    """
+    Applies pending migrations up to target (default: all) and returns the versions applied.
+    slots is the configured number of inventory slots per book (inventory.slots).
+    """
+    options = {'batch_size': batch_size, 'slots': slots}
+    cur = connection.cursor()
+    cur.execute("SELECT GET_LOCK(%s, %s)", (LOCK_NAME, lock_timeout))
+    if cur.fetchone()[0] != 1:
+        raise MigrationError("Another process is migrating the schema.")
+    try:
+        applied = []
+        version = current_version(cur)
+        connection.commit()
+        for number, name, step in MIGRATIONS:
+            if number <= version or (target is not None and number > target):
+                continue
+            logger.info("Applying migration %s: %s", number, name)
+            step(connection, options)
+            cur.execute("INSERT INTO Schema_Version (version, name, appliedAt) VALUES (%s, %s, NOW())",
+                        (number, name))
+            connection.commit()
+            applied.append(number)
+        return applied
+    finally:
+        cur.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+        cur.fetchone()
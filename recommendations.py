@@ -0,0 +1,326 @@
+"""
+"Borrowed together" recommendations from precomputed item-item similarity.
+
+User_Books is the sparse user x book borrowing matrix: one row per book a user has
+borrowed at least once. Book_Borrowers holds each book's number of distinct borrowers and
+Book_CoBorrows the number of users who borrowed both books of a pair. The similarity of
+two books is their cosine over the matrix columns,
+
+    users(a, b) / sqrt(borrowers(a) * borrowers(b))
+
+and Book_Neighbours keeps each book's top-K most similar books. A user's recommendations
+are the neighbours of their recently borrowed books, scored by summed similarity, so a
+request reads a few dozen index rows and never touches Transactions.
+
+rebuild() recomputes everything in one pass, with sparse matrix products when NumPy and
+SciPy are installed and in pure Python otherwise. RecommendationUpdater keeps the tables
+current between rebuilds: it follows Transactions from its own watermark (see rollups.py),
+adds only the new (user, book) pairs to the counts and re-ranks the neighbours of the
+books those pairs touch. Books whose lists merely contain a touched book keep a slightly
+stale score for it until they are re-ranked themselves or the next rebuild.
+"""
+import heapq
+import logging
+import math
+import threading
+from collections import Counter
+
+from rollups import advance_watermark, claim_batch
+
+try:
+    import numpy
+    import scipy.sparse
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger('library.recommendations')
+
+WATERMARK = 'recommendations'
+DEFAULT_NEIGHBOURS = 20
+
+# Most recent borrowed books a user's recommendations are drawn from
+RECENT_HISTORY = 50
+
+# Rows per multi-row write and books per neighbour refresh
+WRITE_CHUNK = 1000
+REFRESH_CHUNK = 200
+
+
+def create_recommendation_tables(cur):
+    cur.execute('''CREATE TABLE IF NOT EXISTS User_Books (
+                    userID INTEGER,
+                    bookID INTEGER,
+                    lastBorrowed DATETIME,
+                    PRIMARY KEY (userID, bookID),
+                    INDEX (userID, lastBorrowed))''')
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS Book_Borrowers (
+                    bookID INTEGER PRIMARY KEY,
+                    borrowers INTEGER NOT NULL DEFAULT 0)''')
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS Book_CoBorrows (
+                    bookID INTEGER,
+                    otherBookID INTEGER,
+                    users INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (bookID, otherBookID))''')
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS Book_Neighbours (
+                    bookID INTEGER,
+                    neighbourID INTEGER,
+                    score DOUBLE NOT NULL,
+                    PRIMARY KEY (bookID, neighbourID),
+                    INDEX (bookID, score))''')
+
+    cur.execute("INSERT IGNORE INTO Rollup_Watermark (name, lastTransactionID) VALUES (%s, 0)", (WATERMARK,))
+
+
+def _write(cur, sql, rows):
+    for i in range(0, len(rows), WRITE_CHUNK):
+        cur.executemany(sql, rows[i:i + WRITE_CHUNK])
+
+
+def _new_pairs(cur, mark, upper):
+    # Distinct (user, book) pairs borrowed in the batch, with the latest borrow of each
+    cur.execute('''SELECT userID, bookID, MAX(borrowDate) FROM Transactions
+                   WHERE transactionID > %s AND transactionID <= %s
+                     AND userID IS NOT NULL AND bookID IS NOT NULL
+                   GROUP BY userID, bookID''', (mark, upper))
+    return cur.fetchall()
+
+
+def _record_pairs(cur, pairs):
+    _write(cur, '''INSERT INTO User_Books (userID, bookID, lastBorrowed) VALUES (%s, %s, %s)
+                   ON DUPLICATE KEY UPDATE
+                       lastBorrowed = GREATEST(COALESCE(lastBorrowed, VALUES(lastBorrowed)),
+                                               COALESCE(VALUES(lastBorrowed), lastBorrowed))''',
+           sorted(pairs))
+
+
+def refresh_neighbours(cur, book_ids, neighbours=DEFAULT_NEIGHBOURS):
+    """Re-ranks the top neighbours of the given books from Book_CoBorrows and Book_Borrowers."""
+    book_ids = sorted(book_ids)
+    for i in range(0, len(book_ids), REFRESH_CHUNK):
+        chunk = tuple(book_ids[i:i + REFRESH_CHUNK])
+        placeholders = ', '.join(['%s'] * len(chunk))
+        cur.execute(f"DELETE FROM Book_Neighbours WHERE bookID IN ({placeholders})", chunk)
+        cur.execute(f'''INSERT INTO Book_Neighbours (bookID, neighbourID, score)
+                        SELECT bookID, neighbourID, score FROM (
+                            SELECT c.bookID, c.otherBookID AS neighbourID,
+                                   c.users / SQRT(a.borrowers * b.borrowers) AS score,
+                                   ROW_NUMBER() OVER (PARTITION BY c.bookID
+                                                      ORDER BY c.users / SQRT(a.borrowers * b.borrowers) DESC,
+                                                               c.otherBookID) AS position
+                            FROM Book_CoBorrows c
+                            JOIN Book_Borrowers a ON a.bookID = c.bookID
+                            JOIN Book_Borrowers b ON b.bookID = c.otherBookID
+                            WHERE c.bookID IN ({placeholders})) ranked
+                        WHERE position <= %s''', chunk + (neighbours,))
+
+
+def update(connection, batch_size=50000, settle_seconds=60, neighbours=DEFAULT_NEIGHBOURS):
+    """
+    Adds the next batch of settled transactions to the matrix, the counts and the affected
+    neighbour lists. Returns how many transaction IDs the watermark advanced by.
+    """
+    cur = connection.cursor()
+    try:
+        mark, upper = claim_batch(cur, WATERMARK, batch_size, settle_seconds)
+        if upper == mark:
+            connection.rollback()
+            return 0
+
+        pairs = _new_pairs(cur, mark, upper)
+        batch = {}
+        for user_id, book_id, _ in pairs:
+            batch.setdefault(user_id, set()).add(book_id)
+
+        history = {}
+        users = sorted(batch)
+        for i in range(0, len(users), WRITE_CHUNK):
+            chunk = tuple(users[i:i + WRITE_CHUNK])
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cur.execute(f"SELECT userID, bookID FROM User_Books WHERE userID IN ({placeholders})", chunk)
+            for user_id, book_id in cur.fetchall():
+                history.setdefault(user_id, set()).add(book_id)
+
+        # Only a user's first borrow of a book changes the counts
+        borrowers = Counter()
+        co_borrows = Counter()
+        touched = set()
+        for user_id, books in batch.items():
+            known = history.get(user_id, set())
+            new = books - known
+            if not new:
+                continue
+            together = known | new
+            touched |= together
+            for book_id in new:
+                borrowers[book_id] += 1
+                for other_id in together:
+                    if other_id != book_id:
+                        co_borrows[(book_id, other_id)] += 1
+                        if other_id in known:
+                            co_borrows[(other_id, book_id)] += 1
+
+        _record_pairs(cur, pairs)
+        _write(cur, '''INSERT INTO Book_Borrowers (bookID, borrowers) VALUES (%s, %s)
+                       ON DUPLICATE KEY UPDATE borrowers = borrowers + VALUES(borrowers)''',
+               sorted(borrowers.items()))
+        _write(cur, '''INSERT INTO Book_CoBorrows (bookID, otherBookID, users) VALUES (%s, %s, %s)
+                       ON DUPLICATE KEY UPDATE users = users + VALUES(users)''',
+               [pair + (count,) for pair, count in sorted(co_borrows.items())])
+        refresh_neighbours(cur, touched, neighbours)
+        advance_watermark(cur, WATERMARK, upper)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return upper - mark
+
+
+def _similarities_numpy(pairs, neighbours):
+    users = {user_id: index for index, user_id in enumerate(sorted({user_id for user_id, _ in pairs}))}
+    book_ids = numpy.array(sorted({book_id for _, book_id in pairs}))
+    rows = numpy.fromiter((users[user_id] for user_id, _ in pairs), dtype=numpy.int64, count=len(pairs))
+    cols = numpy.searchsorted(book_ids, numpy.fromiter((book_id for _, book_id in pairs), dtype=numpy.int64,
+                                                       count=len(pairs)))
+    matrix = scipy.sparse.csr_matrix((numpy.ones(len(pairs), dtype=numpy.int32), (rows, cols)),
+                                     shape=(len(users), len(book_ids)))
+
+    # Book x book co-borrow counts; the diagonal is each book's borrower count
+    co = (matrix.T @ matrix).tocsr()
+    borrowers = co.diagonal()
+    co.setdiag(0)
+    co.eliminate_zeros()
+    co = co.tocoo()
+
+    scores = co.data / numpy.sqrt(borrowers[co.row].astype(numpy.float64) * borrowers[co.col])
+    # Sort by book, then score descending, and keep each book's first `neighbours` entries
+    order = numpy.lexsort((co.col, -scores, co.row))
+    ranked_rows = co.row[order]
+    starts = numpy.searchsorted(ranked_rows, numpy.arange(len(book_ids)))
+    keep = order[numpy.arange(len(order)) - starts[ranked_rows] < neighbours]
+
+    return (
+        list(zip(book_ids.tolist(), borrowers.tolist())),
+        list(zip(book_ids[co.row].tolist(), book_ids[co.col].tolist(), co.data.tolist())),
+        list(zip(book_ids[co.row[keep]].tolist(), book_ids[co.col[keep]].tolist(), scores[keep].tolist()))
+    )
+
+
+def _similarities_python(pairs, neighbours):
+    books_by_user = {}
+    for user_id, book_id in pairs:
+        books_by_user.setdefault(user_id, []).append(book_id)
+
+    borrowers = Counter(book_id for _, book_id in pairs)
+    co_borrows = Counter()
+    for books in books_by_user.values():
+        for book_id in books:
+            for other_id in books:
+                if other_id != book_id:
+                    co_borrows[(book_id, other_id)] += 1
+
+    candidates = {}
+    for (book_id, other_id), users in co_borrows.items():
+        score = users / math.sqrt(borrowers[book_id] * borrowers[other_id])
+        candidates.setdefault(book_id, []).append((score, -other_id))
+    top = [(book_id, -negated_id, score)
+           for book_id, scored in candidates.items()
+           for score, negated_id in heapq.nlargest(neighbours, scored)]
+
+    return (
+        sorted(borrowers.items()),
+        [pair + (count,) for pair, count in co_borrows.items()],
+        top
+    )
+
+
+def rebuild(connection, neighbours=DEFAULT_NEIGHBOURS, settle_seconds=60):
+    """
+    Folds every pending transaction into User_Books, then recomputes Book_Borrowers,
+    Book_CoBorrows and Book_Neighbours from the whole matrix in one transaction.
+    Returns the number of users, books and neighbour rows.
+    """
+    cur = connection.cursor()
+    try:
+        mark, upper = claim_batch(cur, WATERMARK, None, settle_seconds)
+        if upper > mark:
+            _record_pairs(cur, _new_pairs(cur, mark, upper))
+            advance_watermark(cur, WATERMARK, upper)
+
+        cur.execute("SELECT userID, bookID FROM User_Books")
+        pairs = cur.fetchall()
+        similarities = _similarities_numpy if numpy is not None else _similarities_python
+        borrowers, co_borrows, top = similarities(pairs, neighbours) if pairs else ([], [], [])
+
+        cur.execute("DELETE FROM Book_Neighbours")
+        cur.execute("DELETE FROM Book_CoBorrows")
+        cur.execute("DELETE FROM Book_Borrowers")
+        _write(cur, "INSERT INTO Book_Borrowers (bookID, borrowers) VALUES (%s, %s)", borrowers)
+        _write(cur, "INSERT INTO Book_CoBorrows (bookID, otherBookID, users) VALUES (%s, %s, %s)", co_borrows)
+        _write(cur, "INSERT INTO Book_Neighbours (bookID, neighbourID, score) VALUES (%s, %s, %s)", top)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return {"users": len({user_id for user_id, _ in pairs}), "books": len(borrowers), "neighbours": len(top)}
+
+
+def recommend(cur, user_id, limit=10):
+    """Returns (bookID, title, score) for the unborrowed books most similar to a user's recent borrows."""
+    cur.execute('''SELECT n.neighbourID, b.title, SUM(n.score) AS score
+                   FROM (SELECT bookID FROM User_Books WHERE userID=%s
+                         ORDER BY lastBorrowed DESC LIMIT %s) recent
+                   JOIN Book_Neighbours n ON n.bookID = recent.bookID
+                   JOIN Books b ON b.bookID = n.neighbourID
+                   WHERE NOT EXISTS (SELECT 1 FROM User_Books ub
+                                     WHERE ub.userID=%s AND ub.bookID = n.neighbourID)
+                   GROUP BY n.neighbourID, b.title
+                   ORDER BY score DESC, n.neighbourID
+                   LIMIT %s''', (user_id, RECENT_HISTORY, user_id, limit))
+    return [(book_id, title, round(float(score), 6)) for book_id, title, score in cur.fetchall()]
+
+
+class RecommendationUpdater:
+    """Background thread that applies new transactions to the recommendation tables every interval seconds."""
+
+    def __init__(self, connection_factory, interval=60, batch_size=50000, settle_seconds=60,
+                 neighbours=DEFAULT_NEIGHBOURS):
+        self.connection_factory = connection_factory
+        self.interval = interval
+        self.batch_size = batch_size
+        self.settle_seconds = settle_seconds
+        self.neighbours = neighbours
+        self.updated = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='recommendations', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.warning("Updating recommendations failed: %s", e)
+
+    def run_once(self):
+        advanced = 0
+        while not self._stop.is_set():
+            connection = self.connection_factory()
+            try:
+                count = update(connection, self.batch_size, self.settle_seconds, self.neighbours)
+            finally:
+                connection.close()
+            advanced += count
+            if count < self.batch_size:
+                break
+        self.updated += advanced
+        return advanced
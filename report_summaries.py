@@ -0,0 +1,115 @@
+"""
+Summary tables behind /reports/advanced.
+
+Loan_Summary holds the number of loans per (user, book) and Cart_Summary the number of
+carts currently holding each book. Both are kept up to date inside the same transactions
+that change Transactions and Cart_Items, so the report never has to scan the loan history.
+"""
+from collections import Counter
+
+import statements
+
+
+def create_summary_tables(cur):
+    cur.execute('''CREATE TABLE IF NOT EXISTS Loan_Summary (
+                    userID INTEGER,
+                    bookID INTEGER,
+                    loanCount INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (userID, bookID),
+                    FOREIGN KEY (userID) REFERENCES Users(userID),
+                    FOREIGN KEY (bookID) REFERENCES Books(bookID),
+                    INDEX (loanCount),
+                    INDEX (bookID))''')
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS Cart_Summary (
+                    bookID INTEGER PRIMARY KEY,
+                    cartCount INTEGER NOT NULL DEFAULT 0,
+                    FOREIGN KEY (bookID) REFERENCES Books(bookID))''')
+
+
+def record_cart_add(connection, book_id):
+    statements.execute(connection, statements.CART_SUMMARY_ADD, (book_id,))
+
+
+def record_cart_remove(connection, book_id):
+    statements.execute(connection, statements.CART_SUMMARY_REMOVE, (book_id,))
+
+
+def record_cart_adds(cur, book_ids):
+    # Same as record_cart_add for many books, sent as one multi-row statement
+    if book_ids:
+        cur.executemany('''INSERT INTO Cart_Summary (bookID, cartCount) VALUES (%s, 1)
+                           ON DUPLICATE KEY UPDATE cartCount = cartCount + 1''', [(book_id,) for book_id in book_ids])
+
+
+def record_cart_removes(cur, book_ids):
+    # A book can appear more than once when it is removed from several carts, so subtract per-book counts
+    counts = Counter(book_ids)
+    if counts:
+        derived = ' UNION ALL '.join(['SELECT %s AS bookID, %s AS removed'] * len(counts))
+        cur.execute(f'''UPDATE Cart_Summary cs
+                        JOIN ({derived}) r ON cs.bookID = r.bookID
+                        SET cs.cartCount = GREATEST(cs.cartCount - r.removed, 0)''',
+                    tuple(value for item in sorted(counts.items()) for value in item))
+
+
+def forget_book(cur, book_id):
+    # An empty Cart_Summary row would otherwise block deleting the book through its foreign key
+    cur.execute("DELETE FROM Cart_Summary WHERE bookID=%s AND cartCount = 0", (book_id,))
+
+
+def record_checkout(cur, user_id, cart_id):
+    # Must run before the cart's Cart_Items rows are deleted
+    cur.execute(statements.CHECKOUT_LOAN_SUMMARY.sql, (user_id, cart_id))
+    cur.execute(statements.CHECKOUT_CART_SUMMARY.sql, (cart_id,))
+
+
+def record_loans(cur, loans):
+    # Same as record_checkout for (userID, bookID) pairs already logged elsewhere, as one multi-row statement
+    counts = Counter(loans)
+    if counts:
+        cur.executemany('''INSERT INTO Loan_Summary (userID, bookID, loanCount) VALUES (%s, %s, %s)
+                           ON DUPLICATE KEY UPDATE loanCount = loanCount + VALUES(loanCount)''',
+                        [pair + (count,) for pair, count in sorted(counts.items())])
+
+
+def rebuild_summaries(connection):
+    """Recomputes both summary tables from Transactions and Cart_Items in one transaction."""
+    cur = connection.cursor()
+    try:
+        cur.execute("DELETE FROM Loan_Summary")
+        cur.execute('''INSERT INTO Loan_Summary (userID, bookID, loanCount)
+                       SELECT userID, bookID, COUNT(*) FROM Transactions
+                       WHERE userID IS NOT NULL AND bookID IS NOT NULL
+                       GROUP BY userID, bookID''')
+        loan_rows = cur.rowcount
+
+        cur.execute("DELETE FROM Cart_Summary")
+        cur.execute('''INSERT INTO Cart_Summary (bookID, cartCount)
+                       SELECT bookID, COUNT(*) FROM Cart_Items
+                       WHERE bookID IS NOT NULL
+                       GROUP BY bookID''')
+        cart_rows = cur.rowcount
+
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return {"loan_summary_rows": loan_rows, "cart_summary_rows": cart_rows}
+
+
+def fetch_top_loans(cur, limit=10):
+    # Rows are per (userID, bookID): unlike the report's original GROUP BY Users.name, accounts sharing
+    # a name are not added up (see README.md)
+    # Find the loan count of the limit-th pair through the loanCount index, then only join pairs at or above it
+    cur.execute(statements.TOP_LOANS_THRESHOLD.sql, (limit - 1,))
+    threshold = cur.fetchone()
+    threshold = threshold[0] if threshold else 0
+
+    cur.execute(statements.TOP_LOANS.sql, (threshold, limit))
+    rows = cur.fetchall()
+    if len(rows) < limit and threshold > 1:
+        # Some pairs above the threshold were dropped by the joins; fall back to every pair
+        cur.execute(statements.TOP_LOANS.sql, (1, limit))
+        rows = cur.fetchall()
+    return rows
@@ -0,0 +1,272 @@
+"""
+Daily and monthly loan rollups behind the time-windowed reports.
+
+Loan_Rollups holds the number of loans per day and per month for each book, publisher,
+genre and user, plus a 'total' dimension with key 0. The aggregator folds Transactions
+into it incrementally: Rollup_Watermark records the last transactionID already counted,
+and each run reads the next batch of IDs after it, groups them in one pass and upserts
+the counts in the same transaction that advances the watermark.
+
+A date range is answered from whole months where it covers them and from days at its
+edges, so a year-long window reads about as many rollup rows as a one-month one, and no
+report reads Transactions.
+
+Transactions younger than settle_seconds are left for the next run. IDs are assigned
+when a row is inserted but become visible when its transaction commits, so a lower ID
+can appear after a higher one has been counted; the settle delay must be longer than
+the longest transaction that inserts loans, or such a loan is skipped.
+"""
+import datetime
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger('library.rollups')
+
+WATERMARK = 'loans'
+DAY = 'day'
+MONTH = 'month'
+DIMENSIONS = ('total', 'book', 'publisher', 'genre', 'user')
+
+# Table, key column and display column each dimension's keyID refers to
+NAMES = {
+    'book': ('Books', 'bookID', 'title'),
+    'publisher': ('Publishers', 'publisherID', 'publisherName'),
+    'genre': ('Genres', 'genreID', 'genreName'),
+    'user': ('Users', 'userID', 'name')
+}
+
+# Rows per multi-row upsert and book IDs per Book_Genres lookup
+WRITE_CHUNK = 1000
+
+
+def create_rollup_tables(cur):
+    # No foreign keys: rollups are derived data and must not stand in the way of deletes
+    cur.execute('''CREATE TABLE IF NOT EXISTS Loan_Rollups (
+                    dimension VARCHAR(16),
+                    grain VARCHAR(8),
+                    periodStart DATE,
+                    keyID INTEGER,
+                    loans INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (dimension, grain, periodStart, keyID),
+                    INDEX (dimension, keyID, grain, periodStart))''')
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS Rollup_Watermark (
+                    name VARCHAR(64) PRIMARY KEY,
+                    lastTransactionID INTEGER NOT NULL DEFAULT 0,
+                    updatedAt DATETIME)''')
+    cur.execute("INSERT IGNORE INTO Rollup_Watermark (name, lastTransactionID) VALUES (%s, 0)", (WATERMARK,))
+
+
+def _book_genres(cur, book_ids):
+    genres = {}
+    book_ids = sorted(book_ids)
+    for i in range(0, len(book_ids), WRITE_CHUNK):
+        chunk = book_ids[i:i + WRITE_CHUNK]
+        placeholders = ', '.join(['%s'] * len(chunk))
+        cur.execute(f"SELECT bookID, genreID FROM Book_Genres WHERE bookID IN ({placeholders})", tuple(chunk))
+        for book_id, genre_id in cur.fetchall():
+            genres.setdefault(book_id, []).append(genre_id)
+    return genres
+
+
+def claim_batch(cur, name, batch_size=None, settle_seconds=60):
+    """
+    Locks the named watermark and returns (mark, upper): the settled transaction IDs after
+    it run up to upper, at most batch_size of them. upper == mark means nothing is pending.
+    The row lock keeps consumers in other processes from reading the same batch.
+    """
+    cur.execute("SELECT lastTransactionID FROM Rollup_Watermark WHERE name=%s FOR UPDATE", (name,))
+    mark = cur.fetchone()[0]
+
+    cur.execute("SELECT MAX(transactionID) FROM Transactions")
+    upper = cur.fetchone()[0] or 0
+    if batch_size is not None:
+        upper = min(upper, mark + batch_size)
+    cur.execute('''SELECT MIN(transactionID) FROM Transactions
+                   WHERE transactionID > %s AND borrowDate > NOW() - INTERVAL %s SECOND''',
+                (mark, settle_seconds))
+    unsettled = cur.fetchone()[0]
+    if unsettled is not None:
+        upper = min(upper, unsettled - 1)
+    return mark, max(upper, mark)
+
+
+def advance_watermark(cur, name, upper):
+    cur.execute("UPDATE Rollup_Watermark SET lastTransactionID=%s, updatedAt=NOW() WHERE name=%s", (upper, name))
+
+
+def aggregate(connection, batch_size=50000, settle_seconds=60):
+    """
+    Folds the next batch of settled transactions into Loan_Rollups. Returns how many
+    transaction IDs the watermark advanced by; less than batch_size means it caught up.
+    """
+    cur = connection.cursor()
+    try:
+        mark, upper = claim_batch(cur, WATERMARK, batch_size, settle_seconds)
+        if upper == mark:
+            connection.rollback()
+            return 0
+
+        cur.execute('''SELECT DATE(t.borrowDate), t.bookID, t.userID, b.publisherID, COUNT(*)
+                       FROM Transactions t
+                       LEFT JOIN Books b ON b.bookID = t.bookID
+                       WHERE t.transactionID > %s AND t.transactionID <= %s AND t.borrowDate IS NOT NULL
+                       GROUP BY DATE(t.borrowDate), t.bookID, t.userID, b.publisherID''', (mark, upper))
+        groups = cur.fetchall()
+        genres = _book_genres(cur, {book_id for _, book_id, _, _, _ in groups if book_id is not None})
+
+        counts = Counter()
+        for day, book_id, user_id, publisher_id, loans in groups:
+            keys = [('total', 0), ('book', book_id), ('publisher', publisher_id), ('user', user_id)]
+            keys.extend(('genre', genre_id) for genre_id in genres.get(book_id, ()))
+            for dimension, key in keys:
+                if key is not None:
+                    counts[(dimension, DAY, day, key)] += loans
+                    counts[(dimension, MONTH, day.replace(day=1), key)] += loans
+
+        rows = [key + (loans,) for key, loans in sorted(counts.items())]
+        for i in range(0, len(rows), WRITE_CHUNK):
+            cur.executemany('''INSERT INTO Loan_Rollups (dimension, grain, periodStart, keyID, loans)
+                               VALUES (%s, %s, %s, %s, %s)
+                               ON DUPLICATE KEY UPDATE loans = loans + VALUES(loans)''', rows[i:i + WRITE_CHUNK])
+        advance_watermark(cur, WATERMARK, upper)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return upper - mark
+
+
+def rebuild_rollups(connection):
+    """Empties Loan_Rollups and rewinds the watermark, so the aggregator recounts every transaction."""
+    cur = connection.cursor()
+    try:
+        cur.execute("SELECT lastTransactionID FROM Rollup_Watermark WHERE name=%s FOR UPDATE", (WATERMARK,))
+        cur.fetchall()
+        cur.execute("DELETE FROM Loan_Rollups")
+        advance_watermark(cur, WATERMARK, 0)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+
+def fetch_watermark(cur, name=WATERMARK):
+    cur.execute("SELECT lastTransactionID, updatedAt FROM Rollup_Watermark WHERE name=%s", (name,))
+    row = cur.fetchone()
+    return {"last_transaction_id": row[0], "updated_at": row[1]} if row else None
+
+
+def split_range(start, end):
+    """Splits the inclusive range start..end into (grain, first, last) pieces: whole months and leftover days."""
+    first_month = start if start.day == 1 else (start.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+    # First day of the month after the last month that lies entirely within the range
+    past_months = (end + datetime.timedelta(days=1)).replace(day=1)
+    if first_month >= past_months:
+        return [(DAY, start, end)]
+
+    pieces = []
+    if start < first_month:
+        pieces.append((DAY, start, first_month - datetime.timedelta(days=1)))
+    pieces.append((MONTH, first_month, past_months - datetime.timedelta(days=1)))
+    if past_months <= end:
+        pieces.append((DAY, past_months, end))
+    return pieces
+
+
+def _range_condition(start, end):
+    conditions = []
+    params = []
+    for grain, first, last in split_range(start, end):
+        conditions.append("(grain=%s AND periodStart BETWEEN %s AND %s)")
+        params.extend((grain, first, last))
+    return ' OR '.join(conditions), params
+
+
+def fetch_total(cur, start, end):
+    condition, params = _range_condition(start, end)
+    cur.execute(f"SELECT COALESCE(SUM(loans), 0) FROM Loan_Rollups WHERE dimension='total' AND ({condition})",
+                tuple(params))
+    return int(cur.fetchone()[0])
+
+
+def fetch_top(cur, dimension, start, end, limit=10):
+    """Returns (keyID, name, loans) for the limit keys of a dimension with the most loans between start and end."""
+    table, key_column, name_column = NAMES[dimension]
+    condition, params = _range_condition(start, end)
+    cur.execute(f'''SELECT r.keyID, n.{name_column}, r.total
+                    FROM (SELECT keyID, SUM(loans) AS total FROM Loan_Rollups
+                          WHERE dimension=%s AND ({condition})
+                          GROUP BY keyID
+                          ORDER BY total DESC, keyID
+                          LIMIT %s) r
+                    LEFT JOIN {table} n ON n.{key_column} = r.keyID
+                    ORDER BY r.total DESC, r.keyID''', (dimension, *params, limit))
+    return [(key_id, name, int(loans)) for key_id, name, loans in cur.fetchall()]
+
+
+def fetch_trend(cur, start, end, grain=DAY, dimension='total', key_id=0):
+    """
+    Returns (periodStart, loans) for every day, or every month overlapping the range,
+    from start to end, with zeros for periods without loans.
+    """
+    if grain == MONTH:
+        start = start.replace(day=1)
+    cur.execute('''SELECT periodStart, loans FROM Loan_Rollups
+                   WHERE dimension=%s AND keyID=%s AND grain=%s AND periodStart BETWEEN %s AND %s''',
+                (dimension, key_id, grain, start, end))
+    loans = dict(cur.fetchall())
+
+    trend = []
+    period = start
+    while period <= end:
+        trend.append((period, int(loans.get(period, 0))))
+        if grain == MONTH:
+            period = (period.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+        else:
+            period += datetime.timedelta(days=1)
+    return trend
+
+
+class RollupAggregator:
+    """Background thread that folds new transactions into the rollups every interval seconds."""
+
+    def __init__(self, connection_factory, interval=60, batch_size=50000, settle_seconds=60):
+        self.connection_factory = connection_factory
+        self.interval = interval
+        self.batch_size = batch_size
+        self.settle_seconds = settle_seconds
+        self.aggregated = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='loan-rollups', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.warning("Aggregating loan rollups failed: %s", e)
+
+    def run_once(self):
+        """Aggregates batches until the watermark catches up. Returns how far it advanced."""
+        advanced = 0
+        while not self._stop.is_set():
+            connection = self.connection_factory()
+            try:
+                count = aggregate(connection, self.batch_size, self.settle_seconds)
+            finally:
+                connection.close()
+            advanced += count
+            if count < self.batch_size:
+                break
+        self.aggregated += advanced
+        return advanced
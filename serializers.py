@@ -0,0 +1,122 @@
+"""
+Response formats for row-shaped results.
+
+Queries hand over a Table: the column names, taken from the cursor description once per
+query, and the rows as tuples. The format is picked from the Accept header:
+
+  application/json                       one object per row (the default)
+  application/vnd.library.columnar+json  {"columns": [...], "rows": [[...], ...]}
+  application/msgpack                    the columnar shape as MessagePack (needs msgpack)
+  application/vnd.apache.arrow.stream    an Arrow IPC stream (needs pyarrow)
+
+JSON is encoded with orjson when it is installed, and with the standard library otherwise.
+"""
+import datetime
+import decimal
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+JSON = 'application/json'
+COLUMNAR_JSON = 'application/vnd.library.columnar+json'
+MSGPACK = 'application/msgpack'
+ARROW = 'application/vnd.apache.arrow.stream'
+
+
+class Table:
+    __slots__ = ('columns', 'rows')
+
+    def __init__(self, columns, rows):
+        self.columns = list(columns)
+        self.rows = rows
+
+    @classmethod
+    def from_cursor(cls, cur):
+        rows = cur.fetchall()
+        return cls([column[0] for column in cur.description], rows)
+
+    def column(self, name):
+        index = self.columns.index(name)
+        return [row[index] for row in self.rows]
+
+    def records(self):
+        columns = self.columns
+        return [dict(zip(columns, row)) for row in self.rows]
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def _default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8', 'replace')
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps_json(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+def available_formats():
+    formats = [JSON, COLUMNAR_JSON]
+    if msgpack is not None:
+        formats.append(MSGPACK)
+    if pyarrow is not None:
+        formats.append(ARROW)
+    return formats
+
+
+def negotiate_format(accept_mimetypes):
+    # accept_mimetypes is werkzeug's parsed Accept header; */* and a missing header mean JSON
+    return accept_mimetypes.best_match(available_formats(), default=JSON) or JSON
+
+
+def _to_arrow(table, extra):
+    arrays = {name: [row[index] for row in table.rows] for index, name in enumerate(table.columns)}
+    metadata = {key: json.dumps(value, default=_default) for key, value in (extra or {}).items()}
+    arrow_table = pyarrow.table(arrays, metadata=metadata or None)
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, arrow_table.schema) as writer:
+        writer.write_table(arrow_table)
+    return sink.getvalue().to_pybytes()
+
+
+def render(table, fmt, json_body=None, extra=None):
+    """
+    Encodes a Table in the given format and returns the body bytes. json_body, if given,
+    builds the default JSON document (for routes whose JSON shape predates this layer);
+    extra holds fields sent next to the rows, such as paging cursors.
+    """
+    if fmt == JSON:
+        body = json_body() if json_body else table.records()
+        return dumps_json(body)
+
+    columnar = {"columns": table.columns, "rows": table.rows}
+    if extra:
+        columnar.update(extra)
+    if fmt == COLUMNAR_JSON:
+        return dumps_json(columnar)
+    if fmt == MSGPACK:
+        return msgpack.packb(columnar, default=_default, use_bin_type=True)
+    if fmt == ARROW:
+        return _to_arrow(table, extra)
+    raise ValueError(f"Unsupported format {fmt}")
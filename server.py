@@ -0,0 +1,383 @@
+"""
+Pre-forking production server.
+
+The master process binds the listening socket and forks one worker per CPU. Each worker
+loads its own copy of the application (wsgi.load_app_module), so it has its own
+connection pools, caches and event writer; warms it up; and serves requests on a fixed
+pool of threads that should not outnumber its database connections (pool.size). Workers
+share the socket, and a worker with no free thread leaves new connections to the others.
+Only the first worker runs the background jobs (see worker_config).
+
+Workers share nothing but the database, so more than one needs the catalog cache's
+versions in Redis (cache backend 'redis') and carts in the database (cart mode 'db');
+otherwise one worker would keep serving what another has just changed or hold carts the
+others cannot see. The master refuses to start more than one worker without both.
+
+Signals to the master:
+  HUP        reload: start a new set of workers with the current code and config, and once
+             they are warmed up, drain and stop the old ones. If the new workers fail to
+             come up, the old ones keep serving.
+  TERM, INT  drain: stop accepting, finish in-flight requests for up to graceful_timeout
+             seconds, write out queued events, then exit.
+  QUIT       stop immediately.
+
+A crashed worker is replaced. Connections are closed after each response, so put a proxy
+that keeps client connections alive (nginx, a load balancer) in front.
+
+Settings come from the 'server' section of the config file and LIBRARY_SERVER_* variables
+(see settings.py), with command-line options taking precedence:
+
+    python server.py --bind 0.0.0.0:5040 --workers 8 --threads 10 --config library.toml
+    kill -HUP $(cat library.pid)
+"""
+import argparse
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from settings import CONFIG_ENV, Settings
+
+logger = logging.getLogger('library.server')
+
+server_defaults = {
+    'bind': '127.0.0.1:5040',
+    # None: one per CPU this process may run on
+    'workers': None,
+    'threads': 10,
+    'backlog': 1024,
+    'graceful_timeout': 30.0,
+    'ready_timeout': 60.0,
+    'access_log': False,
+    'pid_file': None
+}
+
+BACKGROUND_JOBS_ENV = 'LIBRARY_WORKER_BACKGROUND_JOBS'
+
+
+def default_workers():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class RequestHandler(WSGIRequestHandler):
+    # One request per connection, so an idle keep-alive client never holds a worker thread
+    protocol_version = 'HTTP/1.0'
+    access_log = False
+
+    def log_request(self, code='-', size='-'):
+        if self.access_log:
+            super().log_request(code, size)
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Serves connections on a fixed number of threads, accepting a connection only when one is free."""
+
+    multithread = True
+
+    def __init__(self, host, port, app, fd, threads):
+        super().__init__(host, port, app, RequestHandler, fd=fd)
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix='request')
+        self._free = threading.Semaphore(threads)
+
+    def get_request(self):
+        self._free.acquire()
+        try:
+            return super().get_request()
+        except BaseException:
+            # Another worker took the connection first
+            self._free.release()
+            raise
+
+    def process_request(self, request, client_address):
+        try:
+            self._executor.submit(self._handle, request, client_address)
+        except BaseException:
+            self._free.release()
+            raise
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._free.release()
+
+    def wait_for_requests(self):
+        self._executor.shutdown(wait=True)
+
+
+def shared_state_problems(settings):
+    """What keeps the application's state from being shared between worker processes."""
+    problems = []
+    if settings.value('cache', 'backend', 'local') != 'redis':
+        problems.append("cache.backend must be 'redis' so every worker sees the others' catalog writes")
+    if settings.value('cart', 'mode', 'db') != 'db':
+        problems.append("cart.mode must be 'db' so every worker sees the same carts")
+    return problems
+
+
+def parse_bind(bind):
+    host, _, port = bind.rpartition(':')
+    return host.strip('[]') or '0.0.0.0', int(port)
+
+
+def run_worker(listener, host, port, threads, ready_fd, background_jobs):
+    """Body of a forked worker; returns its exit status."""
+    # Ctrl-C reaches the whole process group; the master decides what happens to workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGQUIT, signal.SIG_DFL)
+    # Until it serves, a worker has nothing to drain
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    parent = os.getppid()
+    if not background_jobs:
+        os.environ[BACKGROUND_JOBS_ENV] = '0'
+
+    import wsgi
+    module = wsgi.load_app_module()
+    if threads > module.pool_config['size']:
+        logger.warning("%s threads share %s pool connections; the rest wait for one",
+                       threads, module.pool_config['size'])
+    server = PooledWSGIServer(host, port, module.app, listener.fileno(), threads)
+    listener.close()
+    module.warm_up()
+
+    def drain(*_):
+        # shutdown() waits for serve_forever to return, so it cannot run on the main thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    def watch_master():
+        while os.getppid() == parent:
+            time.sleep(1)
+        logger.warning("Master %s went away; worker %s is draining", parent, os.getpid())
+        server.shutdown()
+
+    signal.signal(signal.SIGTERM, drain)
+    threading.Thread(target=watch_master, daemon=True).start()
+    try:
+        os.write(ready_fd, b'.')
+    except BrokenPipeError:
+        # A replacement worker: the master does not wait for it
+        pass
+    os.close(ready_fd)
+
+    # Returns after a drain request, with the listening socket closed
+    server.serve_forever()
+    server.wait_for_requests()
+    module.shutdown()
+    return 0
+
+
+class Master:
+    def __init__(self, bind, workers, threads, backlog=1024, graceful_timeout=30, ready_timeout=60,
+                 pid_file=None):
+        self.host, self.port = parse_bind(bind)
+        self.workers = workers
+        self.threads = threads
+        self.backlog = backlog
+        self.graceful_timeout = graceful_timeout
+        self.ready_timeout = ready_timeout
+        self.pid_file = pid_file
+
+        self.listener = None
+        # pid -> (generation, slot)
+        self.children = {}
+        self.generation = 0
+        self.signals = []
+
+    def bind(self):
+        family = socket.AF_INET6 if ':' in self.host else socket.AF_INET
+        self.listener = socket.socket(family, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((self.host, self.port))
+        self.listener.listen(self.backlog)
+        # Every worker is woken for each connection; the ones that lose the accept must not block
+        self.listener.setblocking(False)
+        self.port = self.listener.getsockname()[1]
+
+    def spawn(self, slot):
+        """Forks a worker for slot of the current generation. Returns (pid, read end of its ready pipe)."""
+        ready_read, ready_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                os.close(ready_read)
+                status = run_worker(self.listener, self.host, self.port, self.threads, ready_write, slot == 0)
+            except BaseException:
+                logger.exception("Worker %s failed", os.getpid())
+            finally:
+                # Never return into the master's code
+                os._exit(status)
+        os.close(ready_write)
+        self.children[pid] = (self.generation, slot)
+        return pid, ready_read
+
+    def wait_ready(self, pipes):
+        """Waits for the workers behind pipes (pid -> fd) to warm up. Returns True if all of them did."""
+        deadline = time.monotonic() + self.ready_timeout
+        pending = dict(pipes)
+        try:
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                readable, _, _ = select.select(list(pending.values()), [], [], remaining)
+                for pid, fd in list(pending.items()):
+                    if fd in readable:
+                        if not os.read(fd, 1):
+                            # Closed without a byte: the worker died while starting
+                            return False
+                        os.close(fd)
+                        del pending[pid]
+            return True
+        finally:
+            for fd in pending.values():
+                os.close(fd)
+
+    def start_generation(self):
+        self.generation += 1
+        pipes = dict(self.spawn(slot) for slot in range(self.workers))
+        return self.wait_ready(pipes)
+
+    def signal_children(self, signum, generation=None):
+        for pid, (child_generation, _) in list(self.children.items()):
+            if generation is None or child_generation == generation:
+                try:
+                    os.kill(pid, signum)
+                except ProcessLookupError:
+                    pass
+
+    def reap(self):
+        """Collects exited workers and returns the (generation, slot) each of them held."""
+        exited = []
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            generation, slot = self.children.pop(pid, (None, None))
+            code = os.waitstatus_to_exitcode(status)
+            if code:
+                logger.warning("Worker %s exited with status %s", pid, code)
+            exited.append((generation, slot))
+        return exited
+
+    def reload(self):
+        old = self.generation
+        logger.info("Reloading: starting generation %s", old + 1)
+        if self.start_generation():
+            logger.info("Generation %s is ready; draining generation %s", self.generation, old)
+            self.signal_children(signal.SIGTERM, old)
+        else:
+            logger.error("Generation %s did not come up; generation %s keeps serving", self.generation, old)
+            self.signal_children(signal.SIGKILL, self.generation)
+            self.generation = old
+
+    def stop(self, graceful=True):
+        logger.info("Stopping %s workers%s", len(self.children), " after draining" if graceful else "")
+        self.signal_children(signal.SIGTERM if graceful else signal.SIGQUIT)
+        deadline = time.monotonic() + (self.graceful_timeout if graceful else 5)
+        while self.children and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        if self.children:
+            logger.warning("Killing %s workers that did not finish in time", len(self.children))
+            self.signal_children(signal.SIGKILL)
+            while self.children:
+                try:
+                    pid, _ = os.waitpid(-1, 0)
+                except ChildProcessError:
+                    break
+                self.children.pop(pid, None)
+
+    def handle_signal(self, signum, frame):
+        self.signals.append(signum)
+
+    def run(self):
+        self.bind()
+        if self.pid_file:
+            with open(self.pid_file, 'w') as f:
+                f.write(f"{os.getpid()}\n")
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGQUIT):
+            signal.signal(signum, self.handle_signal)
+
+        logger.info("Listening on %s:%s with %s workers of %s threads", self.host, self.port, self.workers,
+                    self.threads)
+        try:
+            if not self.start_generation():
+                logger.error("Workers did not come up within %ss", self.ready_timeout)
+            last_respawn = 0.0
+            while True:
+                while self.signals:
+                    signum = self.signals.pop(0)
+                    if signum == signal.SIGHUP:
+                        self.reload()
+                    else:
+                        self.stop(graceful=signum != signal.SIGQUIT)
+                        return
+                self.reap()
+                running = {slot for generation, slot in self.children.values() if generation == self.generation}
+                missing = [slot for slot in range(self.workers) if slot not in running]
+                # Replace crashed workers, at most once a second so a broken one cannot fork-bomb
+                if missing and time.monotonic() - last_respawn > 1:
+                    last_respawn = time.monotonic()
+                    for slot in missing:
+                        os.close(self.spawn(slot)[1])
+                time.sleep(0.2)
+        finally:
+            self.listener.close()
+            if self.pid_file and os.path.exists(self.pid_file):
+                os.remove(self.pid_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', help='JSON or TOML config file; also read by every worker.')
+    parser.add_argument('--bind', help='host:port to listen on.')
+    parser.add_argument('--workers', type=int, help='Worker processes (default: one per CPU).')
+    parser.add_argument('--threads', type=int, help='Request threads per worker.')
+    parser.add_argument('--graceful-timeout', type=float, help='Seconds a stopping worker gets to drain.')
+    parser.add_argument('--pid-file')
+    parser.add_argument('--access-log', action='store_true', default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(process)d] %(name)s: %(message)s')
+    if args.config:
+        os.environ[CONFIG_ENV] = os.path.abspath(args.config)
+    settings = Settings()
+    config = settings.section('server', server_defaults)
+    for key in ('bind', 'workers', 'threads', 'graceful_timeout', 'pid_file', 'access_log'):
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+    RequestHandler.access_log = config['access_log']
+
+    workers = config['workers'] or default_workers()
+    problems = shared_state_problems(settings)
+    if workers > 1 and problems:
+        for problem in problems:
+            logger.error("Cannot run %s workers: %s", workers, problem)
+        logger.error("Fix the configuration or start the server with --workers 1")
+        return 1
+
+    master = Master(config['bind'], workers, config['threads'], config['backlog'],
+                    config['graceful_timeout'], config['ready_timeout'], config['pid_file'])
+    master.run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""
+Configuration from a file and the environment.
+
+Each config dict in the application is a section whose defaults live in the code. A JSON
+or TOML file named by LIBRARY_CONFIG overrides them section by section, with the section
+named after the dict without its '_config' suffix:
+
+    {"db": {"host": "10.0.0.5", "password": "..."}, "pool": {"size": 20}}
+
+Environment variables override the file one key at a time as LIBRARY_<SECTION>_<KEY>,
+e.g. LIBRARY_DB_HOST=10.0.0.5 or LIBRARY_POOL_SIZE=20. A value is converted to the type
+of the key's default, so a key with an int default takes whole numbers only and one with a
+float default takes fractions too; keys whose default is None, a list or a dict take JSON, e.g.
+LIBRARY_REPLICA_REPLICAS='[{"name": "replica1", "host": "10.0.0.6"}]'. 'none' or 'null'
+sets a non-string key to None.
+"""
+import json
+import os
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
+CONFIG_ENV = 'LIBRARY_CONFIG'
+ENV_PREFIX = 'LIBRARY_'
+
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+FALSE_VALUES = ('0', 'false', 'no', 'off')
+
+
+class ConfigError(Exception):
+    pass
+
+
+def read_config_file(path):
+    if path.endswith('.toml'):
+        if tomllib is None:
+            raise ConfigError("TOML config files need Python 3.11 or later; use JSON instead.")
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+    with open(path) as f:
+        return json.load(f)
+
+
+def convert(raw, default, name):
+    """Converts the string raw to the type of default."""
+    if not isinstance(default, str) and raw.lower() in ('none', 'null'):
+        return None
+    try:
+        if isinstance(default, bool):
+            if raw.lower() in TRUE_VALUES:
+                return True
+            if raw.lower() in FALSE_VALUES:
+                return False
+            raise ValueError(raw)
+        if isinstance(default, int):
+            return int(raw)
+        if isinstance(default, float):
+            return float(raw)
+        if isinstance(default, str):
+            return raw
+        try:
+            return json.loads(raw)
+        except ValueError:
+            # A plain string, such as a path, for a key that defaults to None
+            if default is None:
+                return raw
+            raise
+    except ValueError:
+        raise ConfigError(f"{name}={raw!r} is not a valid {type(default).__name__}.")
+
+
+def check(value, default, name):
+    """Checks a value from the config file against the type of default, as convert() does for strings."""
+    if isinstance(default, int) and not isinstance(default, bool) and isinstance(value, float):
+        if not value.is_integer():
+            raise ConfigError(f"{name}={value!r} is not a valid int.")
+        return int(value)
+    return value
+
+
+class Settings:
+    def __init__(self, path=None, environ=None):
+        self.environ = os.environ if environ is None else environ
+        self.path = path or self.environ.get(CONFIG_ENV)
+        self.file = read_config_file(self.path) if self.path else {}
+
+    def section(self, name, defaults):
+        """Returns a copy of defaults with the file's and then the environment's overrides applied."""
+        values = dict(defaults)
+        overrides = self.file.get(name, {})
+        unknown = sorted(set(overrides) - set(defaults))
+        if unknown:
+            raise ConfigError(f"Unknown keys in section '{name}' of {self.path}: {', '.join(unknown)}")
+        for key, value in overrides.items():
+            values[key] = check(value, defaults[key], f"{name}.{key}")
+
+        prefix = f"{ENV_PREFIX}{name.upper()}_"
+        for key, default in defaults.items():
+            raw = self.environ.get(prefix + key.upper())
+            if raw is not None:
+                values[key] = convert(raw, default, prefix + key.upper())
+        return values
+
+    def value(self, name, key, default):
+        """One key of a section, overridden as section() does, for code that does not own the section."""
+        value = check(self.file.get(name, {}).get(key, default), default, f"{name}.{key}")
+        env = f"{ENV_PREFIX}{name.upper()}_{key.upper()}"
+        raw = self.environ.get(env)
+        return convert(raw, default, env) if raw is not None else value
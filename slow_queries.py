@@ -0,0 +1,126 @@
+"""
+Opt-in slow-query recorder.
+
+Statements slower than the threshold are logged with redacted parameters, their duration
+and the route that ran them, and are grouped by normalized SQL shape. The first time a
+shape turns up, its EXPLAIN plan is captured on a background thread so the request that
+hit it is not held up.
+"""
+import logging
+import re
+import threading
+import time
+
+logger = logging.getLogger('library.slow_queries')
+
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'REPLACE', 'WITH')
+
+_in_list = re.compile(r'\(\s*%s(?:\s*,\s*%s)+\s*\)')
+_string = re.compile(r"'(?:[^'\\]|\\.)*'")
+_number = re.compile(r'\b\d+(?:\.\d+)?\b')
+_space = re.compile(r'\s+')
+
+
+def normalize_sql(sql):
+    sql = _in_list.sub('(?, ...)', sql)
+    sql = sql.replace('%s', '?')
+    sql = _string.sub('?', sql)
+    sql = _number.sub('?', sql)
+    return _space.sub(' ', sql).strip()
+
+
+def redact(params):
+    # Keep numbers, which are IDs and counts here; hide strings, which can be names or contact details
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: redact(value) for key, value in params.items()}
+    if isinstance(params, (list, tuple)):
+        if params and isinstance(params[0], (list, tuple, dict)):
+            return f"<{len(params)} rows>"
+        return [redact(value) for value in params]
+    if isinstance(params, (bool, int, float)):
+        return params
+    if isinstance(params, (str, bytes)):
+        return f"<{type(params).__name__}:{len(params)}>"
+    return f"<{type(params).__name__}>"
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms=200, explain_connection=None, max_shapes=500):
+        self.threshold = threshold_ms / 1000.0
+        self.explain_connection = explain_connection
+        self.max_shapes = max_shapes
+        self._shapes = {}
+        self._lock = threading.Lock()
+
+    def record(self, sql, params, duration, route, many=False):
+        if duration < self.threshold or not isinstance(sql, str):
+            return
+        if sql.lstrip().upper().startswith('EXPLAIN'):
+            return
+
+        shape = normalize_sql(sql)
+        redacted = redact(params)
+        logger.warning("Slow query (%.1f ms) on %s: %s params=%s", duration * 1000, route, shape, redacted)
+
+        with self._lock:
+            entry = self._shapes.get(shape)
+            if entry is None:
+                if len(self._shapes) >= self.max_shapes:
+                    # Make room by dropping the cheapest shape
+                    cheapest = min(self._shapes, key=lambda key: self._shapes[key]["total_ms"])
+                    del self._shapes[cheapest]
+                entry = self._shapes[shape] = {
+                    "shape": shape,
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "routes": {},
+                    "last_params": None,
+                    "last_seen": None,
+                    "explain": None
+                }
+                explain = not many and self.explain_connection is not None
+            else:
+                explain = False
+            entry["count"] += 1
+            entry["total_ms"] += duration * 1000
+            entry["max_ms"] = max(entry["max_ms"], duration * 1000)
+            entry["routes"][route] = entry["routes"].get(route, 0) + 1
+            entry["last_params"] = redacted
+            entry["last_seen"] = time.time()
+
+        if explain and sql.lstrip().upper().startswith(EXPLAINABLE):
+            threading.Thread(target=self._explain, args=(shape, sql, params), daemon=True).start()
+
+    def _explain(self, shape, sql, params):
+        try:
+            connection = self.explain_connection()
+        except Exception as e:
+            logger.warning("Could not borrow a connection to EXPLAIN %s: %s", shape, e)
+            return
+        try:
+            cur = connection.cursor()
+            cur.execute("EXPLAIN " + sql, params)
+            columns = [column[0] for column in cur.description]
+            plan = [dict(zip(columns, row)) for row in cur.fetchall()]
+        except Exception as e:
+            plan = {"error": str(e)}
+        finally:
+            connection.close()
+
+        with self._lock:
+            if shape in self._shapes:
+                self._shapes[shape]["explain"] = plan
+
+    def worst(self, limit=20):
+        with self._lock:
+            entries = sorted(self._shapes.values(), key=lambda entry: entry["total_ms"], reverse=True)[:limit]
+            return [dict(entry, total_ms=round(entry["total_ms"], 3), max_ms=round(entry["max_ms"], 3),
+                         avg_ms=round(entry["total_ms"] / entry["count"], 3), routes=dict(entry["routes"]))
+                    for entry in entries]
+
+    def clear(self):
+        with self._lock:
+            self._shapes.clear()
@@ -0,0 +1,173 @@
+"""
+The SQL run by the request handlers, in one place, and the server-side prepared statements
+that run it.
+
+Pooled connections created with prepare_statements=True keep a small LRU of prepared
+cursors keyed by statement. The first execution of a statement on a connection prepares
+it; later executions send only the statement ID and the parameters in the binary
+protocol, so MySQL does not parse the SQL again. Any other connection, such as a plain
+mysql.connector connection, runs the same SQL through an ordinary text cursor.
+
+Statements with a variable-length IN list are written with an {ids} marker and expanded
+per list length, so each length is prepared once per connection.
+"""
+import functools
+
+# Prepared statements kept per connection; the least recently used one is closed beyond this
+STATEMENTS_PER_CONNECTION = 64
+
+
+class Statement:
+    __slots__ = ('name', 'sql')
+
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql = sql
+
+    def expand(self, count):
+        return _expand(self, count)
+
+    def __repr__(self):
+        return f"Statement({self.name!r})"
+
+
+@functools.lru_cache(maxsize=1024)
+def _expand(statement, count):
+    # Cached so the same length always yields the same Statement and SQL string
+    return Statement(f"{statement.name}[{count}]", statement.sql.replace('{ids}', ', '.join(['%s'] * count)))
+
+
+# Books
+BOOKS_ALL = Statement('books_all', "SELECT * FROM Books")
+BOOKS_PAGE = Statement('books_page', "SELECT * FROM Books WHERE bookID > %s ORDER BY bookID LIMIT %s")
+BOOKS_BY_IDS = Statement('books_by_ids', "SELECT * FROM Books WHERE bookID IN ({ids})")
+AUTHORS_BY_BOOK_IDS = Statement('authors_by_book_ids', '''SELECT ba.bookID, a.name FROM Authors a
+                                                           JOIN Book_Authors ba ON a.authorID = ba.authorID
+                                                           WHERE ba.bookID IN ({ids})''')
+GENRES_BY_BOOK_IDS = Statement('genres_by_book_ids', '''SELECT bg.bookID, g.genreName FROM Genres g
+                                                         JOIN Book_Genres bg ON g.genreID = bg.genreID
+                                                         WHERE bg.bookID IN ({ids})''')
+BOOK_TITLE = Statement('book_title', "SELECT title FROM Books WHERE bookID=%s")
+
+# With sharded inventory Books.bookCount is left as it was when the slots were seeded. A book's copies
+# not on loan are then the ones in its slots plus the ones held by reservations, which, like bookCount,
+# only changes on checkout and return.
+SLOT_BOOK_COUNT = '''CAST((SELECT COALESCE(SUM(i.available), 0) FROM Inventory_Slots i WHERE i.bookID = b.bookID)
+                          + (SELECT COUNT(*) FROM Reservations r WHERE r.bookID = b.bookID) AS SIGNED)'''
+SLOT_BOOK_COLUMNS = ("b.bookID, b.title, b.publicationDate, b.publisherID, b.availabilityStatus, "
+                     f"{SLOT_BOOK_COUNT} AS bookCount")
+BOOKS_ALL_SLOTS = Statement('books_all_slots', f"SELECT {SLOT_BOOK_COLUMNS} FROM Books b")
+BOOKS_PAGE_SLOTS = Statement('books_page_slots', f"SELECT {SLOT_BOOK_COLUMNS} FROM Books b "
+                                                 "WHERE b.bookID > %s ORDER BY b.bookID LIMIT %s")
+BOOKS_BY_IDS_SLOTS = Statement('books_by_ids_slots', f"SELECT {SLOT_BOOK_COLUMNS} FROM Books b "
+                                                     "WHERE b.bookID IN ({ids})")
+
+# Users
+USER_BY_CONTACT = Statement('user_by_contact', "SELECT * FROM Users WHERE contactDetails=%s")
+USER_BY_NAME = Statement('user_by_name', "SELECT userID FROM Users WHERE name=%s")
+INSERT_USER = Statement('insert_user', "INSERT INTO Users (name, contactDetails) VALUES (%s, %s)")
+
+# Carts
+CART_BY_ID = Statement('cart_by_id', "SELECT * FROM Cart WHERE cartID=%s")
+CART_ITEM = Statement('cart_item', "SELECT * FROM Cart_Items WHERE cartID=%s AND bookID=%s")
+INSERT_CART_ITEM = Statement('insert_cart_item', "INSERT INTO Cart_Items (cartID, bookID, bookName) VALUES (%s, %s, %s)")
+DELETE_CART_ITEM = Statement('delete_cart_item', "DELETE FROM Cart_Items WHERE cartID=%s AND bookID=%s")
+CART_TITLES = Statement('cart_titles', '''SELECT b.title FROM Books b
+                                          JOIN Cart_Items ci ON b.bookID = ci.bookID
+                                          WHERE ci.cartID=%s''')
+CART_SUMMARY_ADD = Statement('cart_summary_add', '''INSERT INTO Cart_Summary (bookID, cartCount) VALUES (%s, 1)
+                                                    ON DUPLICATE KEY UPDATE cartCount = cartCount + 1''')
+CART_SUMMARY_REMOVE = Statement('cart_summary_remove', '''UPDATE Cart_Summary SET cartCount = cartCount - 1
+                                                          WHERE bookID=%s AND cartCount > 0''')
+
+# Checkout
+CHECKOUT_LOCK_ITEMS = Statement('checkout_lock_items', '''SELECT ci.bookID, b.bookCount, b.availabilityStatus FROM Cart_Items ci
+                                                          LEFT JOIN Books b ON b.bookID = ci.bookID
+                                                          WHERE ci.cartID=%s
+                                                          ORDER BY ci.bookID
+                                                          FOR UPDATE''')
+CHECKOUT_DECREMENT = Statement('checkout_decrement', '''UPDATE Books b
+                                                        JOIN Cart_Items ci ON b.bookID = ci.bookID
+                                                        SET b.bookCount = b.bookCount - 1
+                                                        WHERE ci.cartID=%s AND b.availabilityStatus=1 AND b.bookCount > 0''')
+CHECKOUT_LOG_LOANS = Statement('checkout_log_loans', '''INSERT INTO Transactions (userID, bookID, borrowDate)
+                                                        SELECT %s, bookID, NOW() FROM Cart_Items WHERE cartID=%s''')
+CHECKOUT_CLEAR_CART = Statement('checkout_clear_cart', "DELETE FROM Cart_Items WHERE cartID=%s")
+CHECKOUT_LOAN_SUMMARY = Statement('checkout_loan_summary', '''INSERT INTO Loan_Summary (userID, bookID, loanCount)
+                                                              SELECT %s, bookID, 1 FROM Cart_Items WHERE cartID=%s
+                                                              ON DUPLICATE KEY UPDATE loanCount = loanCount + 1''')
+CHECKOUT_CART_SUMMARY = Statement('checkout_cart_summary', '''UPDATE Cart_Summary cs
+                                                              JOIN Cart_Items ci ON cs.bookID = ci.bookID
+                                                              SET cs.cartCount = cs.cartCount - 1
+                                                              WHERE ci.cartID=%s AND cs.cartCount > 0''')
+
+# Reports
+TOP_LOANS_THRESHOLD = Statement('top_loans_threshold',
+                                "SELECT loanCount FROM Loan_Summary ORDER BY loanCount DESC LIMIT 1 OFFSET %s")
+TOP_LOANS = Statement('top_loans', '''
+        SELECT
+            Users.name AS user_name,
+            Books.title AS book_title,
+            ls.loanCount AS loan_count,
+            Publishers.publisherName AS publisher_name,
+            COALESCE(cs.cartCount, 0) AS cart_count
+        FROM
+            Loan_Summary ls
+        JOIN
+            Users ON Users.userID = ls.userID
+        JOIN
+            Books ON Books.bookID = ls.bookID
+        JOIN
+            Publishers ON Books.publisherID = Publishers.publisherID
+        LEFT JOIN
+            Cart_Summary cs ON cs.bookID = ls.bookID
+        WHERE
+            ls.loanCount >= %s AND ls.loanCount > 0
+        ORDER BY
+            loan_count DESC, cart_count DESC
+        LIMIT %s
+    ''')
+
+
+def cursor_for(connection, statement):
+    cache = getattr(connection, 'statement_cache', None)
+    if cache is None:
+        return connection.cursor()
+    cur = cache.get(statement)
+    if cur is None:
+        cur = cache[statement] = connection.cursor(prepared=True)
+        if len(cache) > STATEMENTS_PER_CONNECTION:
+            # Closing the cursor deallocates its statement on the server
+            _, evicted = cache.popitem(last=False)
+            evicted.close()
+    else:
+        cache.move_to_end(statement)
+    return cur
+
+
+def execute(connection, statement, params=()):
+    """Runs a statement and returns its cursor, for rowcount, lastrowid or reading the rows."""
+    cur = cursor_for(connection, statement)
+    # The prepared cursor only skips re-preparing when it is handed the very same SQL object
+    cur.execute(statement.sql, params)
+    return cur
+
+
+def fetchall(connection, statement, params=()):
+    cur = cursor_for(connection, statement)
+    cur.execute(statement.sql, params)
+    return cur.fetchall()
+
+
+def fetchone(connection, statement, params=()):
+    # Read every row so the cached cursor is left with no pending result
+    rows = fetchall(connection, statement, params)
+    return rows[0] if rows else None
+
+
+def fetch_dicts(connection, statement, params=()):
+    cur = cursor_for(connection, statement)
+    cur.execute(statement.sql, params)
+    rows = cur.fetchall()
+    columns = [column[0] for column in cur.description]
+    return [dict(zip(columns, row)) for row in rows]
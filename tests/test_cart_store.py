@@ -0,0 +1,196 @@
+import pytest
+
+from cart_store import CartJournal, CartNotFoundError, CartStore
+
+
+class FakeDatabase:
+    """Just enough of Cart, Cart_Items and Books for CartStore's statements."""
+
+    def __init__(self, carts, books):
+        self.carts = dict(carts)            # cartID -> userID
+        self.books = set(books)
+        self.cart_items = {}                # cartID -> {bookID: bookName}
+        self.commits = 0
+        self.connections = 0
+
+    def connect(self):
+        self.connections += 1
+        return FakeConnection(self)
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+
+    def execute(self, sql, params=()):
+        sql = ' '.join(sql.split())
+        if sql.startswith("SELECT userID FROM Cart WHERE"):
+            user = self.db.carts.get(params[0])
+            self.rows = [(user,)] if user is not None else []
+        elif sql.startswith("SELECT bookID, bookName FROM Cart_Items"):
+            self.rows = list(self.db.cart_items.get(params[0], {}).items())
+        elif sql.startswith("SELECT bookID FROM Cart_Items"):
+            self.rows = [(book_id,) for book_id in self.db.cart_items.get(params[0], {})]
+        elif sql.startswith("SELECT bookID FROM Books"):
+            self.rows = [(book_id,) for book_id in params if book_id in self.db.books]
+        elif sql.startswith("DELETE FROM Cart_Items"):
+            for book_id in params[1:]:
+                self.db.cart_items.get(params[0], {}).pop(book_id, None)
+        elif sql.startswith("UPDATE Cart_Summary"):
+            pass
+        else:
+            raise AssertionError(f"Unexpected statement: {sql}")
+
+    def executemany(self, sql, rows):
+        if sql.startswith("INSERT INTO Cart_Items"):
+            for cart_id, book_id, name in rows:
+                self.db.cart_items.setdefault(cart_id, {})[book_id] = name
+        elif "Cart_Summary" not in sql:
+            raise AssertionError(f"Unexpected statement: {sql}")
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self):
+        return FakeCursor(self.db)
+
+    def commit(self):
+        self.db.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def db():
+    return FakeDatabase({1: 10, 2: 20}, books=range(100, 110))
+
+
+def test_journal_replay_keeps_newest_unflushed_state(tmp_path):
+    journal = CartJournal(str(tmp_path / 'carts.log'))
+    journal.write_state(1, 10, 1, {100: 'a'})
+    journal.write_state(1, 10, 2, {100: 'a', 101: 'b'})
+    journal.write_state(2, 20, 1, {102: 'c'})
+    journal.write_flushed(2, 1)
+    journal.close()
+
+    records = CartJournal(str(tmp_path / 'carts.log')).replay()
+    assert len(records) == 1
+    assert records[0]["cart"] == 1
+    assert records[0]["seq"] == 2
+    assert records[0]["items"] == [[100, 'a'], [101, 'b']]
+
+
+def test_journal_replay_skips_torn_last_line(tmp_path):
+    path = tmp_path / 'carts.log'
+    journal = CartJournal(str(path))
+    journal.write_state(1, 10, 1, {100: 'a'})
+    journal.close()
+    with open(path, 'a') as f:
+        f.write('{"cart": 1, "user": 10, "se')
+
+    records = CartJournal(str(path)).replay()
+    assert [record["seq"] for record in records] == [1]
+
+
+def test_journal_compaction_keeps_only_snapshot_and_later_appends(tmp_path):
+    path = str(tmp_path / 'carts.log')
+    journal = CartJournal(path)
+    for seq in range(1, 50):
+        journal.write_state(1, 10, seq, {100: 'a'})
+    journal.write_state(2, 20, 3, {101: 'b'})
+    before = journal.size()
+
+    journal.compact(lambda: [(2, 20, 3, {101: 'b'})])
+    assert journal.size() < before
+    journal.write_state(3, 30, 1, {102: 'c'})
+    journal.close()
+
+    records = CartJournal(path).replay()
+    assert sorted((record["cart"], record["seq"]) for record in records) == [(2, 3), (3, 1)]
+
+
+def test_changes_stay_in_memory_until_flushed(db):
+    store = CartStore(db.connect)
+    assert store.add(1, 100, 'a')
+    assert not store.add(1, 100, 'a')
+    assert store.add(1, 101, 'b')
+    assert store.remove(1, 100)
+    assert not store.remove(1, 100)
+    assert store.items(1) == [(101, 'b')]
+    assert db.cart_items == {}
+
+    store.flush(1)
+    assert db.cart_items == {1: {101: 'b'}}
+    assert store.stats()["dirty"] == 0
+
+
+def test_unknown_cart(db):
+    store = CartStore(db.connect)
+    with pytest.raises(CartNotFoundError):
+        store.add(99, 100, 'a')
+
+
+def test_flush_drops_books_deleted_from_catalog(db):
+    store = CartStore(db.connect)
+    store.add(1, 100, 'a')
+    store.add(1, 500, 'gone')
+    store.flush(1)
+    assert db.cart_items == {1: {100: 'a'}}
+    assert store.items(1) == [(100, 'a')]
+
+
+def test_eviction_flushes_least_recently_used(db):
+    store = CartStore(db.connect, max_carts=1)
+    store.add(1, 100, 'a')
+    store.add(2, 101, 'b')
+    assert db.cart_items == {1: {100: 'a'}}
+    assert store.stats()["carts"] == 1
+    assert store.stats()["evictions"] == 1
+
+
+def test_journal_restores_unflushed_carts_after_restart(db, tmp_path):
+    path = str(tmp_path / 'carts.log')
+    store = CartStore(db.connect, durability='journal', journal_path=path)
+    store.add(1, 100, 'a')
+    store.add(2, 101, 'b')
+    store.flush(2)
+    store.journal.close()
+
+    restored = CartStore(db.connect, durability='journal', journal_path=path)
+    assert restored.stats()["carts"] == 1
+    assert restored.items(1) == [(100, 'a')]
+    assert restored.flush_all() == 1
+    assert db.cart_items == {1: {100: 'a'}, 2: {101: 'b'}}
+
+    # Everything is flushed, so nothing comes back a second time
+    restored.journal.close()
+    assert CartStore(db.connect, durability='journal', journal_path=path).stats()["carts"] == 0
+
+
+def test_checkout_flushes_first_and_forgets_loaned_books(db):
+    store = CartStore(db.connect)
+    store.add(1, 100, 'a')
+    store.add(1, 101, 'b')
+    seen = []
+
+    def checkout():
+        seen.append(dict(db.cart_items.get(1, {})))
+        db.cart_items[1] = {}
+        return [100, 101]
+
+    assert store.checkout(1, db.connect(), checkout) == [100, 101]
+    assert seen == [{100: 'a', 101: 'b'}]
+    assert store.items(1) == []
@@ -0,0 +1,97 @@
+from catalog_import import CatalogImporter
+
+
+class FakeDatabase:
+    """Just enough of the catalog tables and Inventory_Slots for CatalogImporter's statements."""
+
+    def __init__(self):
+        self.names = {'Publishers': {}, 'Authors': {}, 'Genres': {}}
+        self.books = {}                     # bookID -> (title, bookCount)
+        self.slots = {}                     # (bookID, slot) -> available
+        self.links = set()
+        self.commits = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        raise AssertionError("Unexpected rollback")
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+        self.lastrowid = None
+        self.rowcount = 0
+
+    def execute(self, sql, params=()):
+        db = self.db
+        sql = ' '.join(sql.split())
+        self.rows = []
+        if sql.startswith("SELECT bookID, title FROM Books WHERE bookID BETWEEN"):
+            first, last = params
+            self.rows = [(book_id, db.books[book_id][0]) for book_id in sorted(db.books) if first <= book_id <= last]
+        elif sql.startswith("SELECT") and "FROM Publishers" in sql:
+            self.rows = list(db.names['Publishers'].items())
+        elif sql.startswith("SELECT") and "FROM Authors" in sql:
+            self.rows = list(db.names['Authors'].items())
+        elif sql.startswith("SELECT") and "FROM Genres" in sql:
+            self.rows = list(db.names['Genres'].items())
+        elif sql.startswith("INSERT INTO Inventory_Slots"):
+            slots = params[0]
+            self.rowcount = 0
+            for book_id in params[2:]:
+                if not any(key[0] == book_id for key in db.slots):
+                    count = db.books[book_id][1]
+                    for slot in range(slots):
+                        db.slots[(book_id, slot)] = count // slots + (slot < count % slots)
+                        self.rowcount += 1
+        else:
+            raise AssertionError(f"Unexpected statement: {sql}")
+
+    def executemany(self, sql, rows):
+        db = self.db
+        sql = ' '.join(sql.split())
+        if sql.startswith("INSERT INTO Books"):
+            self.lastrowid = len(db.books) + 1
+            for title, _, _, _, count in rows:
+                db.books[len(db.books) + 1] = (title, count)
+        elif sql.startswith("INSERT IGNORE INTO Book_"):
+            db.links.update(rows)
+        else:
+            table = sql.split()[2]
+            for (name,) in rows:
+                db.names[table].setdefault(name, len(db.names[table]) + 1)
+
+    def fetchall(self):
+        return self.rows
+
+
+RECORDS = [
+    (2, {"title": "First", "bookCount": "3", "authors": ["A"], "genres": ["G"], "publisher": "P"}),
+    (3, {"title": "Second", "bookCount": "10", "authors": ["B"]}),
+    (4, {"title": ""})
+]
+
+
+def test_import_seeds_inventory_slots_for_new_books():
+    db = FakeDatabase()
+    stats = CatalogImporter(db, slots=4).run(iter(RECORDS))
+    assert stats["books"] == 2
+    assert stats["skipped"] == 1
+
+    for book_id, (_, count) in db.books.items():
+        book_slots = [db.slots[(book_id, slot)] for slot in range(4)]
+        assert sum(book_slots) == count
+    assert [db.slots[(1, slot)] for slot in range(4)] == [1, 1, 1, 0]
+
+
+def test_import_without_sharded_inventory_leaves_slots_alone():
+    db = FakeDatabase()
+    CatalogImporter(db).run(iter(RECORDS))
+    assert len(db.books) == 2
+    assert db.slots == {}
@@ -0,0 +1,44 @@
+from catalog_search import MAX_CANDIDATES, MAX_TERMS, build_boolean_query, search_query, search_results, split_terms
+
+
+def test_split_terms_reports_short_and_surplus_words():
+    terms, ignored = split_terms("The Harry of Potter go")
+    assert terms == ['the', 'harry', 'potter']
+    assert ignored == ['of', 'go']
+
+    words = [f"word{i}" for i in range(MAX_TERMS + 2)]
+    terms, ignored = split_terms(' '.join(words))
+    assert terms == words[:MAX_TERMS]
+    assert ignored == words[MAX_TERMS:]
+
+
+def test_boolean_operators_are_stripped():
+    assert build_boolean_query('+pott* -"rowl"') == 'pott* rowl*'
+
+
+def test_short_terms_match_whole_words_only():
+    assert build_boolean_query('sha potter') == 'sha potter*'
+
+
+def test_no_query_when_every_word_is_too_short():
+    assert search_query('a of') is None
+
+
+def test_filters_and_paging_parameters():
+    sql, params = search_query('potter', genre='Fantasy', publisher='7', available=True, limit=20, offset=40)
+    assert params[:9] == ('potter*', 'potter*', MAX_CANDIDATES) * 3
+    assert params[9:] == ('Fantasy', '7', 21, 40)
+    assert 'b.publisherID=%s' in sql
+    assert sql.count('%s') == len(params)
+
+
+def test_candidates_cover_deep_pages():
+    _, params = search_query('potter', limit=100, offset=MAX_CANDIDATES)
+    assert params[2] == MAX_CANDIDATES + 101
+
+
+def test_results_fetch_one_extra_row_to_detect_more():
+    rows = [(1, 3.0), (2, 2.0), (3, 1.0)]
+    results, has_more = search_results(('bookID', 'score'), rows, 2)
+    assert [row['bookID'] for row in results] == [1, 2]
+    assert has_more
@@ -0,0 +1,135 @@
+import threading
+import time
+
+import mysql.connector
+import pytest
+
+from db_pool import ConnectionPool, PoolTimeoutError
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.unread_result = False
+        self.in_transaction = False
+        self.rollbacks = 0
+        self.ping_error = False
+
+    def ping(self, reconnect=False):
+        if self.ping_error:
+            raise mysql.connector.Error("gone away")
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.in_transaction = False
+
+    def consume_results(self):
+        self.unread_result = False
+
+    def is_connected(self):
+        return not self.closed
+
+    def close(self):
+        self.closed = True
+
+
+class FakePool(ConnectionPool):
+    def __init__(self, **kwargs):
+        super().__init__({}, **kwargs)
+        self.connections = []
+
+    def _connect(self):
+        connection = FakeConnection()
+        self.connections.append(connection)
+        return connection
+
+
+def test_reuses_released_connection():
+    pool = FakePool(size=2)
+    first = pool.acquire()
+    first.close()
+    second = pool.acquire()
+    assert second._connection is first._connection
+    assert len(pool.connections) == 1
+    assert pool.stats()["borrowed"] == 2
+
+
+def test_close_twice_releases_once():
+    pool = FakePool(size=1)
+    pooled = pool.acquire()
+    pooled.close()
+    pooled.close()
+    assert pool.stats()["idle"] == 1
+    assert pool.stats()["in_use"] == 0
+
+
+def test_timeout_when_exhausted():
+    pool = FakePool(size=1, timeout=0.05)
+    pool.acquire()
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire()
+    stats = pool.stats()
+    assert stats["timeouts"] == 1
+    assert stats["waits"] == 1
+
+
+def test_waiter_gets_connection_released_by_another_thread():
+    pool = FakePool(size=1, timeout=2)
+    held = pool.acquire()
+    threading.Timer(0.05, held.close).start()
+    pooled = pool.acquire()
+    assert pooled._connection is held._connection
+    assert pool.stats()["wait_time"] > 0
+
+
+def test_release_rolls_back_open_transaction():
+    pool = FakePool(size=1)
+    pooled = pool.acquire()
+    pooled._connection.in_transaction = True
+    pooled._connection.unread_result = True
+    pooled.close()
+    assert pooled._connection.rollbacks == 1
+    assert not pooled._connection.unread_result
+
+
+def test_recycles_old_connections():
+    pool = FakePool(size=1, recycle=10)
+    pooled = pool.acquire()
+    pooled.created_at -= 11
+    pooled.close()
+    fresh = pool.acquire()
+    assert fresh._connection is not pooled._connection
+    assert pooled._connection.closed
+    assert pool.stats()["recycled"] == 1
+    assert pool.stats()["open"] == 1
+
+
+def test_replaces_idle_connection_that_fails_ping():
+    pool = FakePool(size=1, ping_interval=1)
+    pooled = pool.acquire()
+    pooled.close()
+    pooled.last_used = time.monotonic() - 2
+    pooled._connection.ping_error = True
+    fresh = pool.acquire()
+    assert fresh._connection is not pooled._connection
+    assert pool.stats()["recycled"] == 1
+
+
+def test_failed_connect_frees_its_slot():
+    pool = FakePool(size=1, timeout=0.05)
+
+    def refuse():
+        raise mysql.connector.Error("refused")
+
+    pool._connect = refuse
+    with pytest.raises(mysql.connector.Error):
+        pool.acquire()
+    assert pool.stats()["open"] == 0
+
+
+def test_warm_opens_connections_up_to_size():
+    pool = FakePool(size=3)
+    assert pool.warm(5) == 3
+    stats = pool.stats()
+    assert stats["open"] == 3
+    assert stats["idle"] == 3
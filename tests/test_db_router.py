@@ -0,0 +1,47 @@
+import time
+
+from catalog_cache import LocalVersionStore
+from db_router import ReplicaRouter
+
+
+class FakePool:
+    def __init__(self, name):
+        self.name = name
+
+    def stats(self):
+        return {}
+
+
+def make_router(**kwargs):
+    router = ReplicaRouter(FakePool('primary'), {'replica1': FakePool('replica1')}, max_lag=5, **kwargs)
+    # As if the lag check had just put the replica in rotation
+    router._rotation = [router.replicas['replica1']]
+    return router
+
+
+def test_reads_go_to_replica_unless_recently_written_here():
+    router = make_router()
+    assert router.read_pool(('Books',)).name == 'replica1'
+    router.note_write(('Books',))
+    assert router.read_pool(('Books',)).name == 'primary'
+    assert router.read_pool(('Authors',)).name == 'replica1'
+
+
+def test_shared_write_times_cover_other_processes_writes():
+    # Stands in for the store shared by every worker; this router never calls note_write
+    shared = LocalVersionStore()
+    router = make_router(write_times=shared.last_written)
+    assert router.read_pool(('Books',)).name == 'replica1'
+
+    shared.bump(('Books',))
+    assert router.read_pool(('Books', 'Authors')).name == 'primary'
+
+    shared._written['Books'] = time.time() - 6
+    assert router.read_pool(('Books',)).name == 'replica1'
+
+
+def test_no_rotation_falls_back_to_primary():
+    router = make_router()
+    router._rotation = []
+    assert router.read_pool(('Books',)).name == 'primary'
+    assert router.stats()["primary_reads"] == 1
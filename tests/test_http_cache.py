@@ -0,0 +1,32 @@
+import gzip
+
+from werkzeug.wrappers import Response
+
+from http_cache import compress_response
+from serializers import COLUMNAR_JSON, Table, render
+
+
+def columnar_response(rows):
+    table = Table(('bookID', 'title'), [(book_id, f"Title {book_id}") for book_id in range(rows)])
+    return Response(render(table, COLUMNAR_JSON), mimetype=COLUMNAR_JSON)
+
+
+def test_large_columnar_response_is_compressed():
+    response = columnar_response(500)
+    body = response.get_data()
+    assert len(body) > 1024
+
+    response = compress_response(response, 'gzip')
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.get_data()) == body
+    assert 'Accept-Encoding' in response.vary
+
+
+def test_small_columnar_response_is_sent_as_is():
+    response = compress_response(columnar_response(2), 'gzip')
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_unlisted_type_is_not_compressed():
+    response = compress_response(Response(b'x' * 4096, mimetype='image/png'), 'gzip')
+    assert 'Content-Encoding' not in response.headers
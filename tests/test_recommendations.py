@@ -0,0 +1,194 @@
+import datetime
+import math
+import random
+
+import pytest
+
+import recommendations
+from recommendations import rebuild, refresh_neighbours, update
+
+NEIGHBOURS = 3
+
+
+class FakeDatabase:
+    """Just enough of Transactions, Rollup_Watermark and the recommendation tables for update and rebuild."""
+
+    def __init__(self):
+        self.transactions = []              # (transactionID, userID, bookID, borrowDate)
+        self.watermark = 0
+        self.user_books = {}                # (userID, bookID) -> lastBorrowed
+        self.borrowers = {}                 # bookID -> borrowers
+        self.co_borrows = {}                # (bookID, otherBookID) -> users
+        self.neighbours = {}                # (bookID, neighbourID) -> score
+
+    def borrow(self, user_id, book_id):
+        transaction_id = len(self.transactions) + 1
+        borrowed = datetime.datetime(2024, 1, 1) + datetime.timedelta(minutes=transaction_id)
+        self.transactions.append((transaction_id, user_id, book_id, borrowed))
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        raise AssertionError("Unexpected rollback")
+
+    def ranked_neighbours(self, book_id, limit):
+        scored = [(users / math.sqrt(self.borrowers[book_id] * self.borrowers[other_id]), other_id)
+                  for (first, other_id), users in self.co_borrows.items() if first == book_id]
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return scored[:limit]
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+
+    def execute(self, sql, params=()):
+        db = self.db
+        sql = ' '.join(sql.split())
+        self.rows = []
+        if sql.startswith("SELECT lastTransactionID FROM Rollup_Watermark"):
+            self.rows = [(db.watermark,)]
+        elif sql.startswith("SELECT MAX(transactionID)"):
+            self.rows = [(len(db.transactions) or None,)]
+        elif sql.startswith("SELECT MIN(transactionID)"):
+            # Every transaction has settled
+            self.rows = [(None,)]
+        elif sql.startswith("UPDATE Rollup_Watermark"):
+            db.watermark = params[0]
+        elif sql.startswith("SELECT userID, bookID, MAX(borrowDate) FROM Transactions"):
+            mark, upper = params
+            latest = {}
+            for transaction_id, user_id, book_id, borrowed in db.transactions:
+                if mark < transaction_id <= upper:
+                    latest[(user_id, book_id)] = max(latest.get((user_id, book_id), borrowed), borrowed)
+            self.rows = [pair + (borrowed,) for pair, borrowed in latest.items()]
+        elif sql.startswith("SELECT userID, bookID FROM User_Books WHERE userID IN"):
+            self.rows = [pair for pair in db.user_books if pair[0] in params]
+        elif sql == "SELECT userID, bookID FROM User_Books":
+            self.rows = list(db.user_books)
+        elif sql.startswith("DELETE FROM Book_Neighbours WHERE bookID IN"):
+            db.neighbours = {pair: score for pair, score in db.neighbours.items() if pair[0] not in params}
+        elif sql.startswith("INSERT INTO Book_Neighbours (bookID, neighbourID, score) SELECT"):
+            *book_ids, limit = params
+            for book_id in book_ids:
+                for score, other_id in db.ranked_neighbours(book_id, limit):
+                    db.neighbours[(book_id, other_id)] = score
+        elif sql == "DELETE FROM Book_Neighbours":
+            db.neighbours = {}
+        elif sql == "DELETE FROM Book_CoBorrows":
+            db.co_borrows = {}
+        elif sql == "DELETE FROM Book_Borrowers":
+            db.borrowers = {}
+        else:
+            raise AssertionError(f"Unexpected statement: {sql}")
+
+    def executemany(self, sql, rows):
+        db = self.db
+        sql = ' '.join(sql.split())
+        for row in rows:
+            if sql.startswith("INSERT INTO User_Books"):
+                user_id, book_id, borrowed = row
+                db.user_books[(user_id, book_id)] = max(db.user_books.get((user_id, book_id), borrowed), borrowed)
+            elif sql.startswith("INSERT INTO Book_Borrowers"):
+                book_id, count = row
+                db.borrowers[book_id] = db.borrowers.get(book_id, 0) + count
+            elif sql.startswith("INSERT INTO Book_CoBorrows"):
+                book_id, other_id, count = row
+                db.co_borrows[(book_id, other_id)] = db.co_borrows.get((book_id, other_id), 0) + count
+            elif sql.startswith("INSERT INTO Book_Neighbours"):
+                book_id, other_id, score = row
+                db.neighbours[(book_id, other_id)] = score
+            else:
+                raise AssertionError(f"Unexpected statement: {sql}")
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+
+def random_borrows(db, rng, count, users=15, books=12):
+    for _ in range(count):
+        db.borrow(rng.randrange(users), rng.randrange(books))
+
+
+def rebuilt_copy(db):
+    # A database holding the same transactions, computed by one full rebuild
+    fresh = FakeDatabase()
+    fresh.transactions = list(db.transactions)
+    rebuild(fresh, NEIGHBOURS)
+    return fresh
+
+
+@pytest.fixture(autouse=True)
+def pure_python(monkeypatch):
+    # The incremental path must agree with the pure Python rebuild whether or not NumPy is installed
+    monkeypatch.setattr(recommendations, 'numpy', None)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_incremental_counts_match_full_rebuild(seed):
+    rng = random.Random(seed)
+    db = FakeDatabase()
+    for _ in range(6):
+        random_borrows(db, rng, rng.randrange(1, 25))
+        update(db, batch_size=10, neighbours=NEIGHBOURS)
+        while db.watermark < len(db.transactions):
+            update(db, batch_size=10, neighbours=NEIGHBOURS)
+
+    expected = rebuilt_copy(db)
+    assert db.user_books == expected.user_books
+    assert db.borrowers == expected.borrowers
+    assert db.co_borrows == expected.co_borrows
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_incremental_scores_match_full_rebuild_once_refreshed(seed):
+    rng = random.Random(100 + seed)
+    db = FakeDatabase()
+    for _ in range(4):
+        random_borrows(db, rng, 20)
+        update(db, neighbours=NEIGHBOURS)
+
+    # Books not touched by the last batch may keep stale scores until they are re-ranked
+    refresh_neighbours(db.cursor(), list(db.borrowers), NEIGHBOURS)
+    expected = rebuilt_copy(db)
+    assert db.neighbours.keys() == expected.neighbours.keys()
+    for pair, score in expected.neighbours.items():
+        assert db.neighbours[pair] == pytest.approx(score)
+
+
+def test_touched_books_are_reranked_by_update():
+    db = FakeDatabase()
+    for user_id, book_id in [(1, 10), (1, 11), (2, 10), (2, 12), (3, 11), (3, 12)]:
+        db.borrow(user_id, book_id)
+    update(db, neighbours=NEIGHBOURS)
+
+    db.borrow(4, 10)
+    db.borrow(4, 11)
+    update(db, neighbours=NEIGHBOURS)
+
+    expected = rebuilt_copy(db)
+    for pair, score in expected.neighbours.items():
+        if pair[0] in (10, 11):
+            assert db.neighbours[pair] == pytest.approx(score)
+    assert db.neighbours[(10, 11)] == pytest.approx(2 / math.sqrt(3 * 3))
+
+
+def test_repeat_borrows_do_not_change_counts():
+    db = FakeDatabase()
+    db.borrow(1, 10)
+    db.borrow(1, 11)
+    update(db, neighbours=NEIGHBOURS)
+    counts = (dict(db.borrowers), dict(db.co_borrows))
+
+    db.borrow(1, 10)
+    update(db, neighbours=NEIGHBOURS)
+    assert (db.borrowers, db.co_borrows) == counts
+    assert db.watermark == 3
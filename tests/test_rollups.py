@@ -0,0 +1,113 @@
+import datetime
+import random
+
+import pytest
+
+from rollups import DAY, MONTH, fetch_total, fetch_trend, split_range
+
+D = datetime.date
+
+
+def days_of(pieces):
+    days = []
+    for grain, first, last in pieces:
+        if grain == MONTH:
+            # Month pieces must cover whole months
+            assert first.day == 1
+            assert (last + datetime.timedelta(days=1)).day == 1
+        day = first
+        while day <= last:
+            days.append(day)
+            day += datetime.timedelta(days=1)
+    return days
+
+
+@pytest.mark.parametrize("start, end, expected", [
+    (D(2024, 3, 5), D(2024, 3, 20), [(DAY, D(2024, 3, 5), D(2024, 3, 20))]),
+    (D(2024, 3, 1), D(2024, 3, 31), [(MONTH, D(2024, 3, 1), D(2024, 3, 31))]),
+    (D(2024, 1, 31), D(2024, 2, 1), [(DAY, D(2024, 1, 31), D(2024, 2, 1))]),
+    (D(2024, 2, 1), D(2024, 2, 29), [(MONTH, D(2024, 2, 1), D(2024, 2, 29))]),
+    (D(2023, 2, 1), D(2023, 2, 28), [(MONTH, D(2023, 2, 1), D(2023, 2, 28))]),
+    (D(2024, 1, 15), D(2024, 3, 10), [(DAY, D(2024, 1, 15), D(2024, 1, 31)),
+                                      (MONTH, D(2024, 2, 1), D(2024, 2, 29)),
+                                      (DAY, D(2024, 3, 1), D(2024, 3, 10))]),
+    (D(2023, 12, 15), D(2024, 1, 10), [(DAY, D(2023, 12, 15), D(2024, 1, 10))]),
+    (D(2023, 11, 20), D(2024, 2, 5), [(DAY, D(2023, 11, 20), D(2023, 11, 30)),
+                                      (MONTH, D(2023, 12, 1), D(2024, 1, 31)),
+                                      (DAY, D(2024, 2, 1), D(2024, 2, 5))]),
+    (D(2023, 12, 1), D(2023, 12, 31), [(MONTH, D(2023, 12, 1), D(2023, 12, 31))]),
+    (D(2023, 12, 31), D(2023, 12, 31), [(DAY, D(2023, 12, 31), D(2023, 12, 31))]),
+])
+def test_split_range_at_month_and_year_boundaries(start, end, expected):
+    assert split_range(start, end) == expected
+
+
+def test_split_range_covers_every_day_exactly_once():
+    rng = random.Random(20)
+    for _ in range(500):
+        start = D(2022, 11, 1) + datetime.timedelta(days=rng.randrange(500))
+        end = start + datetime.timedelta(days=rng.randrange(450))
+        pieces = split_range(start, end)
+        assert days_of(pieces) == days_of([(DAY, start, end)])
+        assert sum(grain == MONTH for grain, _, _ in pieces) <= 1
+
+
+class FakeCursor:
+    """Answers the rollup reads from {(grain, periodStart): loans} for the 'total' dimension."""
+
+    def __init__(self, rollups):
+        self.rollups = rollups
+        self.rows = []
+
+    def execute(self, sql, params=()):
+        sql = ' '.join(sql.split())
+        if sql.startswith("SELECT periodStart, loans FROM Loan_Rollups"):
+            _, _, grain, first, last = params
+            self.rows = [(period, loans) for (row_grain, period), loans in self.rollups.items()
+                         if row_grain == grain and first <= period <= last]
+        elif sql.startswith("SELECT COALESCE(SUM(loans), 0) FROM Loan_Rollups"):
+            pieces = [params[i:i + 3] for i in range(0, len(params), 3)]
+            self.rows = [(sum(loans for (grain, period), loans in self.rollups.items()
+                              if any(grain == g and first <= period <= last for g, first, last in pieces)),)]
+        else:
+            raise AssertionError(f"Unexpected statement: {sql}")
+
+    def fetchone(self):
+        return self.rows[0]
+
+    def fetchall(self):
+        return self.rows
+
+
+def rollups_for(daily_loans):
+    # Both grains, as aggregate writes them
+    rollups = {}
+    for day, loans in daily_loans.items():
+        rollups[(DAY, day)] = rollups.get((DAY, day), 0) + loans
+        month = day.replace(day=1)
+        rollups[(MONTH, month)] = rollups.get((MONTH, month), 0) + loans
+    return rollups
+
+
+def test_fetch_trend_by_day_fills_gaps_across_year_end():
+    cur = FakeCursor(rollups_for({D(2023, 12, 30): 2, D(2024, 1, 2): 5}))
+    trend = fetch_trend(cur, D(2023, 12, 29), D(2024, 1, 2))
+    assert trend == [(D(2023, 12, 29), 0), (D(2023, 12, 30), 2), (D(2023, 12, 31), 0),
+                     (D(2024, 1, 1), 0), (D(2024, 1, 2), 5)]
+
+
+def test_fetch_trend_by_month_includes_the_partial_first_month():
+    cur = FakeCursor(rollups_for({D(2023, 11, 3): 1, D(2023, 11, 20): 4, D(2024, 2, 29): 3}))
+    trend = fetch_trend(cur, D(2023, 11, 15), D(2024, 2, 10), grain=MONTH)
+    assert trend == [(D(2023, 11, 1), 5), (D(2023, 12, 1), 0), (D(2024, 1, 1), 0), (D(2024, 2, 1), 3)]
+
+
+def test_total_from_mixed_grains_matches_daily_sum():
+    rng = random.Random(21)
+    daily = {D(2023, 10, 1) + datetime.timedelta(days=i): rng.randrange(5) for i in range(200)}
+    cur = FakeCursor(rollups_for(daily))
+    for _ in range(100):
+        start = D(2023, 10, 1) + datetime.timedelta(days=rng.randrange(200))
+        end = start + datetime.timedelta(days=rng.randrange(120))
+        expected = sum(loans for day, loans in daily.items() if start <= day <= end)
+        assert fetch_total(cur, start, end) == expected
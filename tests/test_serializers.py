@@ -0,0 +1,83 @@
+import datetime
+import decimal
+import json
+
+import pytest
+from werkzeug.datastructures import MIMEAccept
+
+import serializers
+from serializers import ARROW, COLUMNAR_JSON, JSON, MSGPACK, Table, negotiate_format, render
+
+ROWS = [
+    (1, 'Dune', datetime.date(1965, 8, 1), decimal.Decimal('12.50'), None),
+    (2, 'Émile', datetime.datetime(2020, 1, 2, 3, 4, 5), decimal.Decimal('0'), b'raw')
+]
+COLUMNS = ('bookID', 'title', 'published', 'price', 'note')
+
+
+@pytest.fixture
+def table():
+    return Table(COLUMNS, ROWS)
+
+
+def test_json_is_one_object_per_row(table):
+    body = json.loads(render(table, JSON))
+    assert body == [
+        {"bookID": 1, "title": "Dune", "published": "1965-08-01", "price": "12.50", "note": None},
+        {"bookID": 2, "title": "Émile", "published": "2020-01-02T03:04:05", "price": "0", "note": "raw"}
+    ]
+
+
+def test_json_body_overrides_default_shape(table):
+    body = json.loads(render(table, JSON, lambda: {"books": table.records(), "next_after": 2}))
+    assert body["next_after"] == 2
+    assert [book["bookID"] for book in body["books"]] == [1, 2]
+
+
+def test_columnar_json_round_trip(table):
+    body = json.loads(render(table, COLUMNAR_JSON, extra={"next_after": None}))
+    assert body["columns"] == list(COLUMNS)
+    assert body["rows"][0] == [1, "Dune", "1965-08-01", "12.50", None]
+    assert body["next_after"] is None
+    assert Table(body["columns"], body["rows"]).column('title') == ['Dune', 'Émile']
+
+
+def test_stdlib_json_matches_orjson(table, monkeypatch):
+    expected = json.loads(render(table, COLUMNAR_JSON))
+    monkeypatch.setattr(serializers, 'orjson', None)
+    assert json.loads(render(table, COLUMNAR_JSON)) == expected
+
+
+def test_msgpack_round_trip(table):
+    msgpack = pytest.importorskip('msgpack')
+    if MSGPACK not in serializers.available_formats():
+        pytest.skip("serializers was imported without msgpack")
+    body = msgpack.unpackb(render(table, MSGPACK, extra={"next_after": 2}), raw=False)
+    assert body["columns"] == list(COLUMNS)
+    assert body["rows"][1] == [2, "Émile", "2020-01-02T03:04:05", "0", b"raw"]
+    assert body["next_after"] == 2
+
+
+def test_arrow_round_trip():
+    pyarrow = pytest.importorskip('pyarrow')
+    if ARROW not in serializers.available_formats():
+        pytest.skip("serializers was imported without pyarrow")
+    table = Table(('bookID', 'title'), [(1, 'Dune'), (2, None)])
+    reader = pyarrow.ipc.open_stream(render(table, ARROW, extra={"next_after": 2}))
+    result = reader.read_all()
+    assert result.column('bookID').to_pylist() == [1, 2]
+    assert result.column('title').to_pylist() == ['Dune', None]
+    assert json.loads(result.schema.metadata[b'next_after']) == 2
+
+
+def test_negotiation_defaults_to_json():
+    assert negotiate_format(MIMEAccept([])) == JSON
+    assert negotiate_format(MIMEAccept([('*/*', 1)])) == JSON
+    assert negotiate_format(MIMEAccept([(COLUMNAR_JSON, 1), (JSON, 0.5)])) == COLUMNAR_JSON
+    # Nothing acceptable on offer: fall back to the default
+    assert negotiate_format(MIMEAccept([('text/csv', 1)])) == JSON
+
+
+def test_unknown_format_is_rejected(table):
+    with pytest.raises(ValueError):
+        render(table, 'text/csv')
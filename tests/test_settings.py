@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+from settings import ConfigError, Settings
+
+DEFAULTS = {'size': 10, 'timeout': 5.0, 'enabled': False, 'host': 'localhost'}
+
+
+def settings_with(tmp_path, file_values=None, **environ):
+    path = None
+    if file_values is not None:
+        path = tmp_path / 'library.json'
+        path.write_text(json.dumps({'pool': file_values}))
+    return Settings(str(path) if path else None, environ)
+
+
+def test_environment_values_take_the_type_of_the_default(tmp_path):
+    settings = settings_with(tmp_path, LIBRARY_POOL_SIZE='20', LIBRARY_POOL_TIMEOUT='0.5',
+                             LIBRARY_POOL_ENABLED='yes')
+    assert settings.section('pool', DEFAULTS) == {'size': 20, 'timeout': 0.5, 'enabled': True, 'host': 'localhost'}
+
+
+@pytest.mark.parametrize("raw", ['2.5', '2.0', 'ten'])
+def test_int_setting_rejects_non_integer_environment_value(tmp_path, raw):
+    settings = settings_with(tmp_path, LIBRARY_POOL_SIZE=raw)
+    with pytest.raises(ConfigError, match="LIBRARY_POOL_SIZE"):
+        settings.section('pool', DEFAULTS)
+    with pytest.raises(ConfigError):
+        settings.value('pool', 'size', 10)
+
+
+def test_int_setting_rejects_fractional_file_value(tmp_path):
+    settings = settings_with(tmp_path, {'size': 2.5})
+    with pytest.raises(ConfigError, match=r"pool\.size"):
+        settings.section('pool', DEFAULTS)
+
+
+def test_file_values_keep_whole_floats_for_int_settings(tmp_path):
+    settings = settings_with(tmp_path, {'size': 20.0, 'timeout': 2})
+    values = settings.section('pool', DEFAULTS)
+    assert values['size'] == 20 and isinstance(values['size'], int)
+    assert values['timeout'] == 2
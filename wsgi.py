@@ -0,0 +1,45 @@
+"""
+Application factory and WSGI entry point.
+
+The application file is not importable by name, so create_app() loads it by path. Every
+call loads a fresh copy with its own connection pools, caches and background threads,
+configured from config_file (or the LIBRARY_CONFIG file) and the environment as
+described in settings.py, and warms it up before returning the Flask app.
+
+    python server.py --workers 8                       # pre-forked production server
+    gunicorn -w 1 --threads 10 'wsgi:create_app()'     # or any WSGI server, one process
+    flask --app wsgi:create_app migrate                # CLI commands against the same config
+
+Run several processes through server.py only. It checks that the cache and the carts
+are shared between workers (see server.shared_state_problems) and starts the background
+jobs in one worker. Every app that create_app() loads starts them, as configured by
+worker_config, and nothing here checks the cache or cart settings.
+"""
+import importlib.util
+import os
+import sys
+
+from settings import CONFIG_ENV
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(REPO_ROOT, 'Complete_Application(submit).py')
+
+
+def load_app_module(config_file=None):
+    """Loads a new instance of the application module without warming it up."""
+    if config_file:
+        # Read by Settings() when the module runs
+        os.environ[CONFIG_ENV] = os.path.abspath(config_file)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    spec = importlib.util.spec_from_file_location('library_app', APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def create_app(config_file=None, warm=True):
+    module = load_app_module(config_file)
+    if warm:
+        module.warm_up()
+    return module.app